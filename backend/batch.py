@@ -0,0 +1,195 @@
+# backend/batch.py
+"""
+Batch jobs: many videos / long screenshots submitted in one request.
+
+The API saves the uploaded files (expanding ZIP archives safely), turns
+every supported file into an ordinary child session and runs the children
+through the usual ``video`` / ``long_image`` pipelines, at most
+BATCH_MAX_PARALLEL_ITEMS at a time.  This module holds the parts that do
+not need the web app: classifying and unpacking uploads, and
+``BatchProgress``, which folds the children's status events into per-item
+and aggregate progress for the parent "batch" session.
+"""
+import os
+import shutil
+import threading
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import Any, Dict, List, Optional, Tuple
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".m4v", ".avi", ".mkv", ".webm", ".flv", ".wmv", ".3gp"}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff"}
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+# Items of one batch running (or queued for workers) at the same time
+BATCH_MAX_PARALLEL_ITEMS = int(os.getenv("BATCH_MAX_PARALLEL_ITEMS", str(max(1, min(4, (os.cpu_count() or 2) // 2)))))
+BATCH_MAX_UNZIPPED_BYTES = int(float(os.getenv("BATCH_MAX_UNZIPPED_GB", "20")) * 1024 ** 3)  # Guards against ZIP bombs
+
+ITEM_TERMINAL_STATUSES = ("completed", "completed_no_pdf", "error", "cancelled", "interrupted")
+
+# Share of an item's progress covered by each pipeline status: status -> (start, end) percent
+STAGE_RANGES: Dict[str, Dict[str, Tuple[int, int]]] = {
+    "video": {
+        "extracting_frames": (0, 20), "frames_extracted": (20, 20),
+        "ocr_processing": (20, 80), "ocr_completed": (80, 80),
+        "pdf_generating": (80, 100),
+    },
+    "long_image": {
+        "slicing": (0, 60), "longImageProcessing": (0, 60),
+        "slicing_complete": (60, 60), "preview_ready": (60, 60),
+        "pdf_generating": (60, 100), "pdfGenerating": (60, 100),
+    },
+}
+
+
+def classify_file(name: str) -> Optional[str]:
+    """Returns 'video', 'long_image' or None for an unsupported file name."""
+    suffix = Path(name).suffix.lower()
+    if suffix in VIDEO_EXTENSIONS:
+        return "video"
+    if suffix in IMAGE_EXTENSIONS:
+        return "long_image"
+    return None
+
+
+def _is_ignored_member(parts: Tuple[str, ...]) -> bool:
+    return any(part.startswith(".") or part == "__MACOSX" for part in parts)
+
+
+def expand_zip(zip_path: Path, dest_dir: Path) -> Tuple[List[Path], List[str]]:
+    """
+    Extracts the supported files of a ZIP archive into dest_dir.
+
+    Entries with absolute paths or '..' components are refused, hidden files
+    and macOS resource forks are ignored. Returns (extracted files in archive
+    order, names of skipped entries).
+    """
+    extracted: List[Path] = []
+    skipped: List[str] = []
+    total_bytes = 0
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(zip_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            member = PurePosixPath(info.filename.replace("\\", "/"))
+            if member.is_absolute() or ".." in member.parts or _is_ignored_member(member.parts):
+                skipped.append(info.filename)
+                continue
+            if classify_file(member.name) is None:
+                skipped.append(info.filename)
+                continue
+            total_bytes += info.file_size
+            if total_bytes > BATCH_MAX_UNZIPPED_BYTES:
+                raise ValueError("ZIP 解压后超过大小上限。")
+            # Flatten into one directory; the index keeps equal names from different folders apart
+            target = dest_dir / f"{len(extracted):04d}_{member.name}"
+            with archive.open(info) as source, open(target, "wb") as out:
+                shutil.copyfileobj(source, out)
+            extracted.append(target)
+    return extracted, skipped
+
+
+def display_name(path: Path) -> str:
+    """Original file name of an expanded ZIP entry (drops the ordering prefix)."""
+    name = path.name
+    prefix, sep, rest = name.partition("_")
+    return rest if sep and prefix.isdigit() and len(prefix) == 4 else name
+
+
+class BatchProgress:
+    """
+    Per-item and aggregate progress of one batch.
+
+    ``observe`` is fed the children's status events (dicts in TaskStatus
+    form) from the connection manager's flush and may be called from any
+    thread; ``snapshot`` returns the structure sent as the batch session's
+    TaskStatus.details.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], combined_pdf: bool = False):
+        self._lock = threading.Lock()
+        self.combined_pdf = combined_pdf
+        self.combined_progress = 0  # Progress of the combined PDF stage
+        self.items: List[Dict[str, Any]] = [
+            {"index": item["index"], "filename": item["filename"], "kind": item["kind"],
+             "session_id": item["session_id"], "status": "queued", "progress": 0,
+             "message": None, "result_url": None}
+            for item in items
+        ]
+        self._by_session = {item["session_id"]: item for item in self.items}
+        self.version = 0  # Bumped on every change so callers publish only when something moved
+
+    def observe(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            item = self._by_session.get(event.get("session_id"))
+            if item is None:
+                return
+            status = event.get("status")
+            if status in ITEM_TERMINAL_STATUSES:  # Also refines a finish() taken from the session store
+                self._finish(item, status, event.get("message"), event.get("result_url"))
+                return
+            if item["status"] in ITEM_TERMINAL_STATUSES:
+                return
+            stage = STAGE_RANGES.get(item["kind"], {}).get(status)
+            if stage is None:
+                return
+            start, end = stage
+            fraction = (event.get("progress") or 0) / 100 if start != end else 0
+            item["status"] = "running"
+            item["progress"] = max(item["progress"], int(start + (end - start) * fraction))
+            self.version += 1
+
+    def _finish(self, item: Dict[str, Any], status: str, message: Optional[str], result_url: Optional[str]):
+        item.update(status=status, message=message or item["message"])
+        if status != "cancelled":
+            item["progress"] = 100
+        if result_url:
+            item["result_url"] = result_url
+        self.version += 1
+
+    def finish(self, session_id: str, status: str, message: Optional[str] = None,
+               result_url: Optional[str] = None) -> None:
+        """Marks an item terminal from the session store (covers events that were never observed)."""
+        with self._lock:
+            item = self._by_session.get(session_id)
+            if item is not None and item["status"] not in ITEM_TERMINAL_STATUSES:
+                self._finish(item, status, message or item["message"], result_url)
+
+    def set_combined_progress(self, progress: int) -> None:
+        with self._lock:
+            self.combined_progress = progress
+            self.version += 1
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return self._counts()
+
+    def _counts(self) -> Dict[str, int]:
+        counts = {"total": len(self.items), "succeeded": 0, "failed": 0, "cancelled": 0, "running": 0}
+        for item in self.items:
+            if item["status"] in ("completed", "completed_no_pdf"):
+                counts["succeeded"] += 1
+            elif item["status"] in ("error", "interrupted"):
+                counts["failed"] += 1
+            elif item["status"] == "cancelled":
+                counts["cancelled"] += 1
+            elif item["status"] == "running":
+                counts["running"] += 1
+        return counts
+
+    def overall_progress(self) -> int:
+        with self._lock:
+            return self._overall_progress()
+
+    def _overall_progress(self) -> int:
+        if not self.items:
+            return 100
+        items_progress = sum(item["progress"] for item in self.items) / len(self.items)
+        if self.combined_pdf:  # The combined PDF is the last tenth
+            return int(items_progress * 0.9 + self.combined_progress * 0.1)
+        return int(items_progress)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"items": [dict(item) for item in self.items], **self._counts(),
+                    "progress": self._overall_progress()}
@@ -0,0 +1,358 @@
+# backend/cli.py
+"""
+Headless bulk processing of a directory of videos and long screenshots.
+
+    python -m backend.cli INPUT_DIR [-o OUTPUT_DIR] [--jobs N] [--recursive]
+                          [--frame-interval 1.0] [--ocr-profile fast] [--force] ...
+
+Runs the same building blocks as the web app (``extract_frames_ffmpeg_sync``
+-> ``OcrFilter`` -> ``PdfGenerator`` for videos, ``slice_image_sync`` ->
+``PdfGenerator`` for long screenshots) without HTTP, WebSockets or the
+session store.  Files are processed in a pool of worker processes, each of
+which loads its own OCR engine once and reuses it for every video it gets;
+the CPU inference and slice encoding threads are divided between the
+workers so the pool does not oversubscribe the machine.  Larger inputs are
+submitted first so one long video does not end up running alone at the end.
+
+Every input produces ``OUTPUT_DIR/<relative path>.pdf``, keeping the source
+extension (``chats/a.mp4`` -> ``chats/a.mp4.pdf``) so inputs that differ only
+in their extension get separate PDFs.  A state file in the
+output directory remembers the size, modification time and settings each
+PDF was built from; inputs whose PDF is still current are skipped unless
+``--force`` is given.  A JSON run report (per-file status, stage timings,
+frame/slice counts) is written to ``OUTPUT_DIR/report.json`` or ``--report``.
+The exit status is 1 if any file failed.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from backend import core_workers, ocr_backends
+from backend.batch import classify_file
+from backend.exclusion import ExclusionMatcher
+from backend.core_workers import (
+    OcrFilter, PdfGenerator, detect_video_content_region_sync, extract_frames_ffmpeg_sync, slice_image_sync
+)
+from backend.frame_store import FRAME_STORE_FILENAME, FrameStore
+from backend.models import LongImageProcessSettings, ProcessSettings
+
+STATE_FILENAME = ".chat_evidence_cli_state.json"
+REPORT_FILENAME = "report.json"
+DEFAULT_JOBS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+# Per worker process, set by _init_worker
+_worker_threads = 1
+_worker_verbose = False
+
+
+def _init_worker(ocr_profile: str, ocr_backend: str, threads: int, warm_up: bool, verbose: bool):
+    """Pool initializer: sizes the thread pools for this process and loads the OCR model once."""
+    global _worker_threads, _worker_verbose
+    _worker_threads = threads
+    _worker_verbose = verbose
+    core_workers.OCR_CPU_THREADS = threads  # Both read when the engine is built
+    ocr_backends.OCR_BACKEND = ocr_backend
+    if warm_up:
+        core_workers.warm_up_ocr_engine(ocr_profile)
+
+
+def _log_callback(name: str) -> Callable[..., None]:
+    def log(message: str, level: str = "info"):
+        if _worker_verbose or level == "warn":
+            print(f"[{name}] {message}", flush=True)
+    return log
+
+
+def _timed(stages: Dict[str, float], stage: str, func: Callable[[], Any]) -> Any:
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        stages[stage] = round(time.perf_counter() - start, 3)
+
+
+def _process_video(task: Dict[str, Any], work_dir: Path, tmp_pdf: Path, result: Dict[str, Any]):
+    settings = ProcessSettings(**task["settings"])
+    video_path = task["input"]
+    log_cb = _log_callback(task["name"])
+    stages = result["stages"]
+    frames_dir = work_dir / "raw_frames"
+    frame_store_path = str(work_dir / FRAME_STORE_FILENAME) if settings.use_frame_store else None
+
+    success, message, frame_count = _timed(stages, "extract", lambda: extract_frames_ffmpeg_sync(
+        video_path, str(frames_dir), settings.frame_interval_seconds, log_cb, None, frame_store_path))
+    if not success:
+        raise RuntimeError(f"帧提取失败: {message}")
+    result["frames"] = frame_count
+
+    analysis_rect = settings.ocr_analysis_rect
+    if analysis_rect is None and settings.auto_ocr_region:
+        region = _timed(stages, "detect_region", lambda: detect_video_content_region_sync(video_path, log_cb))
+        analysis_rect = tuple(region["rect"]) if region.get("rect") else None
+        result["ocr_analysis_rect"] = list(analysis_rect) if analysis_rect else None
+    ocr_engine = core_workers.get_ocr_engine(settings.ocr_profile)
+    if ocr_engine is None:
+        raise RuntimeError(f"OCR引擎未初始化: {core_workers.ocr_engine_status(settings.ocr_profile)['error']}")
+
+    frame_store = FrameStore(frame_store_path) if frame_store_path else None
+    try:
+        ocr_filter = OcrFilter(
+            str(frames_dir), ocr_engine, settings.exclusion_list, analysis_rect, log_callback=log_cb,
+            frame_store=frame_store, ocr_profile=settings.ocr_profile, boundary_only=settings.boundary_ocr,
+            refine_video_path=video_path if settings.adaptive_sampling else None,
+            frame_interval_seconds=settings.frame_interval_seconds,
+            min_refine_interval_seconds=settings.min_frame_interval_seconds
+        )
+        kept = _timed(stages, "ocr_filter", ocr_filter.run_filter)
+        result["kept"] = len(kept)
+        result["refined_frames"] = ocr_filter.refined_frame_count
+        if not kept:
+            raise RuntimeError("没有保留的图片，无法生成PDF。")
+        pdf_generator = PdfGenerator(kept, str(tmp_pdf), settings.pdf_cols, settings.pdf_rows,
+                                     layout=settings.pdf_layout, page_title=settings.pdf_title,
+                                     log_callback=log_cb, frame_store=frame_store)
+        success, message = _timed(stages, "pdf", pdf_generator.generate_pdf)
+        if not success:
+            raise RuntimeError(f"PDF生成失败: {message}")
+    finally:
+        if frame_store:
+            frame_store.close()
+
+
+def _process_long_image(task: Dict[str, Any], work_dir: Path, tmp_pdf: Path, result: Dict[str, Any]):
+    settings = LongImageProcessSettings(**task["settings"])
+    log_cb = _log_callback(task["name"])
+    stages = result["stages"]
+    slices = _timed(stages, "slice", lambda: slice_image_sync(
+        task["input"], settings.slice_height, settings.overlap, str(work_dir / "sliced_images"), log_cb, None,
+        settings.slice_format, settings.slice_png_compress_level, settings.slice_quality,
+        _worker_threads, settings.slice_mode))
+    if not slices:
+        raise RuntimeError("长截图裁剪失败或未生成图片。")
+    result["slices"] = len(slices)
+    pdf_generator = PdfGenerator(slices, str(tmp_pdf), settings.pdf_cols, settings.pdf_rows,
+                                 layout=settings.pdf_layout, page_title=settings.pdf_title, log_callback=log_cb)
+    success, message = _timed(stages, "pdf", pdf_generator.generate_pdf)
+    if not success:
+        raise RuntimeError(f"PDF生成失败: {message}")
+
+
+def process_file(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs one input in a pool worker. Never raises; failures are reported in the result."""
+    result: Dict[str, Any] = {"input": task["name"], "kind": task["kind"], "status": "ok", "stages": {},
+                              "worker_pid": os.getpid()}
+    output_pdf = Path(task["output"])
+    output_pdf.parent.mkdir(parents=True, exist_ok=True)
+    tmp_pdf = output_pdf.with_name(output_pdf.name + ".tmp")
+    work_dir = Path(tempfile.mkdtemp(prefix="chat_evidence_cli_", dir=task.get("work_dir")))
+    start = time.perf_counter()
+    try:
+        if task["kind"] == "video":
+            _process_video(task, work_dir, tmp_pdf, result)
+        else:
+            _process_long_image(task, work_dir, tmp_pdf, result)
+        tmp_pdf.replace(output_pdf)  # Only a finished PDF ever has the final name
+        result["output"] = str(output_pdf)
+        result["pdf_bytes"] = output_pdf.stat().st_size
+    except Exception as e:
+        result.update(status="failed", error=str(e))
+        tmp_pdf.unlink(missing_ok=True)
+    finally:
+        result["seconds"] = round(time.perf_counter() - start, 3)
+        if not task.get("keep_work"):
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+# --- Planning (main process) ---
+
+def find_inputs(input_dir: Path, recursive: bool) -> List[Path]:
+    pattern = "**/*" if recursive else "*"
+    return sorted(p for p in input_dir.glob(pattern)
+                  if p.is_file() and not p.name.startswith(".") and classify_file(p.name))
+
+
+def settings_fingerprint(settings: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+def input_signature(path: Path, settings: Dict[str, Any]) -> Dict[str, Any]:
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "settings": settings_fingerprint(settings)}
+
+
+def load_state(output_dir: Path) -> Dict[str, Any]:
+    try:
+        return json.loads((output_dir / STATE_FILENAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(output_dir: Path, state: Dict[str, Any]):
+    path = output_dir / STATE_FILENAME
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=1, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(path)
+
+
+def is_current(entry: Optional[Dict[str, Any]], signature: Dict[str, Any], output_pdf: Path) -> bool:
+    return bool(entry) and output_pdf.is_file() and all(entry.get(key) == value for key, value in signature.items())
+
+
+def build_settings(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    """Per-kind settings: the web app's defaults overridden by the given flags. Raises ValidationError."""
+    common = {key: value for key, value in {
+        "pdf_rows": args.pdf_rows, "pdf_cols": args.pdf_cols, "pdf_layout": args.pdf_layout,
+        "pdf_title": args.pdf_title,
+    }.items() if value is not None}
+    video = ProcessSettings(
+        frame_interval_seconds=args.frame_interval, adaptive_sampling=args.adaptive_sampling,
+        min_frame_interval_seconds=args.min_frame_interval, exclusion_list=args.exclude,
+        auto_ocr_region=args.auto_ocr_region, use_frame_store=args.frame_store,
+        ocr_profile=args.ocr_profile, boundary_ocr=args.boundary_ocr, **common
+    )
+    long_image = LongImageProcessSettings(
+        slice_height=args.slice_height, overlap=args.overlap, slice_mode=args.slice_mode,
+        slice_format=args.slice_format, **common
+    )
+    return {"video": video.dict(), "long_image": long_image.dict()}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch-convert chat recordings and long screenshots to PDF")
+    parser.add_argument("input_dir", type=Path, help="Directory with videos and long screenshots")
+    parser.add_argument("-o", "--output-dir", type=Path, help="Where the PDFs go (default: INPUT_DIR/pdf)")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS, help="Worker processes")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Also process subdirectories")
+    parser.add_argument("--force", action="store_true", help="Reprocess inputs whose PDF is already current")
+    parser.add_argument("--report", type=Path, help="Run report path (default: OUTPUT_DIR/report.json)")
+    parser.add_argument("--work-dir", help="Directory for intermediate frames/slices (default: system temp)")
+    parser.add_argument("--keep-work", action="store_true", help="Keep intermediate frames/slices")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every pipeline log line")
+    video = parser.add_argument_group("video")
+    video.add_argument("--frame-interval", type=float, default=1.0, help="Seconds between sampled frames")
+    video.add_argument("--adaptive-sampling", action="store_true", help="Refine gaps where the overlap check fails")
+    video.add_argument("--min-frame-interval", type=float, default=0.25)
+    video.add_argument("--ocr-profile", choices=sorted(core_workers.OCR_PROFILES), default=None,
+                       help="Defaults to the OCR_PROFILE environment variable")
+    video.add_argument("--ocr-backend", choices=ocr_backends.OCR_BACKENDS, default=ocr_backends.OCR_BACKEND,
+                       help="OCR engine (defaults to the OCR_BACKEND environment variable)")
+    video.add_argument("--boundary-ocr", action="store_true", help="Recognize only the head/tail lines")
+    video.add_argument("--auto-ocr-region", action="store_true", help="Detect the scrolling chat area per video")
+    video.add_argument("--frame-store", action="store_true", help="Store sampled frames in one memory-mapped file")
+    video.add_argument("--exclude", action="append", default=[], metavar="TEXT", help="Exclusion rule (repeatable): exact text, or contains:/prefix:/re: followed by the pattern")
+    image = parser.add_argument_group("long image")
+    image.add_argument("--slice-height", type=int, default=1000)
+    image.add_argument("--overlap", type=int, default=100)
+    image.add_argument("--slice-mode", choices=("fixed", "snap"), default="fixed")
+    image.add_argument("--slice-format", choices=("auto", "png", "jpeg", "webp"), default="auto")
+    pdf = parser.add_argument_group("pdf (defaults differ per kind, as in the web app)")
+    pdf.add_argument("--pdf-rows", type=int)
+    pdf.add_argument("--pdf-cols", type=int)
+    pdf.add_argument("--pdf-layout", choices=("grid", "column"))
+    pdf.add_argument("--pdf-title")
+    args = parser.parse_args(argv)
+
+    input_dir = args.input_dir.resolve()
+    if not input_dir.is_dir():
+        parser.error(f"{args.input_dir} is not a directory")
+    output_dir = (args.output_dir or input_dir / "pdf").resolve()
+    try:
+        settings = build_settings(args)
+        ExclusionMatcher(args.exclude)
+    except (ValidationError, ValueError) as e:
+        parser.error(str(e))
+    ocr_profile = core_workers.resolve_ocr_profile(args.ocr_profile)
+
+    state = load_state(output_dir)
+    results: List[Dict[str, Any]] = []
+    tasks: List[Dict[str, Any]] = []
+    for path in find_inputs(input_dir, args.recursive):
+        if output_dir in path.parents:
+            continue  # Never treat our own output directory as input
+        name = path.relative_to(input_dir).as_posix()
+        kind = classify_file(path.name)
+        # The source extension stays in the name: chat.mp4 and chat.png must not share chat.pdf
+        output_pdf = output_dir / f"{name}.pdf"
+        # Videos also depend on the OCR engine; an engine switch rebuilds them
+        signature = input_signature(path, {**settings[kind], "ocr_backend": args.ocr_backend}
+                                    if kind == "video" else settings[kind])
+        if not args.force and is_current(state.get(name), signature, output_pdf):
+            results.append({"input": name, "kind": kind, "status": "skipped", "output": str(output_pdf)})
+            continue
+        tasks.append({"name": name, "kind": kind, "input": str(path), "output": str(output_pdf),
+                      "settings": settings[kind], "signature": signature, "size": signature["size"],
+                      "work_dir": args.work_dir, "keep_work": args.keep_work})
+
+    jobs = max(1, min(args.jobs, len(tasks) or 1))
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    print(f"{len(tasks)} file(s) to process, {len(results)} up to date; {jobs} worker(s) x {threads} thread(s).")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    started = time.time()
+    if tasks:
+        tasks.sort(key=lambda task: task["size"], reverse=True)  # Longest first keeps the pool busy to the end
+        warm_up = any(task["kind"] == "video" for task in tasks)
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                       initargs=(ocr_profile, args.ocr_backend, threads, warm_up, args.verbose))
+        futures = {executor.submit(process_file, task): task for task in tasks}
+        try:
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:  # A worker process died
+                    result = {"input": task["name"], "kind": task["kind"], "status": "failed", "error": str(e)}
+                results.append(result)
+                if result["status"] == "ok":
+                    state[task["name"]] = task["signature"]
+                    save_state(output_dir, state)  # After every file, so an interrupted run resumes
+                    print(f"ok      {task['name']} ({result['seconds']:.1f}s)")
+                else:
+                    state.pop(task["name"], None)
+                    print(f"FAILED  {task['name']}: {result.get('error')}")
+        except KeyboardInterrupt:
+            print("Interrupted; finishing the report for the files done so far.")
+            executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            executor.shutdown()
+
+    failed = sum(1 for result in results if result["status"] == "failed")
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "input_dir": str(input_dir),
+        "output_dir": str(output_dir),
+        "jobs": jobs,
+        "threads_per_job": threads,
+        "ocr_profile": ocr_profile,
+        "ocr_backend": args.ocr_backend,
+        "settings": settings,
+        "totals": {
+            "files": len(results),
+            "processed": sum(1 for result in results if result["status"] == "ok"),
+            "skipped": sum(1 for result in results if result["status"] == "skipped"),
+            "failed": failed,
+            "seconds": round(time.time() - started, 3),
+        },
+        "files": sorted(results, key=lambda result: result["input"]),
+    }
+    report_path = args.report or output_dir / REPORT_FILENAME
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding="utf-8")
+    totals = report["totals"]
+    print(f"Done: {totals['processed']} processed, {totals['skipped']} skipped, {failed} failed "
+          f"in {totals['seconds']:.1f}s. Report: {report_path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,35 @@
 # backend/core_workers.py
 import os
-import glob
 import shutil
 import subprocess
 import datetime
-from typing import List, Tuple, Optional, Callable
+from typing import List, Tuple, Optional, Callable, Dict, Any
 from pathlib import Path
 import difflib
-
-from paddleocr import PaddleOCR
+import math
+import re
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Image as ReportLabImage, Spacer, PageBreak, Table, TableStyle, Paragraph
+from reportlab.platypus import SimpleDocTemplate, Image as ReportLabImage, Spacer, PageBreak, Table, TableStyle, Paragraph, Flowable
+from reportlab.lib.utils import ImageReader
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.lib import colors as reportlab_colors
 from PIL import Image as PILImage, ImageFile
 
+from backend.frame_store import FrameStore, FrameStoreWriter, PngStreamSplitter, frame_name
+from backend.exclusion import ExclusionMatcher
+from backend import ocr_backends
+from backend.ocr_backends import OcrBackend, OcrLine, create_ocr_backend, crop_box
+from backend.metrics import FRAMES_TOTAL, OCR_BOXES_TOTAL, OCR_CALL_SECONDS, PDF_IMAGES_TOTAL, PDF_OUTPUT_BYTES
+from backend.tracing import NULL_TRACER, NullTracer
+
 # 如果处理非常长的截图，增加 PIL 允许的最大图像像素
 ImageFile.LOAD_TRUNCATED_IMAGES = True  # 允许加载可能被截断的图像
 # 您可能需要根据预期的截图尺寸和系统内存调整 MAX_IMAGE_PIXELS
@@ -28,38 +42,239 @@ FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")  # 允许通过环境变量覆
 OVERLAP_CHECK_TAIL_LINES = 2  # OCR筛选时，用于比较的上一张保留帧的尾部行数
 OVERLAP_CHECK_HEAD_LINES = 2  # OCR筛选时，用于比较的当前帧的头部行数
 REFERENCE_FRAME_INDEX = 0  # 用于提取参考帧的帧索引
+# 方向检测：录屏内画面方向不变，只在开头检测一次，之后各帧预先旋转并跳过方向分类器
+ORIENTATION_ACCEPT_CONFIDENCE = 0.85  # 原方向识别的平均置信度达到该值时，不再尝试其他旋转角度
+ORIENTATION_PROBE_FRAMES = 3  # 开头连续无文字时最多尝试检测的帧数，之后按原方向处理
+ORIENTATION_RECHECK_CONFIDENCE = 0.6  # 单帧平均置信度低于该值时，使用方向分类器重新识别该帧
+ORIENTATION_RECHECK_FRAMES = 3  # 连续该数量的低置信度帧后，重新检测整体方向
+# 聊天内容区域自动检测：滚动的聊天内容随时间变化，状态栏、标题栏、输入框等保持不变
+ROI_SAMPLE_FRAMES = 12  # 在视频中均匀采样的帧数
+ROI_ANALYSIS_MAX_SIDE = 640  # 分析前将帧按步长降采样到的最长边 (像素)
+ROI_PIXEL_STD_THRESHOLD = 6.0  # 像素灰度的时间标准差超过该值时视为变化
+ROI_ACTIVE_LINE_RATIO = 0.02  # 一行 (列) 中变化像素的比例超过该值时视为内容区域
+ROI_GAP_RATIO = 0.05  # 内容区域中允许的不活跃行间隙 (相对于帧高)
+ROI_MIN_HEIGHT_RATIO = 0.2  # 检测到的区域低于该高度比例时认为视频没有滚动内容
+ROI_PADDING = 4  # 检测结果向外扩展的像素数
+ADAPTIVE_MIN_INTERVAL_SECONDS = 0.25  # 自适应采样中二分补抽帧的最小时间间隔
+# 长图切片编码线程数，默认按 CPU 核数（最多 8 个）
+SLICE_ENCODE_WORKERS = int(os.getenv("SLICE_ENCODE_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+SLICE_PNG_COMPRESS_LEVEL = 6  # 切片 PNG 默认压缩级别 (与 Pillow 默认一致)
+SLICE_QUALITY = 90  # 切片 JPEG/WEBP 默认编码质量
+SNAP_BLANK_ROW_TOLERANCE = 6  # 行内灰度极差不超过该值时视为空白行
+SNAP_SEARCH_RATIO = 0.3  # 在切片底部该比例的高度范围内寻找空白行
+SNAP_ANALYSIS_CHUNK_ROWS = 2048  # 行分析时每次转换为灰度的行数
+SNAP_BASELINE_OVERLAP = 100  # 统计节省量时，固定切割默认使用的重叠高度
+REGION_THUMBNAIL_WIDTH = 360  # 源图嵌入模式下切片预览图的宽度 (像素)
+# 多张截图拼接：按行哈希对齐相邻截图，去掉重复的重叠部分
+STITCH_QUANT_SHIFT = 2  # 计算行哈希前像素值右移的位数，吸收轻微的编码噪声
+STITCH_MIN_OVERLAP_ROWS = 16  # 认定重叠所需的最少非空白行数
+STITCH_MIN_MATCH_RATIO = 0.9  # 重叠部分非空白行哈希一致的最低比例
+STITCH_OFFSET_CANDIDATES = 5  # 按投票数依次验证的候选偏移数
+STITCH_HASH_CHUNK_ROWS = 256  # 计算行哈希时每次处理的行数
+STITCH_PROFILE_BINS = 32  # 近似匹配 (JPEG 等有损截图) 时每行灰度轮廓的分段数
+STITCH_MAX_PROFILE_DIFF = 4.0  # 近似匹配时重叠行灰度轮廓差异 (中位数) 的上限
+PDF_SOURCE_TILE_HEIGHT = 2048  # 源图嵌入 PDF 时每个图块 (XObject) 的高度 (像素)
+OCR_DEVICE = os.getenv("OCR_DEVICE", "auto").lower()  # 'auto' (检测 CUDA)、'cpu' 或 'gpu'
+OCR_PROFILE = os.getenv("OCR_PROFILE", "balanced").lower()  # 未在任务中指定时使用的 OCR 速度档位
+OCR_CPU_THREADS = int(os.getenv("OCR_CPU_THREADS", str(min(os.cpu_count() or 4, 10))))  # CPU 推理线程数
+
+# OCR 速度档位 -> OCR 引擎参数 (PaddleOCR 构造参数；ONNX 引擎使用其中的检测尺寸、方向分类与批大小)。
+# 筛选只依赖每帧首尾几行文字，因此 'fast' 用较小的检测输入和更轻的模型换取吞吐量。
+# enable_mkldnn / cpu_threads 只在 CPU 推理时生效。
+OCR_PROFILES: Dict[str, Dict[str, Any]] = {
+    "fast": {"ocr_version": "PP-OCRv3", "det_limit_side_len": 640, "use_angle_cls": False,
+             "enable_mkldnn": True, "rec_batch_num": 16},
+    "balanced": {"det_limit_side_len": 960, "use_angle_cls": True, "enable_mkldnn": True, "rec_batch_num": 8},
+    "accurate": {"det_limit_side_len": 1600, "use_angle_cls": True, "enable_mkldnn": False, "rec_batch_num": 6},
+}
+if OCR_PROFILE not in OCR_PROFILES:
+    print(f"⚠️ 未知的 OCR_PROFILE '{OCR_PROFILE}'，改用 'balanced'。")
+    OCR_PROFILE = "balanced"
+
+# --- 日志级别 ---
+# log_callback 的第二个参数，客户端可按级别过滤。逐帧/逐图的详细日志使用 debug。
+LOG_DEBUG = "debug"
+LOG_INFO = "info"
+LOG_WARN = "warn"
+
+
+# --- 任务取消 ---
+class JobCancelledError(Exception):
+    """任务被用户取消。"""
+
+
+class CancelToken:
+    """
+    线程安全的取消信号。
+
+    工作代码可以注册取消时要执行的回调 (例如终止 FFmpeg 进程、调用
+    OcrFilter.stop)，长循环可调用 raise_if_cancelled() 主动检查。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """发出取消信号并执行所有已注册的回调。"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"执行取消回调失败: {e}")
+
+    def register(self, callback: Callable[[], None]):
+        """注册取消回调；如果已经取消，则立即执行。"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def unregister(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise JobCancelledError("任务已取消。")
+
+# --- 全局 OCR 引擎 (延迟初始化) ---
+# 导入本模块不会加载模型；首次调用 get_ocr_engine() 时才构建 OCR_BACKEND 选择的引擎，
+# 因此只需要 FFmpeg 或切片功能的进程 (测试、命令行、worker) 启动很快。
+# 每个速度档位对应一个独立的引擎实例，按需加载后缓存。
+OCR_STATE_NOT_LOADED = "not_loaded"
+OCR_STATE_LOADING = "loading"
+OCR_STATE_READY = "ready"
+OCR_STATE_FAILED = "failed"
+
+_ocr_engines: Dict[str, Any] = {}
+_ocr_engine_lock = threading.Lock()
+_ocr_status: Dict[str, Dict[str, Any]] = {
+    name: {"state": OCR_STATE_NOT_LOADED, "backend": None, "device": None, "load_seconds": None,
+           "warmed_up": False, "warmup_seconds": None, "error": None}
+    for name in OCR_PROFILES
+}
+
+
+def resolve_ocr_profile(profile: Optional[str] = None) -> str:
+    """返回有效的档位名称 (未指定时使用 OCR_PROFILE)；未知档位抛出 ValueError。"""
+    name = (profile or OCR_PROFILE).lower()
+    if name not in OCR_PROFILES:
+        raise ValueError(f"未知的 OCR 速度档位: {profile}，可选: {', '.join(OCR_PROFILES)}")
+    return name
+
+
+def detect_ocr_use_gpu() -> bool:
+    """根据 OCR_DEVICE 决定是否使用 GPU；'auto' 时仅在 Paddle 编译了 CUDA 且检测到显卡时使用。"""
+    if OCR_DEVICE in ("cpu", "gpu"):
+        return OCR_DEVICE == "gpu"
+    try:
+        import paddle
+        return bool(paddle.device.is_compiled_with_cuda() and paddle.device.cuda.device_count() > 0)
+    except Exception:
+        return False
+
+
+def get_ocr_engine(profile: Optional[str] = None) -> Optional[OcrBackend]:
+    """
+    返回指定档位的共享 OCR 引擎 (OCR_BACKEND 选择的 OcrBackend)，首次调用时构建 (线程安全)。
+    初始化失败时返回 None (不再重试)，原因见 ocr_engine_status()。
+    """
+    profile = resolve_ocr_profile(profile)
+    status = _ocr_status[profile]
+    if profile in _ocr_engines or status["state"] == OCR_STATE_FAILED:
+        return _ocr_engines.get(profile)
+    with _ocr_engine_lock:
+        if profile in _ocr_engines or status["state"] == OCR_STATE_FAILED:
+            return _ocr_engines.get(profile)
+        status["state"] = OCR_STATE_LOADING
+        start = time.perf_counter()
+        backend = ocr_backends.OCR_BACKEND
+        try:
+            use_gpu = backend == "paddle" and detect_ocr_use_gpu()  # ONNX 引擎只在 CPU 上运行
+            status.update(backend=backend, device="gpu" if use_gpu else "cpu")
+            print(f"正在初始化 OCR 引擎 {backend} (档位: {profile}, 设备: {status['device']})...")
+            _ocr_engines[profile] = create_ocr_backend(backend, OCR_PROFILES[profile], use_gpu=use_gpu,
+                                                       cpu_threads=OCR_CPU_THREADS)
+            status.update(state=OCR_STATE_READY, load_seconds=round(time.perf_counter() - start, 2))
+            print(f"✅ OCR 引擎 {backend} ({profile}) 初始化成功，耗时 {status['load_seconds']} 秒。")
+        except ImportError as e:
+            library = "onnxruntime" if backend == "onnx" else "paddleocr 或 paddlepaddle"
+            status.update(state=OCR_STATE_FAILED, error=f"未找到 {library} 库: {e}")
+            print(f"⚠️ 错误: 未找到 {library} 库。OCR 功能将被禁用。")
+        except Exception as e:
+            status.update(state=OCR_STATE_FAILED, error=str(e))
+            print(f"⚠️ 初始化 OCR 引擎 {backend} ({profile}) 时出错: {e}。OCR 功能可能不可用。")
+    return _ocr_engines.get(profile)
+
+
+def ocr_profile_uses_cls(profile: Optional[str] = None) -> bool:
+    """该档位是否对每个文本行运行方向分类器。"""
+    return bool(OCR_PROFILES[resolve_ocr_profile(profile)].get("use_angle_cls", False))
+
+
+def warm_up_ocr_engine(profile: Optional[str] = None) -> bool:
+    """加载引擎并对一张小的合成图片执行一次识别，使首个真实帧不必承担模型预热开销。"""
+    profile = resolve_ocr_profile(profile)
+    engine = get_ocr_engine(profile)
+    if engine is None:
+        return False
+    status = _ocr_status[profile]
+    if status["warmed_up"]:
+        return True
+    dummy = np.full((48, 192, 3), 255, dtype=np.uint8)
+    dummy[16:32, 16:176] = 0  # 一条深色横条，让检测与识别模型都实际运行
+    start = time.perf_counter()
+    try:
+        engine.ocr(dummy, cls=ocr_profile_uses_cls(profile))
+    except Exception as e:
+        print(f"⚠️ OCR 预热失败: {e}")
+        return False
+    status.update(warmed_up=True, warmup_seconds=round(time.perf_counter() - start, 2))
+    print(f"✅ OCR 预热完成 ({profile})，耗时 {status['warmup_seconds']} 秒。")
+    return True
+
+
+def ocr_engine_status(profile: Optional[str] = None) -> Dict[str, Any]:
+    """指定档位 (默认 OCR_PROFILE) 的 OCR 引擎当前状态 (用于就绪检查)。"""
+    profile = resolve_ocr_profile(profile)
+    return {"profile": profile, **_ocr_status[profile]}
 
-# --- 全局 OCR 引擎初始化 ---
-OCR_ENGINE = None
-try:
-    print("正在初始化 PaddleOCR 引擎...")
-    # 如果需要，可以考虑添加更具体的模型路径，或通过环境变量控制
-    OCR_ENGINE = PaddleOCR(use_angle_cls=True, show_log=False, use_gpu=True,)
-    print("✅ PaddleOCR 引擎初始化成功。")
-except ImportError:
-    print("⚠️ 错误: 未找到 paddleocr 或 paddlepaddle 库。OCR 功能将被禁用。")
-except Exception as e:
-    print(f"⚠️ 初始化 PaddleOCR 时出错: {e}。OCR 功能可能不可用。")
-    # 可选地，添加更健壮的错误处理或回退机制
 
 # --- FFmpeg 同步功能 ---
 
 
-def _run_ffmpeg_sync(cmd_list: list[str], log_callback: Optional[Callable[[str], None]] = None) -> Tuple[int, str, str]:
+def _run_ffmpeg_sync(cmd_list: list[str], log_callback: Optional[Callable[..., None]] = None,
+                     cancel_token: Optional[CancelToken] = None,
+                     tracer: NullTracer = NULL_TRACER) -> Tuple[int, str, str]:
     """
     辅助函数，用于同步运行 FFmpeg 命令，捕获其输出，并处理潜在错误。
 
     参数:
         cmd_list: 代表命令及其参数的字符串列表。
-        log_callback: 用于接收日志消息的可选函数。
+        log_callback: 用于接收日志消息的可选函数，调用方式为 (消息, 可选的日志级别)。
+        cancel_token: 可选的取消信号，取消时终止 FFmpeg 进程。
+        tracer: 可选的追踪器，记录本次 FFmpeg 调用的耗时。
 
     返回:
         一个元组，包含: (返回码, 标准输出字符串, 标准错误字符串)。
-        返回码 -1 表示 FileNotFoundError，-2 表示其他执行错误。
+        返回码 -1 表示 FileNotFoundError，-2 表示其他执行错误，-4 表示已被取消。
     """
     cmd_str = ' '.join(cmd_list)  # 用于日志记录
     if log_callback:
-        log_callback(f"正在执行同步 FFmpeg: {cmd_str}")
+        log_callback(f"正在执行同步 FFmpeg: {cmd_str}", LOG_DEBUG)
     try:
         # 在 Windows 上使用 startupinfo 来防止控制台窗口弹出
         startupinfo = None
@@ -68,21 +283,34 @@ def _run_ffmpeg_sync(cmd_list: list[str], log_callback: Optional[Callable[[str],
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
             startupinfo.wShowWindow = subprocess.SW_HIDE
 
-        process = subprocess.run(
+        process = subprocess.Popen(
             cmd_list,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             text=True,            # 将 stdout/stderr 解码为文本
             errors='ignore',      # 忽略潜在的解码错误
-            check=False,          # 不自动引发 CalledProcessError
             startupinfo=startupinfo  # 为 Windows 传递 startupinfo
         )
+        if cancel_token:
+            cancel_token.register(process.terminate)  # 取消时终止进程，communicate() 随即返回
+        try:
+            with tracer.span("ffmpeg", "ffmpeg", cmd=cmd_str) as span:
+                stdout, stderr = process.communicate()
+                span.set(returncode=process.returncode)
+        finally:
+            if cancel_token:
+                cancel_token.unregister(process.terminate)
+        if cancel_token and cancel_token.cancelled:
+            if log_callback:
+                log_callback("FFmpeg 已因任务取消而终止。")
+            return -4, stdout or "", stderr or ""
 
         # 首先记录 stderr，因为它通常包含更重要的信息/错误
-        if process.stderr and log_callback:
+        if stderr and log_callback:
             # log_callback("--- FFmpeg 标准错误输出 ---")
-            for line in process.stderr.splitlines():
+            for line in stderr.splitlines():
                 if line.strip():
-                    log_callback(f"[FFmpeg ERR]: {line.strip()}")
+                    log_callback(f"[FFmpeg ERR]: {line.strip()}", LOG_DEBUG)
             # log_callback("--- FFmpeg 标准错误输出结束 ---")
         # 如果需要，记录 stdout
         # if process.stdout and log_callback:
@@ -93,7 +321,7 @@ def _run_ffmpeg_sync(cmd_list: list[str], log_callback: Optional[Callable[[str],
 
         if log_callback:
             log_callback(f"FFmpeg 完成。返回码: {process.returncode}")
-        return process.returncode, process.stdout or "", process.stderr or ""
+        return process.returncode, stdout or "", stderr or ""
     except FileNotFoundError:
         err_msg = f"错误: FFmpeg 可执行文件 '{cmd_list[0]}' 未找到。"
         if log_callback:
@@ -111,11 +339,88 @@ def _run_ffmpeg_sync(cmd_list: list[str], log_callback: Optional[Callable[[str],
         return -3, "", str(e)  # 使用 -3 表示其他异常
 
 
+def _run_ffmpeg_to_frame_store_sync(cmd_list: list[str], store_path: str,
+                                    log_callback: Optional[Callable[..., None]] = None,
+                                    cancel_token: Optional[CancelToken] = None,
+                                    tracer: NullTracer = NULL_TRACER) -> Tuple[int, int]:
+    """
+    运行输出 PNG 流 (image2pipe) 的 FFmpeg 命令，并将每一帧追加到单文件帧存储中。
+
+    返回:
+        (返回码, 写入的帧数)。返回码含义与 _run_ffmpeg_sync 相同。
+    """
+    if log_callback:
+        log_callback(f"正在执行同步 FFmpeg (帧存储): {' '.join(cmd_list)}", LOG_DEBUG)
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+    try:
+        process = subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   startupinfo=startupinfo)
+    except FileNotFoundError:
+        if log_callback:
+            log_callback(f"错误: FFmpeg 可执行文件 '{cmd_list[0]}' 未找到。")
+        return -1, 0
+    except OSError as e:
+        if log_callback:
+            log_callback(f"运行 FFmpeg 时发生系统错误: {e}")
+        return -2, 0
+
+    # 在单独线程中读取 stderr，避免管道写满导致 FFmpeg 阻塞
+    stderr_lines: List[str] = []
+    stderr_thread = threading.Thread(
+        target=lambda: stderr_lines.extend(process.stderr.read().decode(errors='ignore').splitlines()),
+        daemon=True)
+    stderr_thread.start()
+    if cancel_token:
+        cancel_token.register(process.terminate)
+
+    splitter = PngStreamSplitter()
+    span = tracer.span("ffmpeg_frame_store", "ffmpeg", cmd=' '.join(cmd_list))
+    try:
+        with span, FrameStoreWriter(store_path) as writer:
+            while True:
+                data = process.stdout.read(1 << 20)
+                if not data:
+                    break
+                for png_bytes in splitter.feed(data):
+                    writer.append(png_bytes)
+            frame_count = len(writer)
+            process.wait()
+            span.set(returncode=process.returncode, frames=frame_count)
+    except Exception as e:
+        process.kill()
+        process.wait()
+        if log_callback:
+            log_callback(f"写入帧存储失败: {e}")
+        return -3, 0
+    finally:
+        if cancel_token:
+            cancel_token.unregister(process.terminate)
+        stderr_thread.join(timeout=5)
+
+    if cancel_token and cancel_token.cancelled:
+        if log_callback:
+            log_callback("FFmpeg 已因任务取消而终止。")
+        return -4, frame_count
+    if log_callback:
+        for line in stderr_lines:
+            if line.strip():
+                log_callback(f"[FFmpeg ERR]: {line.strip()}", LOG_DEBUG)
+        if splitter.pending_bytes:
+            log_callback(f"警告: PNG 流末尾有 {splitter.pending_bytes} 字节不完整数据被忽略。", LOG_WARN)
+        log_callback(f"FFmpeg 完成。返回码: {process.returncode}")
+    return process.returncode, frame_count
+
+
 def extract_single_frame_ffmpeg_sync(
     video_file_path: str,
     output_frame_path: str,
     frame_index: int = REFERENCE_FRAME_INDEX,  # 使用常量
-    log_callback: Optional[Callable[[str], None]] = None
+    log_callback: Optional[Callable[..., None]] = None,
+    cancel_token: Optional[CancelToken] = None
 ) -> bool:
     """
     使用 FFmpeg 同步提取单个帧。
@@ -125,6 +430,7 @@ def extract_single_frame_ffmpeg_sync(
         output_frame_path: 提取的帧PNG文件应保存的路径。
         frame_index: 要提取的帧的索引（从0开始）。
         log_callback: 可选的日志回调函数。
+        cancel_token: 可选的取消信号。
 
     返回:
         如果提取成功则为 True，否则为 False。
@@ -160,11 +466,11 @@ def extract_single_frame_ffmpeg_sync(
         str(output_frame_path_obj)        # 输出文件路径
     ]
 
-    return_code, _, stderr = _run_ffmpeg_sync(cmd, log_callback)
+    return_code, _, stderr = _run_ffmpeg_sync(cmd, log_callback, cancel_token)
 
     frame_exists = output_frame_path_obj.is_file()
     if log_callback:
-        log_callback(f"单帧提取结果 - 返回码: {return_code}, 文件存在: {frame_exists}")
+        log_callback(f"单帧提取结果 - 返回码: {return_code}, 文件存在: {frame_exists}", LOG_DEBUG)
 
     if return_code == 0 and frame_exists:
         if log_callback:
@@ -178,11 +484,40 @@ def extract_single_frame_ffmpeg_sync(
         return False
 
 
+def extract_frame_at_time_ffmpeg_sync(
+    video_file_path: str,
+    output_frame_path: str,
+    timestamp_seconds: float,
+    log_callback: Optional[Callable[..., None]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    tracer: NullTracer = NULL_TRACER
+) -> bool:
+    """
+    通过定位 (-ss 置于 -i 之前，只解码最近关键帧之后的部分) 提取指定时间点的单帧。
+
+    返回:
+        如果提取成功则为 True，否则为 False。
+    """
+    output_frame_path_obj = Path(output_frame_path)
+    cmd = [
+        FFMPEG_PATH, "-y",
+        "-ss", f"{max(0.0, timestamp_seconds):.3f}",
+        "-i", str(video_file_path),
+        "-frames:v", "1",
+        str(output_frame_path_obj)
+    ]
+    return_code, _, _ = _run_ffmpeg_sync(cmd, log_callback, cancel_token, tracer)
+    return return_code == 0 and output_frame_path_obj.is_file()
+
+
 def extract_frames_ffmpeg_sync(
     video_file_path: str,
     output_session_dir: str,
     frame_interval_seconds: float = 1.0,
-    log_callback: Optional[Callable[[str], None]] = None
+    log_callback: Optional[Callable[..., None]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    frame_store_path: Optional[str] = None,
+    tracer: NullTracer = NULL_TRACER
 ) -> Tuple[bool, str, int]:
     """
     使用 FFmpeg 按指定间隔同步提取多个帧。
@@ -192,6 +527,10 @@ def extract_frames_ffmpeg_sync(
         output_session_dir: 提取的帧PNG文件应保存的目录。
         frame_interval_seconds: 提取帧之间的时间间隔（秒）。
         log_callback: 可选的日志回调函数。
+        cancel_token: 可选的取消信号，取消时终止 FFmpeg。
+        frame_store_path: 可选的单文件帧存储路径。指定时帧不再逐个写成 PNG 文件，
+                          而是通过管道追加到该文件中 (见 backend/frame_store.py)。
+        tracer: 可选的追踪器 (见 backend/tracing.py)。
 
     返回:
         一个元组: (成功布尔值, 状态消息, 帧数量)。
@@ -216,6 +555,25 @@ def extract_frames_ffmpeg_sync(
             log_callback(msg)
         return False, msg, 0
 
+    if frame_store_path:
+        cmd = [
+            FFMPEG_PATH, '-y',
+            '-i', str(video_file_path_obj),
+            '-vf', f"fps={1 / max(0.01, frame_interval_seconds)}",
+            '-f', 'image2pipe', '-vcodec', 'png',
+            '-'
+        ]
+        return_code, frame_count = _run_ffmpeg_to_frame_store_sync(cmd, frame_store_path, log_callback, cancel_token, tracer)
+        if return_code == 0:
+            msg = f"FFmpeg 帧提取完成 (帧存储)。共提取 {frame_count} 帧。"
+            if log_callback:
+                log_callback(msg)
+            return True, msg, frame_count
+        msg = f"FFmpeg 帧提取错误 (帧存储)，返回码: {return_code}"
+        if log_callback:
+            log_callback(msg)
+        return False, msg, 0
+
     # 首先清理旧的帧文件
     deleted_count = 0
     for f in output_dir.glob("frame_*.png"):
@@ -224,7 +582,7 @@ def extract_frames_ffmpeg_sync(
             deleted_count += 1
         except OSError as e:
             if log_callback:
-                log_callback(f"警告: 无法删除旧帧 {f.name}: {e}")
+                log_callback(f"警告: 无法删除旧帧 {f.name}: {e}", LOG_WARN)
     if deleted_count > 0 and log_callback:
         log_callback(f"已清理 {deleted_count} 个旧帧文件。")
 
@@ -243,7 +601,7 @@ def extract_frames_ffmpeg_sync(
         output_pattern
     ]
 
-    return_code, _, stderr = _run_ffmpeg_sync(cmd, log_callback)
+    return_code, _, stderr = _run_ffmpeg_sync(cmd, log_callback, cancel_token, tracer)
 
     if return_code == 0:
         # 通过计算创建的文件数量来验证
@@ -260,17 +618,634 @@ def extract_frames_ffmpeg_sync(
         return False, msg, 0
 
 
+# --- 聊天内容区域自动检测 ---
+
+
+def probe_video_duration_sync(video_file_path: str) -> Optional[float]:
+    """从 FFmpeg 的输入信息中解析视频时长 (秒)，失败时返回 None。"""
+    _, _, stderr = _run_ffmpeg_sync([FFMPEG_PATH, "-hide_banner", "-i", str(video_file_path)])
+    match = re.search(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)", stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def sample_video_frames_sync(video_file_path: str, count: int = ROI_SAMPLE_FRAMES,
+                             log_callback: Optional[Callable[..., None]] = None) -> List[np.ndarray]:
+    """
+    在视频时长内均匀取 count 个时间点，各用一次快速定位 (-ss 置于 -i 之前) 解码单帧，
+    返回灰度帧数组列表。无法获取时长时取开头每秒一帧。
+    """
+    duration = probe_video_duration_sync(video_file_path)
+    if duration:
+        timestamps = [duration * (i + 0.5) / count for i in range(count)]
+    else:
+        timestamps = [float(i) for i in range(count)]
+    startupinfo = None
+    if os.name == 'nt':
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+    frames = []
+    for timestamp in timestamps:
+        cmd = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-ss", f"{timestamp:.3f}",
+               "-i", str(video_file_path), "-frames:v", "1", "-f", "image2pipe", "-vcodec", "png", "-"]
+        try:
+            completed = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, startupinfo=startupinfo)
+        except OSError as e:
+            if log_callback:
+                log_callback(f"采样帧失败: {e}", LOG_WARN)
+            break
+        if completed.returncode != 0 or not completed.stdout:
+            continue
+        with PILImage.open(io.BytesIO(completed.stdout)) as img:
+            frames.append(np.asarray(img.convert("L")))
+    if log_callback:
+        log_callback(f"已从视频中采样 {len(frames)} 帧用于区域检测。", LOG_DEBUG)
+    return frames
+
+
+def _longest_active_run(mask: np.ndarray, max_gap: int) -> Optional[Tuple[int, int]]:
+    """返回 mask 中最长的活跃区间 [start, end)，其中不超过 max_gap 的间隙视为连续。"""
+    indices = np.flatnonzero(mask)
+    if not indices.size:
+        return None
+    breaks = np.flatnonzero(np.diff(indices) > max_gap + 1)
+    starts = np.r_[indices[0], indices[breaks + 1]]
+    ends = np.r_[indices[breaks], indices[-1]] + 1
+    longest = int(np.argmax(ends - starts))
+    return int(starts[longest]), int(ends[longest])
+
+
+def detect_content_region(frames: List[np.ndarray]) -> Optional[Tuple[int, int, int, int]]:
+    """
+    根据多帧灰度图像的逐像素时间标准差找出滚动的聊天内容区域。
+
+    先按行统计变化像素比例，取最长的连续活跃行区间 (允许小间隙) 作为纵向范围，
+    再在该范围内按列统计得到横向范围。
+
+    返回:
+        (x, y, width, height)，坐标相对于原始帧；帧数不足或没有明显滚动区域时返回 None。
+    """
+    frames = [frame for frame in frames if frame.shape == frames[0].shape] if frames else []
+    if len(frames) < 2:
+        return None
+    height, width = frames[0].shape[:2]
+    step = max(1, math.ceil(max(height, width) / ROI_ANALYSIS_MAX_SIDE))
+    stack = np.stack([frame[::step, ::step] for frame in frames]).astype(np.float32)
+    moving = stack.std(axis=0) > ROI_PIXEL_STD_THRESHOLD
+
+    row_active = moving.mean(axis=1) > ROI_ACTIVE_LINE_RATIO
+    rows = _longest_active_run(row_active, int(len(row_active) * ROI_GAP_RATIO))
+    if rows is None or rows[1] - rows[0] < len(row_active) * ROI_MIN_HEIGHT_RATIO:
+        return None
+    column_active = moving[rows[0]:rows[1]].mean(axis=0) > ROI_ACTIVE_LINE_RATIO
+    columns = np.flatnonzero(column_active)
+    if not columns.size:
+        return None
+
+    x0 = max(0, int(columns[0]) * step - ROI_PADDING)
+    x1 = min(width, (int(columns[-1]) + 1) * step + ROI_PADDING)
+    y0 = max(0, rows[0] * step - ROI_PADDING)
+    y1 = min(height, rows[1] * step + ROI_PADDING)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def detect_video_content_region_sync(video_file_path: str, log_callback: Optional[Callable[..., None]] = None
+                                     ) -> Dict[str, Any]:
+    """
+    采样视频帧并检测聊天内容区域。
+
+    返回:
+        {"rect": (x, y, w, h) 或 None, "frame_size": (宽, 高) 或 None, "sampled_frames": 采样帧数}
+    """
+    frames = sample_video_frames_sync(video_file_path, log_callback=log_callback)
+    rect = detect_content_region(frames)
+    frame_size = (frames[0].shape[1], frames[0].shape[0]) if frames else None
+    if log_callback:
+        if rect:
+            log_callback(f"自动检测到聊天内容区域: X={rect[0]}, Y={rect[1]}, W={rect[2]}, H={rect[3]}")
+        else:
+            log_callback("未能自动检测到滚动的聊天内容区域，将使用完整帧。", LOG_WARN)
+    return {"rect": rect, "frame_size": frame_size, "sampled_frames": len(frames)}
+
+
 # --- 长图切片功能 (同步) ---
-def slice_image_sync(
+# 切片输出格式 -> (Pillow 格式名, 文件后缀)
+SLICE_OUTPUT_FORMATS = {
+    'png': ('PNG', '.png'),
+    'jpeg': ('JPEG', '.jpg'),
+    'webp': ('WEBP', '.webp'),
+}
+
+
+def _resolve_slice_output_format(source_path: Path, img_format: str, output_format: str) -> Tuple[str, str]:
+    """根据用户选择和源图格式确定切片的保存格式和后缀。"""
+    if output_format and output_format != 'auto':
+        return SLICE_OUTPUT_FORMATS.get(output_format.lower(), SLICE_OUTPUT_FORMATS['png'])
+    # 'auto': 沿用源图格式（受支持时），否则回退到 PNG
+    output_suffix = source_path.suffix.lower() if source_path.suffix else '.png'
+    save_format = 'PNG' if output_suffix not in [
+        '.jpg', '.jpeg', '.png', '.webp'] else img_format
+    save_suffix = '.png' if save_format == 'PNG' else output_suffix
+    return save_format, save_suffix
+
+
+def _build_slice_save_options(save_format: str, png_compress_level: int, quality: int) -> dict:
+    """构建 Pillow save() 的编码参数。"""
+    if save_format == 'PNG':
+        return {'compress_level': min(9, max(0, png_compress_level))}
+    if save_format in ('JPEG', 'WEBP'):
+        return {'quality': min(100, max(1, quality))}
+    return {}
+
+
+def _encode_slice(img: PILImage.Image, box: Tuple[int, int, int, int], output_file: Path,
+                  save_format: str, save_options: dict, tracer: NullTracer = NULL_TRACER) -> str:
+    """裁剪并保存单个切片（在线程池中执行，Pillow 编码时会释放 GIL）。"""
+    with tracer.span("encode_slice", "slice", file=output_file.name, top=box[1], bottom=box[3]):
+        slice_img = img.crop(box)
+        try:
+            if save_format == 'JPEG' and slice_img.mode not in ('RGB', 'L'):
+                converted = slice_img.convert('RGB')  # JPEG 不支持透明通道
+                slice_img.close()
+                slice_img = converted
+            slice_img.save(output_file, format=save_format, **save_options)
+        finally:
+            slice_img.close()  # 关闭切片图像对象
+    return str(output_file)
+
+
+def plan_fixed_slice_ranges(
+    img_height: int,
+    slice_height: int,
+    overlap: int,
+    log_callback: Optional[Callable[..., None]] = None
+) -> List[Tuple[int, int]]:
+    """按固定步长 (slice_height - overlap) 计算切片的 (上, 下) 像素范围。"""
+    ranges = []
+    # 有效步长决定了每次 start_y 前进多少
+    effective_step = max(1, slice_height - overlap)
+    start_y = 0
+    while start_y < img_height:
+        end_y = min(start_y + slice_height, img_height)
+        # 避免在末尾创建过小的切片，如果它们远小于重叠区域
+        # 这可以防止非常小且大多冗余的最终切片。根据需要调整阈值。
+        current_slice_actual_height = end_y - start_y
+        if start_y > 0 and current_slice_actual_height < (overlap * 0.5) and current_slice_actual_height < (slice_height * 0.2):
+            if log_callback:
+                log_callback(
+                    f"  跳过最后过小的切片 {len(ranges) + 1} (高度: {current_slice_actual_height}px)")
+            break  # 停止切片
+        ranges.append((start_y, end_y))
+        # 为下一个切片前进 start_y
+        start_y += effective_step
+    return ranges
+
+
+def compute_blank_row_mask(img: PILImage.Image, tolerance: int = SNAP_BLANK_ROW_TOLERANCE) -> np.ndarray:
+    """
+    使用 NumPy 计算每一行是否为空白行（行内灰度的最大值与最小值之差不超过 tolerance）。
+
+    为控制内存占用，按 SNAP_ANALYSIS_CHUNK_ROWS 行分块转换为灰度。
+    """
+    width, height = img.size
+    mask = np.zeros(height, dtype=bool)
+    for top in range(0, height, SNAP_ANALYSIS_CHUNK_ROWS):
+        bottom = min(top + SNAP_ANALYSIS_CHUNK_ROWS, height)
+        with img.crop((0, top, width, bottom)) as chunk:
+            gray = np.asarray(chunk.convert('L'))
+        row_range = gray.max(axis=1).astype(np.int16) - gray.min(axis=1)
+        mask[top:bottom] = row_range <= tolerance
+    return mask
+
+
+def plan_snapped_slice_ranges(
+    img_height: int,
+    slice_height: int,
+    overlap: int,
+    blank_rows: np.ndarray,
+    log_callback: Optional[Callable[..., None]] = None,
+    search_ratio: float = SNAP_SEARCH_RATIO
+) -> List[Tuple[int, int]]:
+    """
+    计算内容感知的切片范围: 每次切割对齐到目标位置上方最近的空白行，相邻切片无需重叠。
+
+    在切片底部 search_ratio * slice_height 的范围内找不到空白行时（例如长段文字或图片），
+    回退到固定位置切割并保留 overlap 像素的重叠；overlap 为 0 时改用 SNAP_BASELINE_OVERLAP，
+    以免切断的文字行在两张切片中都不完整。
+    """
+    ranges = []
+    search_span = max(1, int(slice_height * search_ratio))
+    fallback_overlap = overlap if overlap > 0 else SNAP_BASELINE_OVERLAP
+    fallback_count = 0
+    start_y = 0
+    while start_y < img_height:
+        target = start_y + slice_height
+        if target >= img_height:
+            ranges.append((start_y, img_height))
+            break
+        window_top = max(start_y + 1, target - search_span)
+        candidates = np.flatnonzero(blank_rows[window_top:target + 1])
+        if candidates.size:
+            cut = window_top + int(candidates[-1])  # 最接近目标位置的空白行
+            ranges.append((start_y, cut))
+            start_y = cut
+        else:
+            fallback_count += 1
+            ranges.append((start_y, target))
+            start_y = max(start_y + 1, target - fallback_overlap)
+    if log_callback:
+        log_callback(f"空白行对齐完成: {len(ranges)} 个切片, 其中 {fallback_count} 处未找到空白行而回退为重叠切割。")
+    return ranges
+
+
+def _report_snap_savings(
+    sliced_image_paths: List[str],
+    slice_ranges: List[Tuple[int, int]],
+    fixed_ranges: List[Tuple[int, int]],
+    stats: Optional[Dict[str, Any]],
+    log_callback: Optional[Callable[..., None]] = None
+):
+    """估算空白行对齐相对固定步长切割节省的切片数量和字节数。"""
+    snapped_rows = sum(bottom - top for top, bottom in slice_ranges)
+    fixed_rows = sum(bottom - top for top, bottom in fixed_ranges)
+    encoded_bytes = sum(os.path.getsize(p) for p in sliced_image_paths if os.path.exists(p))
+    # 固定切割没有真正编码，按本次实际编码的每行平均字节数估算
+    bytes_per_row = encoded_bytes / snapped_rows if snapped_rows else 0
+    saved_slices = len(fixed_ranges) - len(slice_ranges)
+    saved_bytes = int((fixed_rows - snapped_rows) * bytes_per_row)
+    if stats is not None:
+        stats.update({
+            "slice_count": len(slice_ranges),
+            "fixed_slice_count": len(fixed_ranges),
+            "saved_slices": saved_slices,
+            "encoded_bytes": encoded_bytes,
+            "saved_bytes": saved_bytes,
+        })
+    if log_callback:
+        log_callback(
+            f"空白行对齐节省: {saved_slices} 个切片 (固定切割 {len(fixed_ranges)} 个), "
+            f"约 {saved_bytes / 1024:.1f} KB")
+
+
+def _plan_slice_ranges(
+    img: PILImage.Image,
+    slice_height: int,
+    overlap: int,
+    slice_mode: str = 'fixed',
+    log_callback: Optional[Callable[..., None]] = None
+) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
+    """
+    按切割方式计算切片范围。
+
+    返回:
+        (切片范围列表, 固定切割的对比范围列表)。'fixed' 模式下两者相同。
+    """
+    img_height = img.size[1]
+    if slice_mode == 'snap':
+        if log_callback:
+            log_callback("正在分析行空白分布，将切割位置对齐到消息间空白...")
+        blank_rows = compute_blank_row_mask(img)
+        slice_ranges = plan_snapped_slice_ranges(img_height, slice_height, overlap, blank_rows, log_callback)
+        # 节省量的对比基准: 固定切割所需的重叠（重叠设为 0 时按默认重叠计算）
+        baseline_overlap = overlap or min(SNAP_BASELINE_OVERLAP, slice_height - 1)
+        fixed_ranges = plan_fixed_slice_ranges(img_height, slice_height, baseline_overlap)
+        return slice_ranges, fixed_ranges
+    slice_ranges = plan_fixed_slice_ranges(img_height, slice_height, overlap, log_callback)
+    return slice_ranges, slice_ranges
+
+
+def plan_long_image_regions_sync(
     source_image_path: str,
     slice_height: int,
     overlap: int,
+    slice_mode: str = 'fixed',
+    log_callback: Optional[Callable[..., None]] = None,
+    stats: Optional[Dict[str, Any]] = None
+) -> List[Tuple[int, int]]:
+    """
+    只计算长图的切片范围 (上, 下)，不生成切片文件。用于源图直接嵌入 PDF 的导出方式。
+
+    返回:
+        切片范围列表；参数无效或打开图片失败时返回空列表。
+    """
+    if slice_height <= 0 or overlap < 0 or slice_height <= overlap:
+        if log_callback:
+            log_callback("错误: 切片高度必须为正数且大于重叠高度，重叠不能为负数。")
+        return []
+    try:
+        with PILImage.open(source_image_path) as img:
+            if log_callback:
+                log_callback(f"图片尺寸: 宽度={img.width}, 高度={img.height}")
+            slice_ranges, fixed_ranges = _plan_slice_ranges(img, slice_height, overlap, slice_mode, log_callback)
+    except Exception as e:
+        if log_callback:
+            log_callback(f"错误: 打开或分析图片 {source_image_path} 失败: {e}")
+        return []
+    if stats is not None and slice_mode == 'snap':
+        stats.update({
+            "slice_count": len(slice_ranges),
+            "fixed_slice_count": len(fixed_ranges),
+            "saved_slices": len(fixed_ranges) - len(slice_ranges),
+            # 源图只嵌入一次，重叠像素不会重复存储
+            "saved_bytes": 0,
+        })
+    if log_callback:
+        log_callback(f"切片区域计算完成，共 {len(slice_ranges)} 个区域。")
+    return slice_ranges
+
+
+def render_region_thumbnails_sync(
+    source_image_path: str,
+    regions: List[Tuple[int, int]],
     output_dir: str,
-    log_callback: Optional[Callable[[str], None]] = None,
+    thumb_width: int = REGION_THUMBNAIL_WIDTH,
+    log_callback: Optional[Callable[..., None]] = None,
     progress_callback: Optional[Callable[[int, int], None]] = None
 ) -> List[str]:
     """
-    使用 Pillow 同步将长图切成多个重叠的片段。
+    为长图的各个切片区域生成小尺寸 JPEG 预览图 (slice_XXXX.jpg)，供前端预览和排序使用。
+
+    返回:
+        按区域顺序排列的预览图路径列表。
+    """
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+    thumb_paths = []
+    total = len(regions)
+    with PILImage.open(source_image_path) as img:
+        scale = thumb_width / img.width if img.width > thumb_width else 1.0
+        for index, (top, bottom) in enumerate(regions):
+            thumb_file = output_path / f"slice_{index:04d}.jpg"
+            with img.crop((0, top, img.width, bottom)) as region:
+                thumb = region.convert('RGB')
+                if scale < 1.0:
+                    thumb = thumb.resize((thumb_width, max(1, int((bottom - top) * scale))))
+                thumb.save(thumb_file, format='JPEG', quality=80)
+                thumb.close()
+            thumb_paths.append(str(thumb_file))
+            if progress_callback:
+                progress_callback(index + 1, total)
+    if log_callback:
+        log_callback(f"已生成 {len(thumb_paths)} 张切片预览图。")
+    return thumb_paths
+
+
+def compute_row_hashes(array: np.ndarray, tolerance: int = SNAP_BLANK_ROW_TOLERANCE
+                       ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    计算 RGB 数组每一行 (量化后) 像素的 64 位哈希、该行是否含有内容 (非空白行)，
+    以及用于近似匹配的灰度轮廓 (每行分为 STITCH_PROFILE_BINS 段取平均灰度)。
+
+    哈希为各像素值与固定随机权重的乘积和 (按 2^64 取模)，按 STITCH_HASH_CHUNK_ROWS 行分块向量化计算。
+    """
+    height, width = array.shape[:2]
+    rows = array.reshape(height, -1)
+    weights = np.random.default_rng(20240521).integers(1, 2 ** 63, size=rows.shape[1], dtype=np.uint64) | np.uint64(1)
+    bins = min(STITCH_PROFILE_BINS, width)
+    bin_width = width // bins
+    hashes = np.empty(height, dtype=np.uint64)
+    informative = np.empty(height, dtype=bool)
+    profiles = np.empty((height, bins), dtype=np.float32)
+    for top in range(0, height, STITCH_HASH_CHUNK_ROWS):
+        chunk = rows[top:top + STITCH_HASH_CHUNK_ROWS]
+        bottom = top + len(chunk)
+        hashes[top:bottom] = ((chunk >> STITCH_QUANT_SHIFT).astype(np.uint64) * weights).sum(axis=1)
+        gray = array[top:bottom].mean(axis=2, dtype=np.float32)
+        informative[top:bottom] = gray.max(axis=1) - gray.min(axis=1) > tolerance
+        profiles[top:bottom] = gray[:, :bins * bin_width].reshape(len(chunk), bins, bin_width).mean(axis=2)
+    return hashes, informative, profiles
+
+
+def _static_edges(hashes_a: np.ndarray, hashes_b: np.ndarray) -> Tuple[int, int]:
+    """两张同尺寸截图顶部与底部完全相同的行数 (状态栏、标题栏、输入框等固定区域)。"""
+    if len(hashes_a) != len(hashes_b):
+        return 0, 0
+    equal = hashes_a == hashes_b
+    if equal.all():
+        return len(equal), 0
+    top = int(np.argmin(equal))
+    bottom = int(np.argmin(equal[::-1]))
+    return top, bottom
+
+
+def find_scroll_offset(hashes_a: np.ndarray, info_a: np.ndarray,
+                       hashes_b: np.ndarray, info_b: np.ndarray) -> Optional[Tuple[int, float]]:
+    """
+    在两张截图的滚动区域之间寻找偏移 d (B 的第 j 行对应 A 的第 j + d 行)。
+
+    B 中每个非空白行与 A 中只出现一次的同哈希行组成一个候选偏移并投票 (排序 + 二分查找，全部向量化)，
+    得票最多的几个偏移再逐一验证：至少 STITCH_MIN_OVERLAP_ROWS 个非空白行一致，且首尾一致行之间
+    非空白行的哈希一致比例不低于 STITCH_MIN_MATCH_RATIO。
+    返回 (偏移, 一致比例)，没有可靠的重叠时返回 None。
+    """
+    if not len(hashes_a) or not len(hashes_b):
+        return None
+    unique_hashes, first_index, counts = np.unique(hashes_a, return_index=True, return_counts=True)
+    single = counts == 1
+    unique_hashes, positions = unique_hashes[single], first_index[single]
+    b_rows = np.flatnonzero(info_b)
+    if not unique_hashes.size or not b_rows.size:
+        return None
+    slots = np.minimum(np.searchsorted(unique_hashes, hashes_b[b_rows]), unique_hashes.size - 1)
+    found = unique_hashes[slots] == hashes_b[b_rows]
+    shifts = positions[slots[found]] - b_rows[found]
+    shifts = shifts[shifts >= 0]  # 只考虑向下滚动 (B 显示的是更晚的内容)
+    if not shifts.size:
+        return None
+    votes = np.bincount(shifts)
+    for offset in np.argsort(votes, kind="stable")[::-1][:STITCH_OFFSET_CANDIDATES]:
+        offset = int(offset)
+        if not votes[offset]:
+            break
+        overlap = min(len(hashes_a) - offset, len(hashes_b))
+        checked = info_a[offset:offset + overlap] | info_b[:overlap]
+        same = hashes_a[offset:offset + overlap] == hashes_b[:overlap]
+        matched = np.flatnonzero(same & checked)
+        if matched.size < STITCH_MIN_OVERLAP_ROWS:
+            continue
+        # 只统计首尾两个一致行之间的部分：未被识别为固定区域的状态栏 (时间变化) 等不影响判断
+        window = slice(int(matched[0]), int(matched[-1]) + 1)
+        ratio = float(same[window][checked[window]].mean())
+        if ratio >= STITCH_MIN_MATCH_RATIO:
+            return offset, ratio
+    return None
+
+
+def find_scroll_offset_approx(profiles_a: np.ndarray, info_a: np.ndarray,
+                              profiles_b: np.ndarray, info_b: np.ndarray) -> Optional[Tuple[int, float]]:
+    """
+    行哈希无法对齐时 (例如 JPEG 截图，滚动后压缩噪声不同) 的近似匹配：对每个候选偏移计算重叠部分
+    非空白行灰度轮廓的平均绝对差，取其中位数 (不受少量不一致的行影响)，选差异最小的偏移。
+    返回 (偏移, 差异)，差异超过 STITCH_MAX_PROFILE_DIFF 时返回 None。
+    """
+    best: Optional[Tuple[int, float]] = None
+    for offset in range(max(0, len(profiles_a) - STITCH_MIN_OVERLAP_ROWS + 1)):
+        overlap = min(len(profiles_a) - offset, len(profiles_b))
+        checked = info_a[offset:offset + overlap] | info_b[:overlap]
+        if checked.sum() < STITCH_MIN_OVERLAP_ROWS:
+            continue
+        row_diff = np.abs(profiles_a[offset:offset + overlap][checked] - profiles_b[:overlap][checked]).mean(axis=1)
+        diff = float(np.median(row_diff))
+        if best is None or diff < best[1]:
+            best = (offset, diff)
+    return best if best is not None and best[1] <= STITCH_MAX_PROFILE_DIFF else None
+
+
+def _load_screenshot(path: str, width: Optional[int] = None) -> np.ndarray:
+    """以 RGB 数组读取截图；指定宽度且不一致时按比例缩放到该宽度。"""
+    with PILImage.open(path) as img:
+        rgb = img.convert('RGB')
+    if width and rgb.width != width:
+        resized = rgb.resize((width, max(1, round(rgb.height * width / rgb.width))), PILImage.LANCZOS)
+        rgb.close()
+        rgb = resized
+    array = np.asarray(rgb)
+    rgb.close()
+    return array
+
+
+def stitch_screenshots_sync(
+    image_paths: List[str],
+    output_path: str,
+    log_callback: Optional[Callable[..., None]] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    tracer: NullTracer = NULL_TRACER
+) -> Optional[str]:
+    """
+    将按顺序截取、相互重叠的多张聊天截图拼接为一张长图，重叠部分只保留一次。
+
+    相邻两张截图先比较行哈希找出顶部与底部的固定区域 (状态栏、输入框等)，再在中间的滚动区域内
+    寻找滚动偏移 (先按行哈希精确对齐，失败时按灰度轮廓近似对齐)，只追加后一张截图中新出现的行；
+    第一张截图的顶部与最后一张截图的底部保留。
+    找不到可靠重叠的截图会完整追加并记录警告。宽度不同的截图按第一张的宽度缩放。
+    分两遍处理 (先计算行哈希与对齐，再复制各段像素)，同一时间只有一两张截图在内存中。
+
+    返回:
+        拼接结果的路径 (扩展名决定编码格式，.png 使用快速压缩)；失败时返回 None。
+    """
+    def log(message: str, level: str = LOG_INFO):
+        if log_callback:
+            log_callback(message, level)
+
+    if not image_paths:
+        log("错误: 没有需要拼接的截图。")
+        return None
+    total = len(image_paths)
+    try:
+        width: Optional[int] = None
+        kept_paths: List[str] = []  # 去掉与上一张完全相同的截图后的列表
+        heights: List[int] = []
+        input_rows = 0
+        # 每对相邻截图: (顶部固定行数, 底部固定行数, 滚动偏移或 None)
+        pairs: List[Tuple[int, int, Optional[int]]] = []
+        previous: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        for index, path in enumerate(image_paths):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            with tracer.span("stitch_hash", "slice", file=Path(path).name):
+                array = _load_screenshot(path, width)
+                width = width or array.shape[1]
+                hashes, informative, profiles = compute_row_hashes(array)
+            input_rows += len(hashes)
+            del array
+            if previous is not None:
+                top, bottom = _static_edges(previous[0], hashes)
+                if top >= len(hashes):  # 与上一张完全相同
+                    log(f"第 {index + 1} 张截图与上一张相同，已跳过。", LOG_DEBUG)
+                    if progress_callback:
+                        progress_callback(index + 1, total * 2)
+                    continue
+                a_end, b_end = len(previous[0]) - bottom, len(hashes) - bottom
+                match = find_scroll_offset(previous[0][top:a_end], previous[1][top:a_end],
+                                           hashes[top:b_end], informative[top:b_end])
+                if match:
+                    log(f"第 {index + 1} 张截图: 滚动 {match[0]} 行 (重叠行一致率 {match[1]:.0%})。", LOG_DEBUG)
+                else:
+                    match = find_scroll_offset_approx(previous[2][top:a_end], previous[1][top:a_end],
+                                                      profiles[top:b_end], informative[top:b_end])
+                    if match:
+                        log(f"第 {index + 1} 张截图: 近似匹配，滚动 {match[0]} 行 (灰度差异 {match[1]:.1f})。", LOG_DEBUG)
+                pairs.append((top, bottom, match[0] if match else None))
+                if not match:
+                    log(f"第 {index + 1} 张截图与上一张没有找到可靠的重叠，已完整追加。", LOG_WARN)
+            kept_paths.append(path)
+            heights.append(len(hashes))
+            previous = (hashes, informative, profiles)
+            if progress_callback:
+                progress_callback(index + 1, total * 2)
+
+        # 各张截图需要保留的行范围
+        segments: List[Tuple[int, int]] = []
+        for index, height in enumerate(heights):
+            end = height - (pairs[index][1] if index < len(pairs) else 0)  # 底部固定区域只在最后一张保留
+            if index == 0:
+                start = 0
+            else:
+                top, bottom, offset = pairs[index - 1]
+                previous_content = heights[index - 1] - top - bottom
+                start = top + (previous_content - offset if offset is not None else 0)
+            segments.append((min(start, end), end))
+        output_height = sum(end - start for start, end in segments)
+
+        stitched = np.empty((output_height, width, 3), dtype=np.uint8)
+        row = 0
+        for index, (path, (start, end)) in enumerate(zip(kept_paths, segments)):
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            if end > start:
+                with tracer.span("stitch_copy", "slice", file=Path(path).name, rows=end - start):
+                    stitched[row:row + end - start] = _load_screenshot(path, width)[start:end]
+                row += end - start
+            if progress_callback:
+                progress_callback(total + round((index + 1) * total / len(kept_paths)), total * 2)
+
+        output = Path(output_path)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with tracer.span("stitch_encode", "slice", rows=output_height):
+            image = PILImage.fromarray(stitched)
+            if output.suffix.lower() in ('.jpg', '.jpeg'):
+                image.save(output, format='JPEG', quality=95)
+            else:
+                image.save(output, format='PNG', compress_level=1)  # 中间结果，切片时会重新编码
+            image.close()
+    except JobCancelledError:
+        raise
+    except Exception as e:
+        log(f"错误: 拼接截图失败: {e}")
+        return None
+
+    unmatched = sum(1 for _, _, offset in pairs if offset is None)
+    if stats is not None:
+        stats.update({"screenshots": total, "input_rows": input_rows, "output_rows": output_height,
+                      "removed_rows": input_rows - output_height, "unmatched_pairs": unmatched})
+    log(f"{total} 张截图已拼接为 {width}x{output_height} 的长图，去除重复的 {input_rows - output_height} 行"
+        f" ({(input_rows - output_height) / input_rows:.0%})" + (f"，{unmatched} 处未找到重叠。" if unmatched else "。"))
+    return str(output)
+
+
+def slice_image_sync(
+    source_image_path: str,
+    slice_height: int,
+    overlap: int,
+    output_dir: str,
+    log_callback: Optional[Callable[..., None]] = None,
+    progress_callback: Optional[Callable[[int, int], None]] = None,
+    output_format: str = 'auto',
+    png_compress_level: int = SLICE_PNG_COMPRESS_LEVEL,
+    quality: int = SLICE_QUALITY,
+    max_workers: Optional[int] = None,
+    slice_mode: str = 'fixed',
+    stats: Optional[Dict[str, Any]] = None,
+    cancel_token: Optional[CancelToken] = None,
+    tracer: NullTracer = NULL_TRACER
+) -> List[str]:
+    """
+    使用 Pillow 同步将长图切成多个重叠的片段，切片编码在线程池中并发执行。
 
     参数:
         source_image_path: 输入长图的路径。
@@ -279,9 +1254,18 @@ def slice_image_sync(
         output_dir: 保存切片图像文件的目录。
         log_callback: 可选的日志回调函数。
         progress_callback: 可选的进度回调函数 (当前切片数, 总切片数)。
+        output_format: 切片输出格式: 'auto' (沿用源图格式), 'png', 'jpeg' 或 'webp'。
+        png_compress_level: PNG 压缩级别 (0-9)，数值越小编码越快、文件越大。
+        quality: JPEG/WEBP 编码质量 (1-100)。
+        max_workers: 编码线程数，默认为 SLICE_ENCODE_WORKERS。
+        slice_mode: 'fixed' 按固定步长切割；'snap' 将切割位置对齐到最近的空白行，
+                    找不到空白行时才回退使用 overlap。
+        stats: 可选字典，'snap' 模式下会写入相对固定切割节省的切片数和字节数。
+        cancel_token: 可选的取消信号，取消后不再编码剩余切片并返回空列表。
+        tracer: 可选的追踪器，记录切割规划与每个切片的编码耗时。
 
     返回:
-        成功保存的切片图像路径列表。
+        成功保存的切片图像路径列表（按切片顺序）。
     """
     sliced_image_paths = []
     source_path = Path(source_image_path)
@@ -320,72 +1304,67 @@ def slice_image_sync(
                 log_callback("错误: 切片高度必须为正数，重叠不能为负数。")
             return []
 
-        start_y = 0
-        slice_index = 0
-        # 有效步长决定了每次 start_y 前进多少
-        effective_step = max(1, slice_height - overlap)
+        # 先计算全部切片区域，再并发编码
+        with tracer.span("plan_slices", "slice", mode=slice_mode):
+            slice_ranges, fixed_ranges = _plan_slice_ranges(img, slice_height, overlap, slice_mode, log_callback)
+        boxes = [(0, top, img_width, bottom) for top, bottom in slice_ranges]  # 左, 上, 右, 下
 
-        # 估算总步数以报告进度
-        # 如果完整步数后还有剩余部分，则加 1
-        total_steps = (img_height // effective_step) + \
-            (1 if img_height % effective_step > 0 else 0)
-        if img_height <= slice_height:
-            total_steps = 1  # 如果图像比切片高度短，则只有一个切片
+        total_steps = len(boxes)
+        save_format, save_suffix = _resolve_slice_output_format(source_path, img_format, output_format)
+        save_options = _build_slice_save_options(save_format, png_compress_level, quality)
+        workers = max(1, min(max_workers or SLICE_ENCODE_WORKERS, total_steps or 1))
 
         if log_callback:
             log_callback(f"预计切片数量: {total_steps}")
+            log_callback(f"切片输出格式: {save_format} {save_options}, 编码线程数: {workers}")
 
-        while start_y < img_height:
-            current_slice_num = slice_index + 1
-            end_y = min(start_y + slice_height, img_height)
-            box = (0, start_y, img_width, end_y)  # 左, 上, 右, 下
-
-            # 避免在末尾创建过小的切片，如果它们远小于重叠区域
-            # 这可以防止非常小且大多冗余的最终切片。根据需要调整阈值。
-            current_slice_actual_height = end_y - start_y
-            if start_y > 0 and current_slice_actual_height < (overlap * 0.5) and current_slice_actual_height < (slice_height * 0.2):
-                if log_callback:
-                    log_callback(
-                        f"  跳过最后过小的切片 {current_slice_num} (高度: {current_slice_actual_height}px)")
-                # 由于我们跳过了最后一步，将进度更新为 100%
-                if progress_callback:
-                    progress_callback(total_steps, total_steps)
-                break  # 停止切片
-
-            if log_callback:
-                log_callback(
-                    f"  正在裁剪切片 {current_slice_num}/{total_steps}: Y={start_y} 到 Y={end_y}")
-
-            try:
-                slice_img = img.crop(box)
-                # 确定输出格式和文件名
-                output_suffix = source_path.suffix.lower() if source_path.suffix else '.png'
-                # 确保保存格式受 Pillow 支持（PNG 是安全的）
-                save_format = 'PNG' if output_suffix not in [
-                    '.jpg', '.jpeg', '.png', '.webp'] else img_format
-                save_suffix = '.png' if save_format == 'PNG' else output_suffix
+        # 预先解码整张图片，使各线程的 crop 只读取已加载的像素数据
+        with tracer.span("decode_source", "slice", width=img_width, height=img_height):
+            img.load()
 
+        results: List[Optional[str]] = [None] * total_steps
+        completed = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            future_to_index = {}
+            for slice_index, box in enumerate(boxes):
                 slice_filename = f"slice_{slice_index:04d}{save_suffix}"
-                slice_output_path_obj = output_path / slice_filename
-
-                # 保存切片
-                slice_img.save(slice_output_path_obj, format=save_format)
-                slice_img.close()  # 关闭切片图像对象
-                sliced_image_paths.append(str(slice_output_path_obj))
-                slice_index += 1
-
+                future = executor.submit(_encode_slice, img, box, output_path / slice_filename,
+                                         save_format, save_options, tracer)
+                future_to_index[future] = slice_index
+
+            # 进度在主线程中按完成数量报告，保证单调递增
+            for future in as_completed(future_to_index):
+                if cancel_token and cancel_token.cancelled:
+                    for pending in future_to_index:
+                        pending.cancel()  # 丢弃尚未开始的编码任务
+                    break
+                slice_index = future_to_index[future]
+                box = boxes[slice_index]
+                try:
+                    results[slice_index] = future.result()
+                    if log_callback:
+                        log_callback(
+                            f"  已保存切片 {slice_index + 1}/{total_steps}: Y={box[1]} 到 Y={box[3]}", LOG_DEBUG)
+                except Exception as crop_err:
+                    if log_callback:
+                        log_callback(
+                            f"  裁剪或保存切片 {slice_index + 1} 出错: {crop_err}", LOG_WARN)
+                    # 单个切片出错时继续处理其余切片
+                completed += 1
                 if progress_callback:
-                    progress_callback(slice_index, total_steps)
+                    progress_callback(completed, total_steps)
+
+        if cancel_token and cancel_token.cancelled:
+            img.close()
+            if log_callback:
+                log_callback("裁剪已取消。")
+            return []
 
-            except Exception as crop_err:
-                if log_callback:
-                    log_callback(
-                        f"  裁剪或保存切片 {current_slice_num} 出错: {crop_err}")
-                # 决定在单个切片错误时是停止还是继续
-                continue  # 继续到下一个切片
+        # 按切片顺序返回成功的结果，文件名与顺序保持确定性
+        sliced_image_paths = [p for p in results if p]
 
-            # 为下一个切片前进 start_y
-            start_y += effective_step
+        if slice_mode == 'snap':
+            _report_snap_savings(sliced_image_paths, slice_ranges, fixed_ranges, stats, log_callback)
 
         img.close()  # 关闭主图像对象
         if log_callback:
@@ -416,11 +1395,19 @@ class OcrFilter:
                  exclusion_list: Optional[List[str]] = None,
                  analysis_rect_tuple: Optional[Tuple[int,
                                                      int, int, int]] = None,
-                 log_callback: Optional[Callable[[str], None]] = None,
-                 progress_callback: Optional[Callable[[int, int], None]] = None, similarity_threshold: float = 0.3):
+                 log_callback: Optional[Callable[..., None]] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None, similarity_threshold: float = 0.3,
+                 frame_store: Optional[FrameStore] = None, tracer: NullTracer = NULL_TRACER,
+                 ocr_profile: Optional[str] = None, boundary_only: bool = False,
+                 refine_video_path: Optional[str] = None, frame_interval_seconds: float = 1.0,
+                 min_refine_interval_seconds: float = ADAPTIVE_MIN_INTERVAL_SECONDS,
+                 cancel_token: Optional[CancelToken] = None, checkpoint_path: Optional[str] = None):
         self.image_session_folder = image_session_folder  # 图片会话文件夹
+        self.frame_store = frame_store  # 可选的单文件帧存储；指定时按索引读取帧，不再扫描目录
         self.ocr_engine = ocr_engine_instance  # OCR 引擎实例
         self.exclusion_list = exclusion_list if exclusion_list else []  # 内容排除白名单
+        # 排除规则每个任务编译一次：整行、包含、前缀与正则 (见 backend/exclusion.py)，并统计各规则命中次数
+        self._exclusion = ExclusionMatcher(self.exclusion_list)
         # 可选的OCR分析区域 (x, y, width, height)
         self.analysis_rect_tuple = analysis_rect_tuple
         self.overlap_check_tail_lines = OVERLAP_CHECK_TAIL_LINES  # 例如，从上一张保留帧的底部取2行
@@ -429,26 +1416,211 @@ class OcrFilter:
         self.progress_callback = progress_callback  # 进度回调
         self._is_running = True  # 控制运行状态的标志
         self.similarity_threshold = similarity_threshold  # 存储相似度阈值 - 降低为0.3以放宽匹配条件
-
-    def _log(self, msg: str):
+        self.tracer = tracer  # 可选的追踪器，记录每帧的裁剪、OCR 与相似度比较耗时
+        self.ocr_profile = resolve_ocr_profile(ocr_profile)  # OCR 速度档位 (用于方向分类开关与指标标签)
+        self.use_cls = ocr_profile_uses_cls(self.ocr_profile)
+        # 整体方向 (np.rot90 的逆时针 90° 次数)，None 表示尚未检测；仅在档位启用方向分类时使用
+        self._rotation: Optional[int] = None
+        self._orientation_probes = 0  # 已尝试检测方向的帧数
+        self._low_confidence_streak = 0  # 连续低置信度帧数
+        # 边界识别模式：检测全部文本框，但只识别顶部与底部用于重叠判断的行，每帧识别开销与消息数量无关
+        self.boundary_only = boundary_only
+        # 自适应采样：指定源视频时，相邻保留候选帧之间重叠检查失败的时间段会通过定位补抽帧并二分细化，
+        # 补抽的帧命名为 <之前的粗采样帧名>_r<毫秒>.png，按名称排序时位于两张粗采样帧之间
+        self.refine_video_path = refine_video_path
+        self.frame_interval_seconds = frame_interval_seconds  # 粗采样间隔，用于换算各帧的时间点
+        self.min_refine_interval_seconds = min_refine_interval_seconds
+        self.cancel_token = cancel_token
+        self.refined_frame_count = 0  # 补抽的帧数
+        # 检查点：每帧识别并预处理后的文本行逐行追加到该 JSONL 文件；任务中断后重新运行时，
+        # 已有记录的帧直接使用记录的文本行，不再 OCR (保留判断由这些文本行重新推导，结果相同)
+        self.checkpoint_path = Path(checkpoint_path) if checkpoint_path else None
+        self._checkpoint_lines: Dict[str, List[str]] = {}
+        self._checkpoint_file = None
+        self.resumed_frame_count = 0  # 从检查点恢复 (未重新 OCR) 的帧数
+
+    def _log(self, msg: str, level: str = LOG_INFO):
         """记录日志消息。"""
         if self.log_callback:
-            self.log_callback(msg)
+            self.log_callback(msg, level)
 
     def _progress(self, current: int, total: int):
         """报告进度。"""
         if self.progress_callback:
             self.progress_callback(current, total)
 
+    def _open_checkpoint(self):
+        """读取已有的检查点记录 (忽略进程中断时写了一半的最后一行)，并以追加方式打开。"""
+        if self.checkpoint_path is None:
+            return
+        if self.checkpoint_path.is_file():
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        self._checkpoint_lines[record["frame"]] = record["lines"]
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            if self._checkpoint_lines:
+                self._log(f"检查点中已有 {len(self._checkpoint_lines)} 帧的OCR结果，将跳过这些帧的识别。")
+        self._checkpoint_file = open(self.checkpoint_path, "a", encoding="utf-8")
+
+    def _record_checkpoint(self, frame: str, lines: List[str]):
+        if self._checkpoint_file is not None:
+            self._checkpoint_file.write(json.dumps({"frame": frame, "lines": lines}, ensure_ascii=False) + "\n")
+            self._checkpoint_file.flush()  # 每帧写入操作系统缓冲，进程崩溃时不丢失已完成的帧
+
+    def _close_checkpoint(self):
+        if self._checkpoint_file is not None:
+            self._checkpoint_file.close()
+            self._checkpoint_file = None
+
+    def _in_frame_store(self, img_path: Path) -> bool:
+        """该帧是否从帧存储中读取 (自适应采样补抽的帧始终是独立文件)。"""
+        return self.frame_store is not None and not img_path.is_file()
+
+    def _open_frame(self, img_path: Path) -> PILImage.Image:
+        """打开帧图像 (帧存储模式下按名称从存储中读取)。"""
+        if self._in_frame_store(img_path):
+            return self.frame_store.open_image(self.frame_store.index_of(img_path.name))
+        return PILImage.open(img_path)
+
+    @staticmethod
+    def _to_ocr_array(pil_img: PILImage.Image) -> np.ndarray:
+        """将 PIL 图像转换为 OCR 引擎可直接使用的 BGR 数组，避免写临时文件。"""
+        return np.ascontiguousarray(np.asarray(pil_img.convert("RGB"))[:, :, ::-1])
+
+    @staticmethod
+    def _load_ocr_array(ocr_input) -> np.ndarray:
+        """将 OCR 输入 (图像路径或数组) 转为 BGR 数组，用于旋转。"""
+        if isinstance(ocr_input, np.ndarray):
+            return ocr_input
+        with PILImage.open(ocr_input) as img:
+            return OcrFilter._to_ocr_array(img)
+
+    @staticmethod
+    def _mean_confidence(ocr_lines: List[OcrLine]) -> Optional[float]:
+        """各文本行识别置信度的平均值；没有文本行时返回 None。"""
+        return sum(line.score for line in ocr_lines) / len(ocr_lines) if ocr_lines else None
+
+    def _ocr_call(self, ocr_input, cls: bool, frame_name: str) -> List[OcrLine]:
+        """执行一次 OCR 引擎调用并记录耗时。"""
+        with OCR_CALL_SECONDS.labels(profile=self.ocr_profile).time(), \
+                self.tracer.span("ocr", "ocr", frame=frame_name, cls=cls):
+            return self.ocr_engine.ocr(ocr_input, cls=cls)
+
+    def _is_relevant_line(self, text: str) -> bool:
+        """该行在预处理后是否保留 (非空且不被排除规则命中)；不计入命中统计。"""
+        s_line = text.strip()
+        return bool(s_line) and not self._exclusion.is_excluded(s_line, count=False)
+
+    def _boundary_ocr(self, ocr_input, cls: bool, frame_name: str) -> List[OcrLine]:
+        """
+        边界识别：检测全部文本框并按位置排序，从顶部和底部分别识别，直到各得到
+        OVERLAP_CHECK_HEAD_LINES / OVERLAP_CHECK_TAIL_LINES 行不被排除的文本。
+        返回与 engine.ocr() 相同格式的结果 (只含已识别的行，按从上到下排列)。
+        文本框按阅读顺序排列 (OcrBackend.detect 的约定)，裁剪时取外接矩形 (录屏中的文字行基本水平)。
+        """
+        array = self._load_ocr_array(ocr_input)
+        with OCR_CALL_SECONDS.labels(profile=self.ocr_profile).time(), \
+                self.tracer.span("ocr_detect", "ocr", frame=frame_name):
+            boxes = self.ocr_engine.detect(array)
+        recognized: Dict[int, Tuple[str, float]] = {}
+
+        def recognize_until(order: List[int], needed: int):
+            found = 0
+            while found < needed and order:
+                batch, order = order[:needed - found], order[needed - found:]
+                todo = [i for i in batch if i not in recognized]
+                if todo:
+                    with OCR_CALL_SECONDS.labels(profile=self.ocr_profile).time(), \
+                            self.tracer.span("ocr_recognize", "ocr", frame=frame_name, boxes=len(todo), cls=cls):
+                        texts = self.ocr_engine.recognize([crop_box(array, boxes[i]) for i in todo], cls)
+                    recognized.update(zip(todo, texts))
+                found += sum(1 for i in batch if self._is_relevant_line(recognized[i][0]))
+
+        indices = list(range(len(boxes)))
+        recognize_until(indices, self.overlap_check_head_lines)
+        recognize_until(indices[::-1], self.overlap_check_tail_lines)
+        OCR_BOXES_TOTAL.labels(state="detected").inc(len(boxes))
+        OCR_BOXES_TOTAL.labels(state="recognized").inc(len(recognized))
+        return [OcrLine(boxes[i], *recognized[i]) for i in sorted(recognized)]
+
+    def _recognize_frame(self, ocr_input, cls: bool, frame_name: str) -> List[OcrLine]:
+        """按当前模式 (完整识别或边界识别) 识别一帧。"""
+        if self.boundary_only:
+            return self._boundary_ocr(ocr_input, cls, frame_name)
+        return self._ocr_call(ocr_input, cls, frame_name)
+
+    def _detect_orientation(self, ocr_input, frame_name: str):
+        """
+        依次尝试 0°、180°、90°、270° 旋转 (均不使用方向分类器)，选取平均置信度最高的方向。
+        原方向置信度足够高时立即返回，常见情况只需一次调用。每个方向按当前模式识别 (边界识别时
+        只识别首尾几行)，探测帧的结果与后续帧格式一致，开销也受边界识别限制。
+        返回: (旋转次数或 None (帧内没有文字), 所选方向的 OCR 结果)
+        """
+        best_rotation, best_results, best_confidence = None, None, -1.0
+        array = None
+        with self.tracer.span("orientation", "ocr", frame=frame_name) as span:
+            for rotation in (0, 2, 1, 3):
+                if rotation == 0:
+                    candidate = ocr_input
+                else:
+                    if array is None:
+                        array = self._load_ocr_array(ocr_input)
+                    candidate = np.ascontiguousarray(np.rot90(array, rotation))
+                results = self._recognize_frame(candidate, False, frame_name)
+                confidence = self._mean_confidence(results)
+                if best_results is None:
+                    best_results = results
+                if confidence is None:
+                    if rotation == 0:
+                        break  # 原方向没有检测到任何文字，其他方向也不会有
+                    continue
+                if confidence > best_confidence:
+                    best_rotation, best_results, best_confidence = rotation, results, confidence
+                if rotation == 0 and confidence >= ORIENTATION_ACCEPT_CONFIDENCE:
+                    break
+            span.set(rotation=best_rotation, confidence=best_confidence)
+        return best_rotation, best_results
+
+    def _ocr_frame(self, ocr_input, frame_name: str):
+        """
+        识别一帧。启用方向分类的档位下，方向只在开头检测一次，之后的帧按检测结果预先旋转并以
+        cls=False 识别；置信度偏低的帧再用方向分类器重新识别一次，连续偏低时重新检测整体方向。
+        """
+        if not self.use_cls:
+            return self._recognize_frame(ocr_input, False, frame_name)
+        if self._rotation is None:
+            rotation, results = self._detect_orientation(ocr_input, frame_name)
+            self._orientation_probes += 1
+            if rotation is not None or self._orientation_probes >= ORIENTATION_PROBE_FRAMES:
+                self._rotation = rotation or 0
+                self._low_confidence_streak = 0
+                self._log(f"检测到画面方向: 旋转 {self._rotation * 90}° (依据 {frame_name})，后续帧跳过方向分类。", LOG_DEBUG)
+            return results
+        if self._rotation:
+            ocr_input = np.ascontiguousarray(np.rot90(self._load_ocr_array(ocr_input), self._rotation))
+        results = self._recognize_frame(ocr_input, False, frame_name)
+        confidence = self._mean_confidence(results)
+        if confidence is None or confidence >= ORIENTATION_RECHECK_CONFIDENCE:
+            self._low_confidence_streak = 0
+            return results
+        retry = self._recognize_frame(ocr_input, True, frame_name)
+        retry_confidence = self._mean_confidence(retry)
+        self._log(f"{frame_name} 置信度偏低 ({confidence:.2f})，已使用方向分类器重新识别。", LOG_DEBUG)
+        self._low_confidence_streak += 1
+        if self._low_confidence_streak >= ORIENTATION_RECHECK_FRAMES:
+            self._rotation = None  # 连续低置信度，下一帧重新检测整体方向
+            self._orientation_probes = 0
+        return retry if retry_confidence is not None and retry_confidence > confidence else results
+
     def _preprocess_ocr_lines(self, ocr_text_lines: List[str]) -> List[str]:
         """过滤掉排除列表中的行和空行，并去除首尾空格。"""
         processed = []
-        # 如果存在排除列表，预处理以便快速查找
-        excluded_set = {ex.strip() for ex in self.exclusion_list if ex.strip(
-        )} if self.exclusion_list else set()
         for line in ocr_text_lines:
             s_line = line.strip()  # 去除首尾空格
-            if s_line and s_line not in excluded_set:  # 如果行不为空且不在排除列表中
+            if s_line and not self._exclusion.is_excluded(s_line):  # 如果行不为空且不被排除规则命中
                 processed.append(s_line)  # 存储处理后的行
         return processed
 
@@ -480,6 +1652,117 @@ class OcrFilter:
         # 如果相似度超过阈值，则认为存在重叠
         return similarity >= self.similarity_threshold
 
+    def _frame_lines(self, img_path: Path, ocr_temp_dir: Path) -> List[str]:
+        """对一帧执行 (可选的区域裁剪与) OCR，返回预处理后的文本行。"""
+        cached_lines = self._checkpoint_lines.get(img_path.name)
+        if cached_lines is not None:
+            self.resumed_frame_count += 1
+            return cached_lines
+        path_for_ocr = img_path  # 默认为原始帧路径
+        ocr_input = None  # 帧存储模式下直接传给 OCR 的图像数组
+        in_store = self._in_frame_store(img_path)
+
+        # --- 如果指定了OCR分析区域，则应用 ---
+        if self.analysis_rect_tuple:
+            with self.tracer.span("crop", "ocr", frame=img_path.name):
+                try:
+                    pil_img_full = self._open_frame(img_path)
+                    x, y, w, h = self.analysis_rect_tuple
+                    # 验证区域是否有效
+                    if w > 0 and h > 0 and x >= 0 and y >= 0 and \
+                       x + w <= pil_img_full.width and y + h <= pil_img_full.height:
+
+                        img_cropped = pil_img_full.crop(
+                            (x, y, x + w, y + h))  # 裁剪图像
+                        if in_store:
+                            ocr_input = self._to_ocr_array(img_cropped)
+                        else:
+                            path_for_ocr = ocr_temp_dir / \
+                                f"cropped_{img_path.name}"  # 更新OCR路径为裁剪后的图像
+                            img_cropped.save(path_for_ocr)
+                        img_cropped.close()  # 关闭裁剪后的图像对象
+                    else:
+                        self._log(
+                            f"警告: OCR分析区域对 {img_path.name} 无效。将使用完整帧。", LOG_WARN)
+                    pil_img_full.close()  # 关闭完整图像对象
+                except Exception as img_err:
+                    self._log(
+                        f"处理图片 {img_path.name} 时出错 (裁剪区域): {img_err}", LOG_WARN)
+                    path_for_ocr = img_path  # 出错则回退到使用原始帧
+
+        # --- 执行 OCR ---
+        if ocr_input is None and in_store:
+            with self.tracer.span("decode", "ocr", frame=img_path.name), \
+                    self._open_frame(img_path) as frame_img:
+                ocr_input = self._to_ocr_array(frame_img)
+        ocr_results = self._ocr_frame(
+            ocr_input if ocr_input is not None else str(path_for_ocr), img_path.name)
+        FRAMES_TOTAL.labels(state="ocr").inc()
+
+        current_raw_lines = [line.text for line in ocr_results]  # 当前帧的原始OCR行
+
+        # --- 预处理OCR结果 ---
+        processed_lines = self._preprocess_ocr_lines(current_raw_lines)
+        self._record_checkpoint(img_path.name, processed_lines)
+        return processed_lines
+
+    def _overlaps(self, previous_lines: List[str], current_lines: List[str], frame_label: str) -> bool:
+        """上一张保留帧的尾部与当前帧的头部是否 (模糊) 重叠。"""
+        tail_of_last_kept = previous_lines[-self.overlap_check_tail_lines:] if previous_lines else []
+        head_of_current = current_lines[:self.overlap_check_head_lines] if current_lines else []
+        with self.tracer.span("similarity", "ocr", frame=frame_label) as span:
+            has_overlap = self._lines_overlap_fuzzy(tail_of_last_kept, head_of_current)
+            span.set(overlap=has_overlap)
+        return has_overlap
+
+    def _extract_refined_frame(self, timestamp: float) -> Optional[Path]:
+        """从源视频补抽指定时间点的帧，文件名排在其之前的粗采样帧之后。"""
+        coarse_index = int(timestamp // self.frame_interval_seconds) if self.frame_interval_seconds > 0 else 0
+        coarse_stem = Path(frame_name(coarse_index)).stem
+        output_path = Path(self.image_session_folder) / f"{coarse_stem}_r{int(round(timestamp * 1000)):08d}.png"
+        if not output_path.is_file() and not extract_frame_at_time_ffmpeg_sync(
+                self.refine_video_path, str(output_path), timestamp, cancel_token=self.cancel_token,
+                tracer=self.tracer):
+            self._log(f"补抽 {timestamp:.2f}s 处的帧失败。", LOG_WARN)
+            return None
+        self.refined_frame_count += 1
+        FRAMES_TOTAL.labels(state="refined").inc()
+        return output_path
+
+    def _bridge_gap(self, start_time: float, start_lines: List[str], end_time: float, end_lines: List[str],
+                    end_label: str, ocr_temp_dir: Path) -> Tuple[List[Tuple[str, List[str], float]], bool]:
+        """
+        上一张保留帧 (start) 与当前帧 (end) 不重叠时，说明中间可能有内容被跳过：
+        在中点补抽一帧，能与 start 接上就保留并继续细化后半段，否则先细化前半段；
+        时间间隔小于 min_refine_interval_seconds 时停止。
+
+        返回:
+            (按时间顺序新保留的中间帧 [(路径, 文本行, 时间点)], 最后一张保留帧是否已与当前帧重叠)
+        """
+        if end_time - start_time <= self.min_refine_interval_seconds or not self._is_running:
+            return [], False
+        mid_time = (start_time + end_time) / 2
+        mid_path = self._extract_refined_frame(mid_time)
+        if mid_path is None:
+            return [], False
+        mid_lines = self._frame_lines(mid_path, ocr_temp_dir)
+        if not mid_lines:
+            self._log(f"跳过: {mid_path.name} (补抽帧无有效内容)", LOG_DEBUG)
+            return [], False
+
+        bridged: List[Tuple[str, List[str], float]] = []
+        if not self._overlaps(start_lines, mid_lines, mid_path.name):
+            bridged, connected = self._bridge_gap(start_time, start_lines, mid_time, mid_lines,
+                                                  mid_path.name, ocr_temp_dir)
+            if not connected:
+                return bridged, False
+        self._log(f"保留: {mid_path.name} (自适应补抽帧，{mid_time:.2f}s)", LOG_DEBUG)
+        bridged.append((str(mid_path), mid_lines, mid_time))
+        if self._overlaps(mid_lines, end_lines, end_label):
+            return bridged, True
+        more, connected = self._bridge_gap(mid_time, mid_lines, end_time, end_lines, end_label, ocr_temp_dir)
+        return bridged + more, connected
+
     def run_filter(self) -> List[str]:
         """执行对会话文件夹中图像的OCR过滤过程。"""
         if not self.ocr_engine:
@@ -488,7 +1771,12 @@ class OcrFilter:
         self._log(f"开始视频帧 OCR 筛选: {self.image_session_folder}")
 
         session_path = Path(self.image_session_folder)
-        image_files = sorted(session_path.glob("frame_*.png"))  # 获取并排序所有帧图像
+        if self.frame_store is not None:
+            # 帧存储中的帧使用与文件模式相同的逻辑名称 (frame_000001.png ...)
+            image_files = [session_path / name for name in self.frame_store.names]
+        else:
+            # 获取并排序所有粗采样帧图像 (补抽帧由本次筛选按需生成)
+            image_files = sorted(path for path in session_path.glob("frame_*.png") if "_r" not in path.stem)
         if not image_files:
             self._log("未找到视频帧文件。")
             return []
@@ -496,111 +1784,89 @@ class OcrFilter:
         kept_images = []  # 存储被保留的图像路径
         # 存储上一张被保留图像的实际处理后的行列表，用于提取尾部
         last_kept_processed_lines_list: List[str] = []
-        last_kept_full_text_block = ""  # 上一张保留帧的完整文本
+        last_kept_time = 0.0  # 上一张保留帧在视频中的时间点 (秒)，用于自适应补抽
 
         total_files = len(image_files)
         ocr_temp_dir = session_path / "_ocr_temp_inputs"  # OCR临时输入目录
         ocr_temp_dir.mkdir(exist_ok=True)  # 创建临时目录
-        last_processed_path = None  # 跟踪最后处理的帧
 
         try:
+            self._open_checkpoint()
             for i, img_path in enumerate(image_files):
                 is_last_frame = (i == len(image_files) - 1)  # 判断是否为最后一帧
+                frame_time = i * self.frame_interval_seconds
                 
                 if not self._is_running:
                     self._log("OCR筛选被中断。")
                     break
                     
                 self._progress(i + 1, total_files)  # 报告进度
-                last_processed_path = img_path  # 更新最后处理的帧
-                path_for_ocr = img_path  # 默认为原始帧路径
                 should_keep = False  # 默认不保留
 
                 try:
-                    # --- 如果指定了OCR分析区域，则应用 ---
-                    if self.analysis_rect_tuple:
-                        try:
-                            pil_img_full = PILImage.open(img_path)
-                            x, y, w, h = self.analysis_rect_tuple
-                            # 验证区域是否有效
-                            if w > 0 and h > 0 and x >= 0 and y >= 0 and \
-                               x + w <= pil_img_full.width and y + h <= pil_img_full.height:
-
-                                img_cropped = pil_img_full.crop(
-                                    (x, y, x + w, y + h))  # 裁剪图像
-                                path_for_ocr = ocr_temp_dir / \
-                                    f"cropped_{img_path.name}"  # 更新OCR路径为裁剪后的图像
-                                img_cropped.save(path_for_ocr)
-                                img_cropped.close()  # 关闭裁剪后的图像对象
-                            else:
-                                self._log(
-                                    f"警告: OCR分析区域对 {img_path.name} 无效。将使用完整帧。")
-                            pil_img_full.close()  # 关闭完整图像对象
-                        except Exception as img_err:
-                            self._log(
-                                f"处理图片 {img_path.name} 时出错 (裁剪区域): {img_err}")
-                            path_for_ocr = img_path  # 出错则回退到使用原始帧
-
-                    # --- 执行 OCR ---
-                    ocr_results = self.ocr_engine.ocr(
-                        str(path_for_ocr),cls=True)
-
-                    current_raw_lines = []  # 当前帧的原始OCR行
-                    if ocr_results and ocr_results[0]:  # 检查结果是否有效
-                        current_raw_lines = [item[1][0] for item in ocr_results[0] if item and len(
-                            item) > 1 and len(item[1]) > 0]
-
-                    # --- 预处理OCR结果 ---
-                    current_processed_lines = self._preprocess_ocr_lines(
-                        current_raw_lines)
-                    current_full_text_block = "\n".join(current_processed_lines)
+                    current_processed_lines = self._frame_lines(img_path, ocr_temp_dir)
                     
                     if not current_processed_lines:  # 如果处理后没有有效内容
                         if is_last_frame:  # 如果是最后一帧但没有内容，仍然保留
                             should_keep = True
-                            self._log(f"保留: {img_path.name} (最后一帧，即使没有有效内容)")
+                            self._log(f"保留: {img_path.name} (最后一帧，即使没有有效内容)", LOG_DEBUG)
                         else:
-                            self._log(f"跳过: {img_path.name} (预处理后无有效内容)")
+                            self._log(f"跳过: {img_path.name} (预处理后无有效内容)", LOG_DEBUG)
                             continue  # 跳过此帧
                     
                     # --- 判断是否保留当前帧 ---
                     if not kept_images:  # 如果是第一张有效帧
                         should_keep = True
-                        self._log(f"保留: {img_path.name} (首张有效帧)")
+                        self._log(f"保留: {img_path.name} (首张有效帧)", LOG_DEBUG)
                     else:
-                        # 只检查重叠条件，不再检查"足够的新内容"
-                        tail_of_last_kept = last_kept_processed_lines_list[-self.overlap_check_tail_lines:] if last_kept_processed_lines_list else []
-                        head_of_current = current_processed_lines[:self.overlap_check_head_lines] if current_processed_lines else []
-                        
-                        # 使用模糊匹配检查重叠
-                        has_overlap_fuzzy = self._lines_overlap_fuzzy(tail_of_last_kept, head_of_current)
+                        # 只检查重叠条件，不再检查"足够的新内容"；使用模糊匹配检查重叠
+                        has_overlap_fuzzy = self._overlaps(
+                            last_kept_processed_lines_list, current_processed_lines, img_path.name)
+                        if not has_overlap_fuzzy and self.refine_video_path and current_processed_lines:
+                            # 自适应采样：在两帧之间补抽帧，把可能跳过的内容接上
+                            bridged, has_overlap_fuzzy = self._bridge_gap(
+                                last_kept_time, last_kept_processed_lines_list, frame_time,
+                                current_processed_lines, img_path.name, ocr_temp_dir)
+                            for bridged_path, bridged_lines, bridged_time in bridged:
+                                kept_images.append(bridged_path)
+                                last_kept_processed_lines_list = bridged_lines
+                                last_kept_time = bridged_time
                         
                         if has_overlap_fuzzy or is_last_frame:  # 有重叠或者是最后一帧
                             should_keep = True
                             if has_overlap_fuzzy:
-                                self._log(f"保留: {img_path.name} (模糊重叠通过)")
+                                self._log(f"保留: {img_path.name} (模糊重叠通过)", LOG_DEBUG)
                             if is_last_frame:
-                                self._log(f"保留: {img_path.name} (最后一帧)")
+                                self._log(f"保留: {img_path.name} (最后一帧)", LOG_DEBUG)
                         else:
-                            self._log(f"跳过: {img_path.name} (模糊重叠未通过)")
+                            self._log(f"跳过: {img_path.name} (模糊重叠未通过)", LOG_DEBUG)
                     
                     if should_keep:
                         kept_images.append(str(img_path))
                         last_kept_processed_lines_list = current_processed_lines
-                        last_kept_full_text_block = current_full_text_block  # 更新为当前帧的完整文本块
+                        last_kept_time = frame_time
 
                 except Exception as ocr_err:
-                    self._log(f"OCR处理 {img_path.name} 失败: {ocr_err}")
+                    self._log(f"OCR处理 {img_path.name} 失败: {ocr_err}", LOG_WARN)
                     # 如果是最后一帧且处理失败，仍然保留
                     if is_last_frame:
                         kept_images.append(str(img_path))
                         self._log(f"尽管OCR失败，仍保留最后一帧: {img_path.name}")
 
         finally:
+            self._close_checkpoint()
             if ocr_temp_dir.exists():
                 try: shutil.rmtree(ocr_temp_dir)
                 except Exception as clean_err: self._log(f"清理OCR临时目录失败: {clean_err}")
 
+        FRAMES_TOTAL.labels(state="kept").inc(len(kept_images))
+        if self.refine_video_path:
+            self._log(f"自适应采样共补抽 {self.refined_frame_count} 帧。")
+        if self.resumed_frame_count:
+            self._log(f"{self.resumed_frame_count} 帧的OCR结果取自检查点。")
+        if self._exclusion.hits:
+            summary = "，".join(f"'{rule}' {hits} 次" for rule, hits in self._exclusion.hit_summary())
+            self._log(f"排除规则命中: {summary}")
         self._log(f"OCR筛选完成。保留 {len(kept_images)} 张帧。")
         self._progress(total_files, total_files)
         return kept_images
@@ -611,6 +1877,95 @@ class OcrFilter:
         self._log("OCR 筛选停止信号已接收。")
 
 
+# --- 源图嵌入 PDF 的辅助类 ---
+class _SourceImageTiles:
+    """
+    将长图按 PDF_SOURCE_TILE_HEIGHT 分块，每个图块在 PDF 中只作为一个 Form XObject 嵌入一次。
+    图块在首次被某个单元格引用时才裁剪和编码。
+    """
+
+    def __init__(self, source_image_path: str, tile_height: int = PDF_SOURCE_TILE_HEIGHT):
+        self.image = PILImage.open(source_image_path)
+        self.image.load()
+        self.is_jpeg = self.image.format == 'JPEG'
+        self.img_width, self.img_height = self.image.size
+        self.tile_height = max(1, tile_height)
+        self._registered = set()  # 已嵌入当前文档的图块名称
+
+    def tile_range(self, index: int) -> Tuple[int, int]:
+        """返回图块的 (上, 下) 像素范围。"""
+        top = index * self.tile_height
+        return top, min(top + self.tile_height, self.img_height)
+
+    def tiles_for_range(self, top: int, bottom: int) -> range:
+        """返回与 [top, bottom) 行区间相交的图块索引。"""
+        return range(top // self.tile_height, (max(top, bottom - 1)) // self.tile_height + 1)
+
+    def ensure_form(self, canvas, index: int) -> str:
+        """确保图块已作为 Form XObject 写入文档，返回其名称。"""
+        name = f"srcTile{index}"
+        if name in self._registered:
+            return name
+        top, bottom = self.tile_range(index)
+        tile = self.image.crop((0, top, self.img_width, bottom))
+        try:
+            if tile.mode not in ('RGB', 'L'):
+                converted = tile.convert('RGB')
+                tile.close()
+                tile = converted
+            if self.is_jpeg:
+                # JPEG 源图的图块以 JPEG 直接嵌入 (DCTDecode)，避免解压后按原始像素存储
+                buffer = io.BytesIO()
+                tile.save(buffer, format='JPEG', quality=95)
+                buffer.seek(0)
+                reader = ImageReader(buffer)
+            else:
+                reader = ImageReader(tile)
+            canvas.beginForm(name, 0, 0, self.img_width, bottom - top)
+            canvas.drawImage(reader, 0, 0, width=self.img_width, height=bottom - top)
+            canvas.endForm()
+        finally:
+            tile.close()
+        self._registered.add(name)
+        return name
+
+    def close(self):
+        self.image.close()
+
+
+class _SourceImageRegion(Flowable):
+    """将源长图中 [top, bottom) 行区间绘制为单元格内容: 引用共享图块并按单元格裁剪、平移。"""
+
+    def __init__(self, tiles: _SourceImageTiles, top: int, bottom: int, width: float, height: float):
+        super().__init__()
+        self.tiles = tiles
+        self.top = top
+        self.bottom = bottom
+        self.width = width
+        self.height = height
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self):
+        canvas = self.canv
+        scale = self.width / self.tiles.img_width
+        canvas.saveState()
+        clip = canvas.beginPath()
+        clip.rect(0, 0, self.width, self.height)
+        canvas.clipPath(clip, stroke=0, fill=0)
+        for index in self.tiles.tiles_for_range(self.top, self.bottom):
+            form_name = self.tiles.ensure_form(canvas, index)
+            _, tile_bottom = self.tiles.tile_range(index)
+            canvas.saveState()
+            # PDF 坐标原点在左下角: 图块底边相对于区域顶部的偏移决定其 y 位置
+            canvas.translate(0, self.height - (tile_bottom - self.top) * scale)
+            canvas.scale(scale, scale)
+            canvas.doForm(form_name)
+            canvas.restoreState()
+        canvas.restoreState()
+
+
 # --- PDF 生成器类 ---
 class PdfGenerator:
     """根据指定的布局从图像路径列表生成PDF文档。"""
@@ -619,8 +1974,12 @@ class PdfGenerator:
                  images_per_row: int, images_per_col: int,
                  layout: str = 'grid',  # 'grid' (行优先) 或 'column' (列优先)
                  page_title: str = "聊天记录",  # PDF 页面标题（此参数目前未在生成内容中使用，但可保留供未来扩展）
-                 log_callback: Optional[Callable[[str], None]] = None,
-                 progress_callback: Optional[Callable[[int, int], None]] = None):
+                 log_callback: Optional[Callable[..., None]] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None,
+                 source_image_path: Optional[str] = None,
+                 image_regions: Optional[List[Tuple[int, int]]] = None,
+                 frame_store: Optional[FrameStore] = None,
+                 tracer: NullTracer = NULL_TRACER):
         self.image_paths = image_paths  # 图片路径列表
         self.output_pdf_path = output_pdf_path  # 输出PDF的路径
         self.images_per_row = max(1, images_per_row)  # 每页列数 (C)
@@ -631,26 +1990,56 @@ class PdfGenerator:
         self.log_callback = log_callback  # 日志回调
         self.progress_callback = progress_callback  # 进度回调
         self._is_running = True  # 控制运行状态的标志
-
-    def _log(self, msg: str):
+        # 源图嵌入模式: 单元格直接引用源长图的行区间 (与 image_paths 一一对应)，不使用切片文件
+        self.source_image_path = source_image_path
+        self.image_regions = image_regions
+        self._source_tiles: Optional[_SourceImageTiles] = None
+        # 帧存储模式: image_paths 中不存在于磁盘的帧按名称从存储中读取
+        self.frame_store = frame_store
+        self.tracer = tracer  # 可选的追踪器，记录每页的排版与渲染耗时
+
+    def _log(self, msg: str, level: str = LOG_INFO):
         """记录日志消息。"""
         if self.log_callback:
-            self.log_callback(msg)
+            self.log_callback(msg, level)
 
     def _progress(self, current: int, total: int):
         """报告进度。"""
         if self.progress_callback:
             self.progress_callback(current, total)
 
+    def _create_region_flowable(self, region: Tuple[int, int], container_width: float, container_height: float) -> Optional[Flowable]:
+        """创建按比例缩放的源图区域单元格。"""
+        try:
+            top, bottom = region
+            region_w, region_h = self._source_tiles.img_width, bottom - top
+            if region_w <= 0 or region_h <= 0:
+                raise ValueError("无效的区域尺寸")
+            ratio = min(container_width / region_w, container_height / region_h)  # 保持宽高比
+            return _SourceImageRegion(self._source_tiles, top, bottom, region_w * ratio, region_h * ratio)
+        except Exception as e:
+            self._log(f"创建源图区域 {region} 失败: {e}", LOG_WARN)
+            return None
+
+    def _create_cell(self, item_index: int, container_width: float, container_height: float) -> Optional[Flowable]:
+        """根据导出方式创建单元格内容。"""
+        if self._source_tiles is not None:
+            return self._create_region_flowable(self.image_regions[item_index], container_width, container_height)
+        return self._create_rl_image(self.image_paths[item_index], container_width, container_height)
+
     def _create_rl_image(self, img_path: str, container_width: float, container_height: float) -> Optional[ReportLabImage]:
         """创建按比例缩放以适应容器的 ReportLab Image 对象。"""
         try:
             img_obj = Path(img_path)
+            image_source = img_obj
             if not img_obj.is_file():
-                raise FileNotFoundError(f"图片文件未找到: {img_path}")
+                store_index = self.frame_store.index_of(img_obj.name) if self.frame_store is not None else None
+                if store_index is None:
+                    raise FileNotFoundError(f"图片文件未找到: {img_path}")
+                image_source = io.BytesIO(self.frame_store.get_bytes(store_index))
 
             # 使用上下文管理器打开图像，确保其被关闭
-            with PILImage.open(img_obj) as pil_img:
+            with PILImage.open(image_source) as pil_img:
                 original_w, original_h = pil_img.size
                 if original_w <= 0 or original_h <= 0:
                     raise ValueError("无效的图片尺寸")
@@ -662,16 +2051,19 @@ class PdfGenerator:
                 img_display_w = original_w * ratio
                 img_display_h = original_h * ratio
                 self._log(
-                    f"  图像: {Path(img_path).name}, 原始尺寸: {original_w}x{original_h}")
+                    f"  图像: {Path(img_path).name}, 原始尺寸: {original_w}x{original_h}", LOG_DEBUG)
                 self._log(
-                    f"  容器尺寸: {container_width:.2f}x{container_height:.2f}")
+                    f"  容器尺寸: {container_width:.2f}x{container_height:.2f}", LOG_DEBUG)
                 self._log(
-                    f"  缩放比例: {ratio:.2f}, 显示尺寸: {img_display_w:.2f}x{img_display_h:.2f}")
+                    f"  缩放比例: {ratio:.2f}, 显示尺寸: {img_display_w:.2f}x{img_display_h:.2f}", LOG_DEBUG)
 
             # 在 'with' 块外部创建 ReportLabImage
+            if isinstance(image_source, io.BytesIO):
+                image_source.seek(0)
+                return ReportLabImage(image_source, width=img_display_w, height=img_display_h)
             return ReportLabImage(img_path, width=img_display_w, height=img_display_h)
         except Exception as e:
-            self._log(f"创建图片对象 {Path(img_path).name} 失败: {e}")
+            self._log(f"创建图片对象 {Path(img_path).name} 失败: {e}", LOG_WARN)
             return None
 
     def generate_pdf(self) -> Tuple[bool, str]:
@@ -692,6 +2084,20 @@ class PdfGenerator:
             self._log(err_msg)
             return False, err_msg
 
+        if self.source_image_path:
+            if not self.image_regions or len(self.image_regions) != len(self.image_paths):
+                err_msg = "源图嵌入模式需要与图片列表一一对应的区域列表。"
+                self._log(err_msg)
+                return False, err_msg
+            try:
+                self._source_tiles = _SourceImageTiles(self.source_image_path)
+                self._log(f"  源图嵌入模式: {Path(self.source_image_path).name}, "
+                          f"每 {self._source_tiles.tile_height}px 为一个图块，只嵌入一次")
+            except Exception as e:
+                err_msg = f"打开源图 {self.source_image_path} 失败: {e}"
+                self._log(err_msg)
+                return False, err_msg
+
         try:
             # 设置文档模板
             doc = SimpleDocTemplate(str(output_pdf_path_obj), pagesize=A4,
@@ -701,7 +2107,7 @@ class PdfGenerator:
 
             # 计算内容区域和单元格尺寸
             content_width, content_height = doc.width, doc.height  # 可用内容区域
-            self._log(f"  文档可用内容区 (doc.width, doc.height): {content_width:.2f}pt x {content_height:.2f}pt")
+            self._log(f"  文档可用内容区 (doc.width, doc.height): {content_width:.2f}pt x {content_height:.2f}pt", LOG_DEBUG)
             
             # 增加安全系数，确保全部内容能够容纳
             safety_factor = 0.98  # 整体减少2%的空间来避免边界问题
@@ -714,17 +2120,17 @@ class PdfGenerator:
             cell_total_height = adjusted_content_height / self.images_per_col
             cell_total_width = content_width / self.images_per_row
             
-            self._log(f"  每页行数: {self.images_per_col}, 每页列数: {self.images_per_row}")
-            self._log(f"  调整后内容高度: {adjusted_content_height:.2f}pt")
-            self._log(f"  单元格总高度: {cell_total_height:.2f}pt")
+            self._log(f"  每页行数: {self.images_per_col}, 每页列数: {self.images_per_row}", LOG_DEBUG)
+            self._log(f"  调整后内容高度: {adjusted_content_height:.2f}pt", LOG_DEBUG)
+            self._log(f"  单元格总高度: {cell_total_height:.2f}pt", LOG_DEBUG)
             
             if cell_total_height < 10*mm:
-                self._log(f"警告: 计算出的单元格高度 {cell_total_height:.2f}pt 过小，可能导致问题。检查页边距和行列数设置。")
+                self._log(f"警告: 计算出的单元格高度 {cell_total_height:.2f}pt 过小，可能导致问题。检查页边距和行列数设置。", LOG_WARN)
             
             # 确保容器尺寸为正
             img_container_width = max(1*mm, cell_total_width - 2 * cell_padding)
             img_container_height = max(1*mm, cell_total_height - 2 * cell_padding)
-            self._log(f"  单元格内图片容器尺寸: {img_container_width:.2f}pt x {img_container_height:.2f}pt")
+            self._log(f"  单元格内图片容器尺寸: {img_container_width:.2f}pt x {img_container_height:.2f}pt", LOG_DEBUG)
             
             images_per_page = self.images_per_row * self.images_per_col  # 每页图片数量
             total_images = len(self.image_paths)  # 总图片数量
@@ -753,7 +2159,8 @@ class PdfGenerator:
                 if not self._is_running:
                     self._log("PDF生成中断。")
                     return False, "用户中断。"
-                self._log(f"  正在处理 PDF 第 {page_num + 1}/{num_pages} 页...")
+                self._log(f"  正在处理 PDF 第 {page_num + 1}/{num_pages} 页...", LOG_DEBUG)
+                page_layout_start = time.time()
 
                 start_idx = page_num * images_per_page
                 end_idx = min(start_idx + images_per_page, total_images)
@@ -772,10 +2179,9 @@ class PdfGenerator:
                     for c in range(self.images_per_row):  # 遍历列
                         for r in range(self.images_per_col):  # 遍历行
                             if img_idx_on_page < len(page_image_paths):
-                                img_path = page_image_paths[img_idx_on_page]
                                 # 修改这里确保图像正确缩放
-                                rl_image = self._create_rl_image(
-                                    img_path, img_container_width, img_container_height)
+                                rl_image = self._create_cell(
+                                    start_idx + img_idx_on_page, img_container_width, img_container_height)
                                 if rl_image:
                                     page_table_data[r][c] = rl_image
                                 self._progress(
@@ -787,13 +2193,12 @@ class PdfGenerator:
                             break
                 else:  # 默认为 'grid' (行优先, 左右优先)
                     if self.layout != 'grid':
-                        self._log(f"    未知布局 '{self.layout}', 使用 grid 布局。")
+                        self._log(f"    未知布局 '{self.layout}', 使用 grid 布局。", LOG_WARN)
                     for r in range(self.images_per_col):  # 遍历行
                         for c in range(self.images_per_row):  # 遍历列
                             if img_idx_on_page < len(page_image_paths):
-                                img_path = page_image_paths[img_idx_on_page]
-                                rl_image = self._create_rl_image(
-                                    img_path, img_container_width, img_container_height)
+                                rl_image = self._create_cell(
+                                    start_idx + img_idx_on_page, img_container_width, img_container_height)
                                 if rl_image:
                                     page_table_data[r][c] = rl_image
                                 self._progress(
@@ -810,19 +2215,36 @@ class PdfGenerator:
                               rowHeights=row_heights)
                 table.setStyle(img_style)
                 story.append(table)
+                self.tracer.complete("pdf_page_layout", "pdf", page_layout_start, time.time() - page_layout_start,
+                                     page=page_num + 1, images=len(page_image_paths))
 
                 if page_num < num_pages - 1:  # 如果不是最后一页，则添加分页符
                     story.append(PageBreak())
 
             # 构建最终的PDF文档
             self._log("正在构建最终 PDF 文档...")
-            doc.build(story)
+            page_render_starts: List[float] = []  # 每页开始渲染的时间，由 ReportLab 的页面回调记录
+
+            def _mark_page_start(canvas, _doc):
+                page_render_starts.append(time.time())
+
+            with self.tracer.span("pdf_build", "pdf", pages=num_pages):
+                if self.tracer.enabled:
+                    doc.build(story, onFirstPage=_mark_page_start, onLaterPages=_mark_page_start)
+                else:
+                    doc.build(story)
+            build_end = time.time()
+            for page_index, page_start in enumerate(page_render_starts):
+                page_end = page_render_starts[page_index + 1] if page_index + 1 < len(page_render_starts) else build_end
+                self.tracer.complete("pdf_page_render", "pdf", page_start, page_end - page_start, page=page_index + 1)
             self._log(f"✅ PDF 成功生成: {self.output_pdf_path}")
+            PDF_IMAGES_TOTAL.inc(total_images)
+            PDF_OUTPUT_BYTES.observe(output_pdf_path_obj.stat().st_size)
             self._progress(total_images, total_images)  # 确保进度为100%
-            self._log(f"  文档可用内容区: {content_width:.2f}x{content_height:.2f}")
-            self._log(f"  调整后内容区: {adjusted_content_height:.2f}pt")
-            self._log(f"  单元格总尺寸: {cell_total_width:.2f}x{cell_total_height:.2f}")
-            self._log(f"  单元格内图片容器尺寸: {img_container_width:.2f}x{img_container_height:.2f}")
+            self._log(f"  文档可用内容区: {content_width:.2f}x{content_height:.2f}", LOG_DEBUG)
+            self._log(f"  调整后内容区: {adjusted_content_height:.2f}pt", LOG_DEBUG)
+            self._log(f"  单元格总尺寸: {cell_total_width:.2f}x{cell_total_height:.2f}", LOG_DEBUG)
+            self._log(f"  单元格内图片容器尺寸: {img_container_width:.2f}x{img_container_height:.2f}", LOG_DEBUG)
             return True, str(output_pdf_path_obj)
 
         except Exception as e:
@@ -831,6 +2253,10 @@ class PdfGenerator:
             import traceback  # 仅在此处导入，因为不常用
             self._log(traceback.format_exc())  # 记录完整的堆栈跟踪信息以便调试
             return False, f"PDF 生成失败: {e}"
+        finally:
+            if self._source_tiles is not None:
+                self._source_tiles.close()
+                self._source_tiles = None
 
     def stop(self):
         """向PDF生成过程发送停止信号。"""
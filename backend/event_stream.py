@@ -0,0 +1,131 @@
+# backend/event_stream.py
+"""
+Per-session status buffering for the WebSocket stream.
+
+Pipelines run in executor threads and may emit thousands of log lines per
+job.  Instead of scheduling one task and one WebSocket frame per line, every
+update is appended to a ``SessionEventBuffer`` (a cheap, thread-safe
+operation) and a single flusher coroutine drains the buffers every
+``EVENT_FLUSH_INTERVAL_SECONDS``, sending each session one JSON array.
+
+The buffer is bounded: when a client falls behind, debug lines are dropped
+first, then the oldest info lines.  Consecutive progress-only updates for the
+same stage are coalesced into the latest one.
+
+Flushed events are numbered and kept in a bounded ``SessionEventLog`` so a
+client reconnecting with ``?last_seq=N`` (or a second viewer) can replay what
+it missed.  Key statuses (previews, results, errors) stay replayable even
+after they scroll out of the log window.
+"""
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+EVENT_FLUSH_INTERVAL_SECONDS = float(os.getenv("EVENT_FLUSH_INTERVAL_MS", "200")) / 1000
+EVENT_BUFFER_MAX_EVENTS = int(os.getenv("EVENT_BUFFER_MAX_EVENTS", "500"))
+WS_SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+EVENT_LOG_MAX_EVENTS = int(os.getenv("EVENT_LOG_MAX_EVENTS", "1000"))
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warn": 30}
+DEFAULT_LOG_LEVEL = "info"
+
+
+def level_rank(level: str) -> int:
+    return LOG_LEVELS.get(level, LOG_LEVELS[DEFAULT_LOG_LEVEL])
+
+
+# Statuses whose latest occurrence must survive log eviction for replay
+STICKY_STATUSES = {
+    "ocr_completed", "preview_ready", "slicing_complete",
+    "completed", "completed_no_pdf", "error", "trace_ready", "batch_progress",
+}
+
+
+def is_key_event(event: Dict[str, Any]) -> bool:
+    """Progress, preview and result updates are never filtered out by log level."""
+    return event.get("progress") is not None or bool(event.get("preview_images")) or bool(event.get("result_url"))
+
+
+def _is_progress_only(event: Dict[str, Any]) -> bool:
+    return (event.get("progress") is not None and not event.get("preview_images")
+            and not event.get("result_url"))
+
+
+class SessionEventBuffer:
+    """Bounded, thread-safe buffer of TaskStatus dicts for one session."""
+
+    def __init__(self, max_events: int = EVENT_BUFFER_MAX_EVENTS):
+        self.max_events = max_events
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._lock = threading.Lock()
+        self._dropped = 0
+
+    def push(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            if (_is_progress_only(event) and self._events
+                    and _is_progress_only(self._events[-1])
+                    and self._events[-1].get("status") == event.get("status")):
+                self._events[-1] = event  # Only the latest progress value matters
+                return
+            self._events.append(event)
+            if len(self._events) > self.max_events:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drops the oldest lowest-priority event. Progress/preview/result events are kept when possible."""
+        for rank in (LOG_LEVELS["debug"], LOG_LEVELS["info"]):
+            for i, queued in enumerate(self._events):
+                if level_rank(queued.get("level", DEFAULT_LOG_LEVEL)) <= rank and not is_key_event(queued):
+                    del self._events[i]
+                    self._dropped += 1
+                    return
+        self._events.popleft()
+        self._dropped += 1
+
+    def drain(self) -> Tuple[List[Dict[str, Any]], int]:
+        """Returns (buffered events, number of events dropped since the last drain) and clears the buffer."""
+        with self._lock:
+            events, dropped = list(self._events), self._dropped
+            self._events.clear()
+            self._dropped = 0
+        return events, dropped
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+
+class SessionEventLog:
+    """Bounded, sequence-numbered history of flushed events for one session."""
+
+    def __init__(self, max_events: int = EVENT_LOG_MAX_EVENTS):
+        self._events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self._sticky: Dict[str, Dict[str, Any]] = {}  # status -> latest event with that status
+        self.last_seq = 0
+
+    def append(self, events: List[Dict[str, Any]]) -> None:
+        """Assigns sequence numbers (stored in each event's 'seq') and records the events."""
+        for event in events:
+            self.last_seq += 1
+            event["seq"] = self.last_seq
+            self._events.append(event)
+            if event.get("status") in STICKY_STATUSES:
+                self._sticky[event["status"]] = event
+
+    def since(self, last_seq: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Returns (events with seq > last_seq, gap). gap is True when some of
+        those events were already evicted; the latest key statuses are then
+        included in their place.
+        """
+        if last_seq > self.last_seq:
+            last_seq = 0  # The client saw a previous server process; replay everything retained
+        if last_seq == self.last_seq:
+            return [], False
+        oldest = self._events[0]["seq"] if self._events else self.last_seq + 1
+        retained = [event for event in self._events if event["seq"] > last_seq]
+        if last_seq + 1 >= oldest:
+            return retained, False
+        missed_sticky = [event for event in self._sticky.values() if last_seq < event["seq"] < oldest]
+        return sorted(missed_sticky, key=lambda event: event["seq"]) + retained, True
@@ -0,0 +1,108 @@
+# backend/exclusion.py
+"""
+Exclusion rules for OCR lines.
+
+Each entry of a job's exclusion list is one rule; an optional prefix picks
+how it matches the stripped line:
+
+    微信                 exact whole line (no prefix, or "exact:")
+    contains:已读        the line contains the text
+    prefix:对方正在输入  the line starts with the text
+    re:^\\d{1,2}:\\d{2}$ the regular expression matches somewhere in the line
+
+``ExclusionMatcher`` compiles a list once per job: exact rules become a set
+lookup, and all substring, prefix and regex rules are folded into one
+alternation each, so a line is tested in a single pass per kind however many
+rules there are. Which rule matched is recovered from the named group of the
+alternation, so per-rule hit counts cost nothing extra.
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Pattern, Tuple
+
+RULE_KINDS = ("exact", "contains", "prefix", "re")
+
+
+def parse_rule(entry: str) -> Optional[Tuple[str, str]]:
+    """Splits one exclusion list entry into (kind, value); None for a blank entry."""
+    entry = entry.strip()
+    kind, sep, value = entry.partition(":")
+    if sep and kind in RULE_KINDS:
+        value = value.strip()
+        return (kind, value) if value else None
+    return ("exact", entry) if entry else None
+
+
+class ExclusionMatcher:
+    """Compiled exclusion rules of one job. Raises ValueError for an invalid regex."""
+
+    def __init__(self, entries: Optional[List[str]] = None):
+        self.rules: List[Tuple[str, str]] = []
+        for entry in entries or []:
+            rule = parse_rule(entry)
+            if rule is not None and rule not in self.rules:
+                self.rules.append(rule)
+        self._exact: Dict[str, int] = {}
+        alternatives: Dict[str, List[str]] = {"contains": [], "prefix": []}
+        regexes: List[Tuple[int, Pattern]] = []
+        for index, (kind, value) in enumerate(self.rules):
+            if kind == "exact":
+                self._exact.setdefault(value, index)
+            elif kind == "re":
+                try:
+                    regexes.append((index, re.compile(value)))
+                except re.error as e:
+                    raise ValueError(f"排除规则中的正则表达式无效 '{value}': {e}") from e
+            else:
+                alternatives[kind].append(f"(?P<r{index}>{re.escape(value)})")
+        # Longer literals first, so a rule contained in another one does not shadow it
+        contains = sorted(alternatives["contains"], key=len, reverse=True)
+        self._contains = re.compile("|".join(contains)) if contains else None
+        self._prefix = re.compile("|".join(alternatives["prefix"])) if alternatives["prefix"] else None
+        # Regexes with groups of their own (backreferences count groups, names could clash) or
+        # inline flags only work compiled alone, so they are searched one by one
+        combinable = [(index, pattern) for index, pattern in regexes
+                      if not pattern.groups and not pattern.pattern.startswith("(?")]
+        self._standalone: List[Tuple[int, Pattern]] = [item for item in regexes if item not in combinable]
+        self._regex = None
+        if combinable:
+            try:
+                self._regex = re.compile("|".join(f"(?P<r{index}>{pattern.pattern})" for index, pattern in combinable))
+            except re.error:  # e.g. an inline flag in the middle of a pattern
+                self._standalone = regexes
+        self.hits: Counter = Counter()  # Rule index -> number of excluded lines
+
+    def __bool__(self) -> bool:
+        return bool(self.rules)
+
+    def match(self, line: str) -> Optional[int]:
+        """Index of a rule that excludes the stripped line, or None."""
+        index = self._exact.get(line)
+        if index is not None:
+            return index
+        for pattern, method in ((self._prefix, "match"), (self._contains, "search"), (self._regex, "search")):
+            if pattern is not None:
+                found = getattr(pattern, method)(line)
+                if found:
+                    return int(found.lastgroup[1:])
+        for index, pattern in self._standalone:
+            if pattern.search(line):
+                return index
+        return None
+
+    def is_excluded(self, line: str, count: bool = True) -> bool:
+        """Whether the stripped line is excluded; counts the hit unless count is False."""
+        index = self.match(line)
+        if index is None:
+            return False
+        if count:
+            self.hits[index] += 1
+        return True
+
+    def hit_summary(self) -> List[Tuple[str, int]]:
+        """(entry, hits) of every rule that matched, most hits first."""
+        return [(self.describe(index), hits) for index, hits in self.hits.most_common()]
+
+    def describe(self, index: int) -> str:
+        kind, value = self.rules[index]
+        return value if kind == "exact" else f"{kind}:{value}"
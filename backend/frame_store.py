@@ -0,0 +1,154 @@
+# backend/frame_store.py
+"""
+Single-file container for sampled video frames.
+
+Instead of one ``frame_*.png`` per sample, FFmpeg writes a PNG stream to
+stdout (``-f image2pipe``) which is split and appended to one file:
+
+    [png 0][png 1]...[png N-1][index: N x (u64 offset, u32 length)][footer]
+
+The footer is ``MAGIC`` + u64 index offset + u32 frame count.  Readers
+memory-map the file and slice frames by index, so listing, reading and
+deleting frames no longer touches thousands of inodes.  Frames keep their
+logical names (``frame_000001.png`` ...), which lets previews, ordering and
+``kept_images`` work the same as with loose files.
+"""
+import io
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from PIL import Image as PILImage
+
+FRAME_STORE_FILENAME = "frames.fstore"
+MAGIC = b"CETFRM01"
+_INDEX_ENTRY = struct.Struct("<QI")  # offset, length
+_FOOTER = struct.Struct("<8sQI")  # magic, index offset, frame count
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def frame_name(index: int) -> str:
+    """Logical file name of the frame at index (matches FFmpeg's frame_%06d.png numbering)."""
+    return f"frame_{index + 1:06d}.png"
+
+
+class PngStreamSplitter:
+    """Splits a concatenated PNG byte stream (FFmpeg image2pipe) into individual images."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._pos = 8  # Parse cursor; chunks start after the 8-byte signature
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        self._buffer += data
+        while True:
+            if len(self._buffer) < 8:
+                return
+            if self._buffer[:8] != PNG_SIGNATURE:
+                raise ValueError("PNG 流格式错误: 缺少文件签名。")
+            if self._pos + 8 > len(self._buffer):
+                return
+            length = struct.unpack(">I", self._buffer[self._pos:self._pos + 4])[0]
+            chunk_type = bytes(self._buffer[self._pos + 4:self._pos + 8])
+            chunk_end = self._pos + 12 + length  # length + type + data + crc
+            if chunk_end > len(self._buffer):
+                return
+            self._pos = chunk_end
+            if chunk_type == b"IEND":
+                image = bytes(self._buffer[:chunk_end])
+                del self._buffer[:chunk_end]
+                self._pos = 8
+                yield image
+
+    @property
+    def pending_bytes(self) -> int:
+        return len(self._buffer)
+
+
+class FrameStoreWriter:
+    """Appends encoded frames to a new store file. The index is written on close()."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "wb")
+        self._entries: List[Tuple[int, int]] = []
+        self._offset = 0
+
+    def append(self, data: bytes) -> int:
+        """Appends one encoded frame and returns its index."""
+        self._file.write(data)
+        self._entries.append((self._offset, len(data)))
+        self._offset += len(data)
+        return len(self._entries) - 1
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        if self._file.closed:
+            return
+        index_offset = self._offset
+        for entry in self._entries:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.write(_FOOTER.pack(MAGIC, index_offset, len(self._entries)))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FrameStore:
+    """Read-only, memory-mapped view of a frame store file."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            self._file.close()
+            raise ValueError(f"帧存储文件为空: {path}")
+        if len(self._mmap) < _FOOTER.size:
+            self.close()
+            raise ValueError(f"帧存储文件不完整: {path}")
+        magic, index_offset, count = _FOOTER.unpack_from(self._mmap, len(self._mmap) - _FOOTER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"无效的帧存储文件: {path}")
+        self._entries = [_INDEX_ENTRY.unpack_from(self._mmap, index_offset + i * _INDEX_ENTRY.size)
+                         for i in range(count)]
+        self.names = [frame_name(i) for i in range(count)]
+        self._index_by_name: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def index_of(self, name: str) -> Optional[int]:
+        """Index of a frame by its logical name (a path's name part is accepted too)."""
+        return self._index_by_name.get(Path(name).name)
+
+    def get_bytes(self, index: int) -> bytes:
+        offset, length = self._entries[index]
+        return self._mmap[offset:offset + length]
+
+    def open_image(self, index: int) -> PILImage.Image:
+        return PILImage.open(io.BytesIO(self.get_bytes(index)))
+
+    def total_bytes(self) -> int:
+        return len(self._mmap)
+
+    def close(self):
+        if getattr(self, "_mmap", None) is not None and not self._mmap.closed:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
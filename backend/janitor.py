@@ -0,0 +1,292 @@
+# backend/janitor.py
+"""
+Background cleanup of session directories.
+
+Every session owns ``temp_sessions/<session_id>/`` (uploads, raw frames,
+slices) and ``output/<session_id>/`` (PDFs).  The janitor removes them when:
+
+* the session has been idle for longer than ``SESSION_IDLE_TTL_HOURS``;
+* the total size exceeds ``DISK_QUOTA_GB`` -- finished sessions are then
+  evicted least-recently-used first.
+
+Sessions with a queued/running job or a connected WebSocket are never
+touched.  On startup, leftover directories that the session store does not
+know about are adopted (if recent and recognisable) or removed, and jobs
+owned by a process that no longer exists are marked ``interrupted``.  In
+inline mode that includes ``queued`` jobs: they were waiting in a process's
+background tasks, which did not survive it.
+"""
+import os
+import shutil
+import socket
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.batch import VIDEO_EXTENSIONS, display_name
+from backend.session_store import SessionStore
+
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_HOURS", "24")) * 3600
+DISK_QUOTA_BYTES = int(float(os.getenv("DISK_QUOTA_GB", "0")) * 1024 ** 3)  # 0 disables the quota
+JANITOR_INTERVAL_SECONDS = float(os.getenv("JANITOR_INTERVAL_SECONDS", "300"))
+
+ACTIVE_JOB_STATUSES = ("queued", "running", "cancelling")
+
+
+def current_process_owner() -> str:
+    """Identifies this process in the session store's job_owner field."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner_alive(owner: Optional[str]) -> bool:
+    """True if the job owner may still be running (unknown or other-host owners count as alive)."""
+    if not owner or ":" not in owner:
+        return True
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+    return _pid_alive(int(pid))
+
+
+def directory_size(path: Path) -> int:
+    """Total size in bytes of all files below path (0 if it does not exist)."""
+    total = 0
+    stack = [str(path)]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+class Janitor:
+    """Applies the idle TTL and disk quota to the session directories."""
+
+    def __init__(self, session_store: SessionStore, temp_dir: Path, output_dir: Path,
+                 idle_ttl: float = SESSION_IDLE_TTL_SECONDS, quota_bytes: int = DISK_QUOTA_BYTES,
+                 in_use: Optional[Callable[[str], bool]] = None, inline_jobs: bool = True):
+        self.session_store = session_store
+        self.temp_dir = Path(temp_dir)
+        self.output_dir = Path(output_dir)
+        self.idle_ttl = idle_ttl
+        self.quota_bytes = quota_bytes
+        self.in_use = in_use or (lambda session_id: False)  # e.g. has a connected WebSocket
+        self.inline_jobs = inline_jobs  # Jobs run in the API process instead of a durable queue
+        self.last_report: Dict[str, Any] = {}
+
+    # --- Helpers ---
+
+    def _session_dirs(self, session_id: str) -> List[Path]:
+        return [self.temp_dir / session_id, self.output_dir / session_id]
+
+    def _on_disk_ids(self) -> set:
+        ids = set()
+        for base in (self.temp_dir, self.output_dir):
+            if base.is_dir():
+                # Only directories are sessions; store/queue database files live next to them
+                ids.update(entry.name for entry in base.iterdir() if entry.is_dir() and not entry.name.startswith("_"))
+        return ids
+
+    def _is_protected(self, session_id: str, data: Optional[Dict[str, Any]]) -> bool:
+        if data and data.get("job_status") in ACTIVE_JOB_STATUSES:
+            return True
+        return self.in_use(session_id)
+
+    def remove_session(self, session_id: str) -> int:
+        """Deletes the session's directories and store entry. Returns the bytes freed."""
+        freed = 0
+        for path in self._session_dirs(session_id):
+            if path.exists():
+                freed += directory_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+        self.session_store.delete(session_id)
+        return freed
+
+    # --- Usage ---
+
+    def usage(self) -> Dict[str, Any]:
+        """Per-session disk usage plus totals."""
+        now = time.time()
+        known = dict(self.session_store.items())
+        sessions = []
+        for session_id in sorted(self._on_disk_ids() | set(known)):
+            data = known.get(session_id)
+            temp_bytes = directory_size(self.temp_dir / session_id)
+            output_bytes = directory_size(self.output_dir / session_id)
+            last_used = data["updated_at"] if data else None
+            sessions.append({
+                "session_id": session_id,
+                "type": data.get("type") if data else None,
+                "job_status": data.get("job_status") if data else None,
+                "temp_bytes": temp_bytes,
+                "output_bytes": output_bytes,
+                "last_used_at": last_used,
+                "idle_seconds": round(now - last_used, 1) if last_used else None,
+                "protected": self._is_protected(session_id, data),
+            })
+        total = sum(s["temp_bytes"] + s["output_bytes"] for s in sessions)
+        free = shutil.disk_usage(self.temp_dir).free if self.temp_dir.exists() else None
+        return {
+            "total_bytes": total,
+            "quota_bytes": self.quota_bytes or None,
+            "idle_ttl_seconds": self.idle_ttl,
+            "disk_free_bytes": free,
+            "session_count": len(sessions),
+            "sessions": sessions,
+            "last_collection": self.last_report,
+        }
+
+    # --- Collection ---
+
+    def collect(self) -> List[str]:
+        """Runs one TTL + quota pass. Returns the ids of the removed sessions."""
+        now = time.time()
+        removed: List[str] = []
+        freed = 0
+        candidates = []  # (last_used, session_id, size) of finished sessions kept after the TTL pass
+        total = 0
+        for session_id, data in self.session_store.items():
+            size = sum(directory_size(path) for path in self._session_dirs(session_id))
+            if self._is_protected(session_id, data):
+                total += size
+                continue
+            if now - data["updated_at"] > self.idle_ttl:
+                freed += self.remove_session(session_id)
+                removed.append(session_id)
+                continue
+            total += size
+            candidates.append((data["updated_at"], session_id, size))
+
+        if self.quota_bytes and total > self.quota_bytes:
+            for _, session_id, size in sorted(candidates):
+                if total <= self.quota_bytes:
+                    break
+                freed += self.remove_session(session_id)
+                removed.append(session_id)
+                total -= size
+            if total > self.quota_bytes:
+                print(f"Janitor: still {total} bytes in use after eviction (quota {self.quota_bytes}); "
+                      f"remaining sessions are running or connected.")
+
+        self.last_report = {"finished_at": now, "removed": len(removed), "freed_bytes": freed, "total_bytes": total}
+        if removed:
+            print(f"Janitor: removed {len(removed)} session(s), freed {freed / 1024 ** 2:.1f} MB.")
+        return removed
+
+    # --- Startup ---
+
+    def _adopt(self, session_id: str) -> bool:
+        """
+        Rebuilds a store entry for a recognisable leftover session directory.
+
+        The upload is picked by name (next to it lie frame stores, checkpoints
+        and traces): ``original_long_*`` / ``stitched_long.*`` or a screenshots
+        folder for a long image, otherwise a file with a video extension.
+        """
+        session_dir = self.temp_dir / session_id
+        output_dir = self.output_dir / session_id
+        if not session_dir.is_dir():
+            return False
+        files = sorted(p for p in session_dir.iterdir() if p.is_file())
+        long_images = ([p for p in files if p.name.startswith("original_long_")]
+                       or [p for p in files if p.stem == "stitched_long"])
+        screenshots_dir = session_dir / "screenshots"
+        screenshots = sorted(p for p in screenshots_dir.iterdir() if p.is_file()) if screenshots_dir.is_dir() else []
+        videos = [p for p in files if p.suffix.lower() in VIDEO_EXTENSIONS]
+        pdfs = sorted(output_dir.glob("*.pdf"), key=lambda p: p.stat().st_mtime) if output_dir.is_dir() else []
+        sliced_dir = session_dir / "sliced_images"
+        if long_images or screenshots:
+            if screenshots:
+                # Not stitched yet if the file is missing; the stitch stage writes it on a rerun
+                suffix = ".jpg" if screenshots[0].suffix.lower() in (".jpg", ".jpeg") else ".png"  # As the upload endpoint
+                image_path = long_images[0] if long_images else session_dir / f"stitched_long{suffix}"
+                filename = f"{display_name(screenshots[0])} 等 {len(screenshots)} 张截图"
+            else:
+                image_path = long_images[0]
+                filename = image_path.name[len("original_long_"):]
+            data = {
+                "type": "long_image",
+                "long_image_path": str(image_path),
+                "sliced_images": [str(p) for p in sorted(sliced_dir.iterdir()) if p.is_file()] if sliced_dir.is_dir() else [],
+                "long_image_pdf_path": str(pdfs[-1]) if pdfs else None,
+                "original_long_image_filename": filename,
+            }
+            if screenshots:
+                data["screenshot_paths"] = [str(p) for p in screenshots]
+        elif videos:
+            data = {
+                "type": "video",
+                "video_path": str(videos[0]),
+                "frames_dir": str(session_dir / "raw_frames"),
+                "kept_images": [],
+                "video_pdf_path": str(pdfs[-1]) if pdfs else None,
+                "original_video_filename": videos[0].name,
+            }
+        else:
+            return False
+        data.update(job_status="interrupted", adopted=True)
+        self.session_store.create(session_id, data)
+        return True
+
+    def startup_scan(self) -> Dict[str, int]:
+        """Adopts or reaps leftovers from a previous run and releases jobs of dead processes."""
+        now = time.time()
+        adopted = reaped = interrupted = 0
+        known = dict(self.session_store.items())
+
+        for session_id in self._on_disk_ids() - set(known):
+            dirs = [path for path in self._session_dirs(session_id) if path.exists()]
+            newest = max(path.stat().st_mtime for path in dirs)
+            if now - newest <= self.idle_ttl and self._adopt(session_id):
+                adopted += 1  # Gets a fresh idle TTL from now
+            else:
+                for path in dirs:
+                    shutil.rmtree(path, ignore_errors=True)
+                reaped += 1
+
+        for session_id, data in known.items():
+            if not any(path.exists() for path in self._session_dirs(session_id)):
+                self.session_store.delete(session_id)  # Nothing left to serve
+                reaped += 1
+            elif data.get("job_status") in ("running", "cancelling") and not _owner_alive(data.get("job_owner")):
+                self.session_store.update(session_id, job_status="interrupted")
+                interrupted += 1
+            elif (data.get("job_status") == "queued" and self.inline_jobs
+                  and (not data.get("job_owner") or not _owner_alive(data.get("job_owner")))):
+                # The background task that would have started it is gone (sessions queued
+                # before owners were recorded for them have no owner to check)
+                self.session_store.update(session_id, job_status="interrupted")
+                interrupted += 1
+
+        summary = {"adopted": adopted, "reaped": reaped, "interrupted": interrupted}
+        print(f"Janitor startup scan: {summary}")
+        return summary
@@ -0,0 +1,191 @@
+# backend/job_queue.py
+"""
+Durable local job queue shared by the API process and the worker processes.
+
+The API enqueues ``video`` / ``long_image`` jobs; ``python -m backend.worker``
+processes claim them, run the pipelines, and publish status events back
+through the ``events`` table.  The API relays those events to the
+WebSocket clients.  Everything lives in one SQLite file, so jobs survive
+restarts and any number of workers on the same host can share the queue.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+JOB_QUEUE_DB_PATH = os.getenv("JOB_QUEUE_DB_PATH")  # Defaults to <temp_sessions>/_jobs.sqlite3
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))  # Requeue running jobs without a heartbeat
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+EVENT_RETENTION_SECONDS = 3600  # Relayed events older than this are pruned
+
+# Job status values
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+
+
+class JobQueue:
+    """SQLite-backed FIFO job queue plus an append-only status event log."""
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY,"
+            " session_id TEXT NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " worker_id TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " started_at REAL,"
+            " heartbeat_at REAL,"
+            " finished_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " event_id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    # --- Jobs ---
+
+    def enqueue(self, session_id: str, kind: str, payload: Dict[str, Any]) -> str:
+        job_id = str(uuid.uuid4())
+        self._connect().execute(
+            "INSERT INTO jobs (job_id, session_id, kind, payload, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, session_id, kind, json.dumps(payload, ensure_ascii=False), JOB_QUEUED, time.time()),
+        )
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """Atomically takes the oldest queued job. Returns None when the queue is empty."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT job_id, session_id, kind, payload, attempts, created_at FROM jobs"
+                " WHERE status = ? ORDER BY created_at LIMIT 1", (JOB_QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1,"
+                " started_at = ?, heartbeat_at = ? WHERE job_id = ?",
+                (JOB_RUNNING, worker_id, now, now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {
+            "job_id": row[0], "session_id": row[1], "kind": row[2],
+            "payload": json.loads(row[3]), "attempts": row[4] + 1,
+            "queue_wait_seconds": now - row[5],
+        }
+
+    def heartbeat(self, job_id: str) -> None:
+        self._connect().execute("UPDATE jobs SET heartbeat_at = ? WHERE job_id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, status: str = JOB_DONE, error: Optional[str] = None) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+    def requeue_stale(self, timeout: float = JOB_STALE_SECONDS) -> int:
+        """Returns jobs whose worker stopped heartbeating to the queue (or fails them after too many attempts)."""
+        conn = self._connect()
+        cutoff = time.time() - timeout
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            failed = conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?"
+                " WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (JOB_FAILED, "worker lost", time.time(), JOB_RUNNING, cutoff, JOB_MAX_ATTEMPTS),
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = NULL WHERE status = ? AND heartbeat_at < ?",
+                (JOB_QUEUED, JOB_RUNNING, cutoff),
+            ).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if failed:
+            print(f"Job queue: {failed} stale job(s) exceeded {JOB_MAX_ATTEMPTS} attempts and were failed.")
+        return requeued
+
+    def cancel_queued(self, session_id: str) -> int:
+        """Cancels the session's jobs that no worker has claimed yet. Returns how many were cancelled."""
+        return self._connect().execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE session_id = ? AND status = ?",
+            (JOB_CANCELLED, time.time(), session_id, JOB_QUEUED),
+        ).rowcount
+
+    def depth(self) -> int:
+        """Number of jobs waiting to be claimed."""
+        return self._connect().execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (JOB_QUEUED,)).fetchone()[0]
+
+    def latest_job(self, session_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute(
+            "SELECT job_id, kind, status, worker_id, attempts, error FROM jobs"
+            " WHERE session_id = ? ORDER BY created_at DESC LIMIT 1", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("job_id", "kind", "status", "worker_id", "attempts", "error"), row))
+
+    # --- Status events (worker -> API) ---
+
+    def publish_event(self, session_id: str, payload: Any) -> None:
+        self._connect().execute(
+            "INSERT INTO events (session_id, payload, created_at) VALUES (?, ?, ?)",
+            (session_id, json.dumps(payload, ensure_ascii=False), time.time()),
+        )
+
+    def fetch_events(self, after_id: int, limit: int = 500) -> List[Tuple[int, str, Any]]:
+        rows = self._connect().execute(
+            "SELECT event_id, session_id, payload FROM events WHERE event_id > ? ORDER BY event_id LIMIT ?",
+            (after_id, limit),
+        ).fetchall()
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def latest_event_id(self) -> int:
+        row = self._connect().execute("SELECT MAX(event_id) FROM events").fetchone()
+        return row[0] or 0
+
+    def prune_events(self, older_than: float = EVENT_RETENTION_SECONDS) -> int:
+        return self._connect().execute(
+            "DELETE FROM events WHERE created_at < ?", (time.time() - older_than,)
+        ).rowcount
+
+
+def create_job_queue(default_dir: Path) -> JobQueue:
+    db_path = JOB_QUEUE_DB_PATH or str(Path(default_dir) / "_jobs.sqlite3")
+    return JobQueue(db_path)
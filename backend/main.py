@@ -1,18 +1,23 @@
 # backend/main.py
 import uuid
 import os
+import json
+import hashlib
 import shutil
+import zipfile
 import asyncio
+import threading
+import time
 from pathlib import Path
 import datetime
 from typing import Dict, List, Optional, Callable, Any, Tuple
 
 from fastapi import (
     FastAPI, File, UploadFile, WebSocket, WebSocketDisconnect,
-    Form, HTTPException, Query, BackgroundTasks
+    Form, HTTPException, Query, BackgroundTasks, Header
 )
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel # Assuming models are defined here or imported
 
 # --- Assuming Models are defined or imported ---
@@ -24,36 +29,89 @@ class TaskStatus(BaseModel):
     progress: Optional[int] = None
     result_url: Optional[str] = None
     preview_images: Optional[List[str]] = None
+    level: str = "info" # 'debug', 'info' or 'warn'
+    seq: Optional[int] = None # Event log sequence number, used to resume after reconnecting
+    details: Optional[Dict[str, Any]] = None # Structured extras, e.g. per-item progress of a batch
 
 class ProcessSettings(BaseModel):
     frame_interval_seconds: float = 1.0
+    adaptive_sampling: bool = False # Treat the interval as coarse and bisect gaps where the overlap check fails
+    min_frame_interval_seconds: float = 0.25 # Finest gap adaptive sampling refines down to
     exclusion_list: List[str] = []
     ocr_analysis_rect: Optional[Tuple[int, int, int, int]] = None
+    auto_ocr_region: bool = False # Detect the scrolling chat area when no ocr_analysis_rect is given
     pdf_rows: int = 3
     pdf_cols: int = 2
     pdf_title: str = "聊天记录证据"
     pdf_layout: str = 'grid' # 'grid' or 'column'
     image_order: Optional[List[str]] = None
+    use_frame_store: bool = False # Store sampled frames in one memory-mapped file instead of one PNG each
+    ocr_profile: Optional[str] = None # 'fast', 'balanced' or 'accurate'; None uses the OCR_PROFILE env default
+    boundary_ocr: bool = False # Recognize only the head/tail lines the overlap check needs
+    build_pdf: bool = True # False stops after OCR/filtering (a batch builds one combined PDF instead)
+    enable_trace: bool = False # Record a Chrome trace of this job (see /download_trace)
 
 class LongImageProcessSettings(BaseModel):
     slice_height: int = 1000
     overlap: int = 100
+    slice_mode: str = 'fixed' # 'fixed' or 'snap'
+    slice_format: str = 'auto' # 'auto', 'png', 'jpeg' or 'webp'
+    slice_png_compress_level: int = 6
+    slice_quality: int = 90
+    pdf_embed_mode: str = 'slices' # 'slices' or 'source'
     pdf_rows: int = 3
     pdf_cols: int = 1
     pdf_title: str = "长截图证据"
     pdf_layout: str = 'column' # 'grid' or 'column'
     image_order: Optional[List[str]] = None
+    build_pdf: bool = True # False stops after slicing (a batch builds one combined PDF instead)
+    enable_trace: bool = False # Record a Chrome trace of this job (see /download_trace)
+
+class BatchSettings(BaseModel):
+    video: ProcessSettings = ProcessSettings() # Applied to every video in the batch
+    long_image: LongImageProcessSettings = LongImageProcessSettings() # Applied to every long screenshot
+    combined_pdf: bool = False # One PDF for the whole batch instead of one per item
+    pdf_rows: int = 3 # Layout of the combined PDF
+    pdf_cols: int = 2
+    pdf_title: str = "证据材料汇编"
+    pdf_layout: str = 'grid'
 
 # --- Import core worker functions/classes ---
 from backend.core_workers import (
     extract_single_frame_ffmpeg_sync,
+    detect_video_content_region_sync,
     extract_frames_ffmpeg_sync,
     slice_image_sync, # ** Ensure you have implemented this function **
+    plan_long_image_regions_sync,
+    render_region_thumbnails_sync,
+    stitch_screenshots_sync,
+    REGION_THUMBNAIL_WIDTH,
     OcrFilter,
     PdfGenerator,
-    OCR_ENGINE,
+    CancelToken,
+    JobCancelledError,
+    get_ocr_engine,
+    warm_up_ocr_engine,
+    ocr_engine_status,
+    resolve_ocr_profile,
+    OCR_STATE_READY,
     REFERENCE_FRAME_INDEX
 )
+from backend.session_store import SessionStore, create_session_store
+from backend.job_queue import JobQueue, create_job_queue
+from backend.janitor import Janitor, JANITOR_INTERVAL_SECONDS, current_process_owner, directory_size
+from backend import metrics
+from backend.tracing import NULL_TRACER, NullTracer, Tracer, TRACE_FILENAME_PREFIX, timed_record
+from backend.frame_store import FrameStore, FRAME_STORE_FILENAME
+from backend.exclusion import ExclusionMatcher
+from backend.batch import (
+    BatchProgress, BATCH_MAX_ITEMS, BATCH_MAX_PARALLEL_ITEMS,
+    classify_file, display_name, expand_zip
+)
+from backend.event_stream import (
+    SessionEventBuffer, SessionEventLog, EVENT_FLUSH_INTERVAL_SECONDS, WS_SEND_TIMEOUT_SECONDS,
+    LOG_LEVELS, DEFAULT_LOG_LEVEL, level_rank, is_key_event
+)
 
 APP_NAME = "易存讯 - 聊天记录与长截图取证"
 APP_VERSION = "0.2.0" # Updated version
@@ -61,6 +119,22 @@ TEMP_SESSIONS_BASE_DIR = Path("temp_sessions")
 OUTPUT_BASE_DIR = Path("output")
 os.makedirs(TEMP_SESSIONS_BASE_DIR, exist_ok=True)
 os.makedirs(OUTPUT_BASE_DIR, exist_ok=True)
+# 'inline': run pipelines as background tasks in the API process (single API process only:
+#           job events stay in the memory of the process running the job).
+# 'queue': enqueue jobs for separate `python -m backend.worker` processes; required for `--workers N`.
+JOB_EXECUTION_MODE = os.getenv("JOB_EXECUTION_MODE", "inline")
+EVENT_RELAY_INTERVAL_SECONDS = 0.2
+JOB_ACTIVE_STATUSES = ("queued", "running", "cancelling")
+CANCEL_POLL_INTERVAL_SECONDS = 1.0 # How often a running job checks the session store for a cancel request
+CLEANUP_CANCEL_TIMEOUT_SECONDS = 30 # How long /cleanup_session waits for a cancelled job to stop
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN") # If set, /admin/* endpoints require the X-Admin-Token header
+TRACE_JOBS = os.getenv("TRACE_JOBS", "0").lower() in ("1", "true", "yes") # Trace every job, not only opted-in ones
+# Load and warm up the OCR model in the background at startup; HTTP is served meanwhile
+OCR_WARMUP_ON_STARTUP = os.getenv("OCR_WARMUP_ON_STARTUP", "1").lower() in ("1", "true", "yes")
+# Restart jobs interrupted by a crash/restart from their checkpoints when the API starts (inline mode)
+RESUME_INTERRUPTED_JOBS = os.getenv("RESUME_INTERRUPTED_JOBS", "1").lower() in ("1", "true", "yes")
+OCR_CHECKPOINT_FILENAME = "ocr_checkpoint.jsonl" # Per-frame OCR lines of the running/interrupted OCR stage
+METRICS_DISK_SCAN_INTERVAL_SECONDS = float(os.getenv("METRICS_DISK_SCAN_INTERVAL_SECONDS", "60")) # Directory sizes are walked at most this often
 
 app = FastAPI(title=APP_NAME, version=APP_VERSION)
 
@@ -71,38 +145,161 @@ app.mount("/static", StaticFiles(directory=BASE_DIR / "frontend"), name="static_
 
 
 # --- WebSocket Connection Manager ---
+class WebSocketClient:
+    """One connected viewer of a session."""
+    def __init__(self, websocket: WebSocket, level: str, cursor: int):
+        self.websocket = websocket
+        self.level = level
+        self.cursor = cursor # Last event seq delivered to this client
+        self.sending: Optional[asyncio.Task] = None
+
+
 class ConnectionManager:
+    """
+    Tracks WebSocket clients and batches status updates per session.
+
+    Updates are buffered (thread-safe, no event loop needed) and `run_flusher`
+    moves them into the session's sequence-numbered event log every
+    EVENT_FLUSH_INTERVAL_SECONDS. Each connected client is then sent the log
+    entries past its own cursor as one JSON array, so reconnecting clients and
+    extra viewers are served from the same log.
+    """
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {} # session_id -> WebSocket
-
-    async def connect(self, websocket: WebSocket, session_id: str):
+        self.active_connections: Dict[str, List[WebSocketClient]] = {} # session_id -> connected clients
+        self.buffers: Dict[str, SessionEventBuffer] = {}
+        self.event_logs: Dict[str, SessionEventLog] = {}
+        self._buffers_lock = threading.Lock()
+        # Set in worker processes: batches go to the job queue instead of a local socket
+        self.forwarder: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None
+        self.tracers: Dict[str, Tracer] = {} # Sessions whose running job is traced; their sends become spans
+        # session_id -> callback receiving each flushed event of that session (batch progress tracking)
+        self.observers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+    async def connect(self, websocket: WebSocket, session_id: str, level: str = DEFAULT_LOG_LEVEL,
+                      last_seq: int = 0) -> WebSocketClient:
+        """Accepts the socket; events after last_seq are replayed on the next flush."""
         await websocket.accept()
-        self.active_connections[session_id] = websocket
-        print(f"WebSocket connection accepted for session: {session_id}")
-
-    def disconnect(self, session_id: str):
-        if session_id in self.active_connections:
-            del self.active_connections[session_id]
+        client = WebSocketClient(websocket, level if level in LOG_LEVELS else DEFAULT_LOG_LEVEL, max(0, last_seq))
+        self.active_connections.setdefault(session_id, []).append(client)
+        print(f"WebSocket connection accepted for session: {session_id} (last_seq={last_seq})")
+        return client
+
+    def disconnect(self, session_id: str, client: WebSocketClient):
+        clients = self.active_connections.get(session_id)
+        if clients and client in clients:
+            clients.remove(client)
+            if not clients:
+                del self.active_connections[session_id]
             print(f"WebSocket connection removed for session: {session_id}")
 
+    def discard_session(self, session_id: str):
+        """Forgets the clients and the buffered/logged events of a cleaned-up session."""
+        self.active_connections.pop(session_id, None)
+        with self._buffers_lock:
+            self.buffers.pop(session_id, None)
+            self.event_logs.pop(session_id, None)
+
+    def publish(self, session_id: str, status: TaskStatus):
+        """Queues a status update for the next flush. Safe to call from any thread."""
+        with self._buffers_lock:
+            buffer = self.buffers.get(session_id)
+            if buffer is None:
+                buffer = self.buffers[session_id] = SessionEventBuffer()
+        buffer.push(status.dict(exclude={"seq"}))
+
     async def send_status_update(self, session_id: str, status: TaskStatus):
-        websocket = self.active_connections.get(session_id)
-        if websocket:
+        self.publish(session_id, status)
+
+    async def send_direct(self, client: WebSocketClient, status: TaskStatus):
+        """Sends an unlogged status (e.g. the connection handshake) to one client only."""
+        try:
+            await client.websocket.send_json([status.dict()])
+        except (WebSocketDisconnect, RuntimeError) as e:
+            print(f"Error sending direct WS message for {status.session_id}: {e}")
+
+    @staticmethod
+    def _notice(session_id: str, status: str, message: str) -> Dict[str, Any]:
+        return TaskStatus(session_id=session_id, status=status, level="warn", message=message).dict(exclude={"seq"})
+
+    async def flush(self):
+        """Logs everything buffered so far and sends each client what it has not seen."""
+        with self._buffers_lock:
+            pending = list(self.buffers.items())
+        for session_id, buffer in pending:
+            events, dropped = buffer.drain()
+            if dropped:
+                metrics.WS_EVENTS_DROPPED_TOTAL.inc(dropped)
+                events.append(self._notice(session_id, "log_dropped", f"客户端接收过慢，已省略 {dropped} 条日志。"))
+            observer = self.observers.get(session_id)
+            if observer:
+                for event in events:
+                    try:
+                        observer(event)
+                    except Exception as e:
+                        print(f"Error in status observer for {session_id}: {e}")
+            if self.forwarder:
+                if events:
+                    try:
+                        with self.tracers.get(session_id, NULL_TRACER).span("event_forward", "websocket", events=len(events)):
+                            self.forwarder(session_id, events)
+                    except Exception as e:
+                        print(f"Error forwarding status for {session_id}: {e}")
+                continue
+            if events:
+                with self._buffers_lock:
+                    event_log = self.event_logs.setdefault(session_id, SessionEventLog())
+                event_log.append(events)
+        for session_id, clients in list(self.active_connections.items()):
+            event_log = self.event_logs.get(session_id)
+            if event_log is None:
+                continue
+            for client in list(clients):
+                if client.sending and not client.sending.done():
+                    continue # Backpressure: this client resumes from its cursor once the send completes
+                missed, gap = event_log.since(client.cursor)
+                client.cursor = event_log.last_seq
+                min_rank = level_rank(client.level)
+                batch = [e for e in missed if level_rank(e.get("level", DEFAULT_LOG_LEVEL)) >= min_rank or is_key_event(e)]
+                if gap:
+                    batch.insert(0, self._notice(session_id, "log_gap", "部分历史日志已过期，仅重放关键状态。"))
+                if batch:
+                    client.sending = asyncio.create_task(self._send_batch(session_id, client, batch))
+
+    async def _send_batch(self, session_id: str, client: WebSocketClient, batch: List[Dict[str, Any]]):
+        try:
+            with metrics.WS_SEND_SECONDS.time(), \
+                    self.tracers.get(session_id, NULL_TRACER).span("ws_send", "websocket", events=len(batch)):
+                await asyncio.wait_for(client.websocket.send_json(batch), timeout=WS_SEND_TIMEOUT_SECONDS)
+            metrics.WS_EVENTS_SENT_TOTAL.inc(len(batch))
+        except asyncio.TimeoutError:
+            print(f"WebSocket send timed out for {session_id}; dropping the client.")
+            self.disconnect(session_id, client)
+        except WebSocketDisconnect:
+            print(f"WebSocketDisconnect while sending to {session_id}")
+            self.disconnect(session_id, client)
+        except RuntimeError as e:
+            print(f"RuntimeError sending WS message for {session_id}: {e}")
+            # Handle cases where the socket might already be closed
+            if "WebSocket is closed" in str(e):
+                self.disconnect(session_id, client)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(EVENT_FLUSH_INTERVAL_SECONDS)
             try:
-                await websocket.send_json(status.dict())
-            except WebSocketDisconnect:
-                print(f"WebSocketDisconnect while sending to {session_id}")
-                self.disconnect(session_id)
-            except RuntimeError as e:
-                print(f"RuntimeError sending WS message for {session_id}: {e}")
-                # Handle cases where the socket might already be closed
-                if "WebSocket is closed" in str(e):
-                    self.disconnect(session_id)
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing status updates: {e}")
 
 manager = ConnectionManager()
-# Session Data Store (In-memory, consider Redis/DB for production)
+# Session Data Store (SQLite by default, shared by all API/worker processes)
 # Structure: session_id -> Dict[str, Any]
-SESSIONS_DATA: Dict[str, Dict[str, Any]] = {}
+session_store: SessionStore = create_session_store(TEMP_SESSIONS_BASE_DIR)
+job_queue: Optional[JobQueue] = create_job_queue(TEMP_SESSIONS_BASE_DIR) if JOB_EXECUTION_MODE == "queue" else None
+# Removes idle sessions and enforces the disk quota; sessions with a job or a connected client are kept
+janitor = Janitor(session_store, TEMP_SESSIONS_BASE_DIR, OUTPUT_BASE_DIR,
+                  in_use=lambda session_id: session_id in manager.active_connections,
+                  inline_jobs=job_queue is None)
 
 # --- Thread-safe Callback Creation ---
 def create_async_callback_for_sync_task(
@@ -112,7 +309,12 @@ def create_async_callback_for_sync_task(
     is_progress: bool = False,
     max_updates_for_progress: int = 20
 ) -> Callable:
-    """Creates a thread-safe callback for updating WebSocket from sync tasks."""
+    """
+    Creates a thread-safe callback for updating WebSocket from sync tasks.
+
+    Log callbacks accept (message, level='info'). Updates only go into the
+    session's event buffer; the flusher batches them onto the socket.
+    """
     progress_state = {'updates_sent': 0}
 
     def sync_callback_handler(*args):
@@ -131,11 +333,12 @@ def create_async_callback_for_sync_task(
                         progress_val = int((current / total) * 100)
                         message = f"进度: {current}/{total}"
                         status_update = TaskStatus(session_id=session_id, status=status_str, message=message, progress=progress_val)
-                        main_loop.call_soon_threadsafe(asyncio.create_task, manager.send_status_update(session_id, status_update))
+                        manager.publish(session_id, status_update)
             else:
                 message = args[0]
-                status_update = TaskStatus(session_id=session_id, status=status_str, message=message)
-                main_loop.call_soon_threadsafe(asyncio.create_task, manager.send_status_update(session_id, status_update))
+                level = args[1] if len(args) > 1 else DEFAULT_LOG_LEVEL
+                status_update = TaskStatus(session_id=session_id, status=status_str, message=message, level=level)
+                manager.publish(session_id, status_update)
         except Exception as e:
             print(f"Error in sync_callback_handler for session {session_id}: {e}")
 
@@ -149,25 +352,68 @@ async def read_root():
     return FileResponse(BASE_DIR / "frontend/index.html")
 
 @app.websocket("/ws/{session_id}")
-async def websocket_endpoint(websocket: WebSocket, session_id: str):
-    """Handles WebSocket connections for real-time updates."""
-    await manager.connect(websocket, session_id)
-    status_msg = "WebSocket reconnected." if session_id in SESSIONS_DATA else "WebSocket connected. Waiting for upload..."
-    status_key = "reconnected" if session_id in SESSIONS_DATA else "pending_upload"
-    # Send initial status immediately after connection
-    await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status=status_key, message=status_msg))
+async def websocket_endpoint(websocket: WebSocket, session_id: str,
+                             level: str = Query(DEFAULT_LOG_LEVEL), last_seq: int = Query(0)):
+    """
+    Handles WebSocket connections for real-time updates (batched JSON arrays of TaskStatus).
+    Logged events with seq > last_seq are replayed, so clients resume where they left off.
+    """
+    client = await manager.connect(websocket, session_id, level, last_seq)
+    session_known = session_store.update(session_id) is not None # Also marks the session as recently used
+    status_msg = "WebSocket reconnected." if session_known else "WebSocket connected. Waiting for upload..."
+    status_key = "reconnected" if session_known else "pending_upload"
+    # Send initial status immediately after connection (to this client only)
+    await manager.send_direct(client, TaskStatus(session_id=session_id, status=status_key, message=status_msg))
     try:
         while True:
             data = await websocket.receive_text()
             if data == "ping":
                 await websocket.send_text("pong")
-            # Handle other client messages if needed
+                continue
+            try:
+                client_msg = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(client_msg, dict) and client_msg.get("type") == "set_level":
+                level = client_msg.get("level", DEFAULT_LOG_LEVEL)
+                client.level = level if level in LOG_LEVELS else DEFAULT_LOG_LEVEL
     except WebSocketDisconnect:
         print(f"Client {session_id} disconnected WS normally.")
     except Exception as e:
         print(f"WebSocket error for {session_id}: {e}")
     finally:
-        manager.disconnect(session_id)
+        manager.disconnect(session_id, client)
+
+def video_session_data(video_path: Path, filename: str, upload_trace: Dict[str, Any]) -> Dict[str, Any]:
+    """Initial session data of a video session whose file is already in its session directory."""
+    return {
+        "type": "video",
+        "video_path": str(video_path),
+        "frames_dir": str(video_path.parent / "raw_frames"),
+        "kept_images": [],
+        "video_pdf_path": None, # Use specific key
+        "original_video_filename": filename,
+        # Kept so a traced job can show the upload on its timeline
+        "upload_trace": upload_trace,
+    }
+
+def long_image_session_data(image_path: Path, filename: str, upload_trace: Dict[str, Any],
+                            screenshot_paths: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Initial session data of a long image session whose file is already in its session directory.
+    With screenshot_paths, image_path is where the screenshots get stitched into one long image.
+    """
+    data = {
+        "type": "long_image",
+        "long_image_path": str(image_path),
+        "sliced_images": [],
+        "long_image_pdf_path": None,
+        "original_long_image_filename": filename,
+        "upload_trace": upload_trace,
+    }
+    if screenshot_paths:
+        data["screenshot_paths"] = screenshot_paths
+    return data
 
 @app.post("/upload_video/")
 async def upload_video(video_file: UploadFile = File(...)):
@@ -177,6 +423,7 @@ async def upload_video(video_file: UploadFile = File(...)):
     session_dir.mkdir(parents=True, exist_ok=True)
     video_path = session_dir / video_file.filename
 
+    upload_start = time.time()
     try:
         with open(video_path, "wb") as buffer:
             shutil.copyfileobj(video_file.file, buffer)
@@ -188,14 +435,9 @@ async def upload_video(video_file: UploadFile = File(...)):
     finally:
         video_file.file.close()
 
-    SESSIONS_DATA[session_id] = {
-        "type": "video",
-        "video_path": str(video_path),
-        "frames_dir": str(session_dir / "raw_frames"),
-        "kept_images": [],
-        "video_pdf_path": None, # Use specific key
-        "original_video_filename": video_file.filename
-    }
+    session_store.create(session_id, video_session_data(
+        video_path, video_file.filename,
+        timed_record(upload_start, time.time() - upload_start, bytes=video_path.stat().st_size)))
     await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="upload_complete", message=f"视频 '{video_file.filename}' 上传成功。"))
     print(f"Video session created: {session_id}")
     return {"session_id": session_id, "filename": video_file.filename, "message": "Video uploaded successfully."}
@@ -203,9 +445,9 @@ async def upload_video(video_file: UploadFile = File(...)):
 @app.get("/get_reference_frame/{session_id}")
 async def get_reference_frame(session_id: str):
     """Extracts and returns the reference frame for OCR area selection."""
-    if session_id not in SESSIONS_DATA or SESSIONS_DATA[session_id].get("type") != "video":
+    session_data = session_store.get(session_id)
+    if not session_data or session_data.get("type") != "video":
         raise HTTPException(status_code=404, detail="Video session not found or invalid type.")
-    session_data = SESSIONS_DATA[session_id]
     video_path = Path(session_data["video_path"])
     ref_frame_dir = TEMP_SESSIONS_BASE_DIR / session_id / "ref_frame"
     ref_frame_dir.mkdir(parents=True, exist_ok=True)
@@ -230,49 +472,190 @@ async def get_reference_frame(session_id: str):
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="error", message="参考帧提取失败。"))
         raise HTTPException(status_code=500, detail="Failed to extract reference frame.")
 
+async def detect_ocr_region_for_session(session_id: str, session_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Runs (or reuses) automatic chat-region detection for a video session."""
+    if session_data.get("auto_ocr_region"):
+        return session_data["auto_ocr_region"]
+    current_loop = asyncio.get_running_loop()
+    log_cb = create_async_callback_for_sync_task(session_id, "ocr_region_detection", current_loop)
+    with metrics.STAGE_SECONDS.labels(pipeline="video", stage="detect_region").time():
+        result = await current_loop.run_in_executor(
+            None, detect_video_content_region_sync, session_data["video_path"], log_cb)
+    session_store.update(session_id, auto_ocr_region=result)
+    return result
+
+@app.get("/detect_ocr_region/{session_id}")
+async def detect_ocr_region(session_id: str):
+    """
+    Suggests an OCR analysis rect from the pixels that change while the chat
+    scrolls, for the frontend to preset on the reference frame for confirmation.
+    """
+    session_data = session_store.get(session_id)
+    if not session_data or session_data.get("type") != "video":
+        raise HTTPException(status_code=404, detail="Video session not found or invalid type.")
+    result = await detect_ocr_region_for_session(session_id, session_data)
+    rect = result.get("rect")
+    return {
+        "session_id": session_id,
+        "rect": list(rect) if rect else None,
+        "frame_size": result.get("frame_size"),
+        "sampled_frames": result.get("sampled_frames", 0),
+        "message": "已检测到聊天内容区域。" if rect else "未检测到滚动的聊天内容区域。",
+    }
+
+# --- Job Checkpoints ---
+# session["checkpoint"] maps a finished stage to {"key": ..., results}. The key hashes every input
+# the stage depends on (including the previous stage's key), so a rerun or resume with the same
+# settings skips the finished stages and any change invalidates them and everything after.
+def checkpoint_key(**inputs: Any) -> str:
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def stage_checkpoint(checkpoint: Dict[str, Any], stage: str, key: str) -> Optional[Dict[str, Any]]:
+    entry = checkpoint.get(stage)
+    return entry if entry and entry.get("key") == key and entry.get("done") else None
+
+
+def save_checkpoint(session_id: str, checkpoint: Dict[str, Any], stage: str, key: str, **results: Any):
+    """Records a finished stage and drops the checkpoints of the stages after it."""
+    stages = list(checkpoint)
+    for later in stages[stages.index(stage) + 1:] if stage in stages else []:
+        checkpoint.pop(later, None)
+    checkpoint[stage] = {"key": key, "done": True, **results}
+    session_store.update(session_id, checkpoint=checkpoint)
+
+
+def reset_checkpoint(session_id: str, checkpoint: Dict[str, Any], stage: str):
+    """Forgets a stage that is about to run again, together with every stage after it."""
+    stages = list(checkpoint)
+    if stage in stages:
+        for later in stages[stages.index(stage):]:
+            checkpoint.pop(later, None)
+        session_store.update(session_id, checkpoint=checkpoint)
+
+
+async def reuse_pdf_checkpoint(session_id: str, checkpoint: Dict[str, Any], key: str) -> bool:
+    """Completes the job with the PDF a previous run already built from the same inputs."""
+    pdf_checkpoint = stage_checkpoint(checkpoint, "pdf", key)
+    if not pdf_checkpoint or not Path(pdf_checkpoint["path"]).is_file():
+        return False
+    pdf_path = Path(pdf_checkpoint["path"])
+    session_store.update(session_id, job_status="completed")
+    await manager.send_status_update(session_id, TaskStatus(
+        session_id=session_id, status="completed", message=f"PDF已是最新 (取自检查点): {pdf_path.name}",
+        result_url=f"/download_pdf/{session_id}/{pdf_path.name}", progress=100
+    ))
+    return True
+
+
 # --- Background Task for Video Processing ---
-async def run_full_process(session_id: str, settings: ProcessSettings):
+async def run_full_process(session_id: str, settings: ProcessSettings, cancel_token: Optional[CancelToken] = None,
+                           tracer: NullTracer = NULL_TRACER):
     """Runs the full video processing pipeline in the background."""
-    if session_id not in SESSIONS_DATA or SESSIONS_DATA[session_id].get("type") != "video":
+    session_data = session_store.get(session_id)
+    if not session_data or session_data.get("type") != "video":
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="error", message="无效的视频处理会话。"))
         return
 
-    session_data = SESSIONS_DATA[session_id]
     video_path_str = session_data["video_path"]
     frames_dir_path = Path(session_data["frames_dir"])
     frames_dir_path.mkdir(parents=True, exist_ok=True)
     current_loop = asyncio.get_running_loop()
+    cancel_token = cancel_token or CancelToken()
+    frame_store_path = str(TEMP_SESSIONS_BASE_DIR / session_id / FRAME_STORE_FILENAME) if settings.use_frame_store else None
+    frame_store: Optional[FrameStore] = None
+    checkpoint: Dict[str, Any] = dict(session_data.get("checkpoint") or {})
+    ocr_checkpoint_path = TEMP_SESSIONS_BASE_DIR / session_id / OCR_CHECKPOINT_FILENAME
 
     try:
         # 1. Extract Frames
-        await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="extracting_frames", message="开始提取视频帧...", progress=0))
-        ffmpeg_log_cb = create_async_callback_for_sync_task(session_id, "extracting_frames", current_loop)
-        ffmpeg_success, ffmpeg_msg, frame_count = await current_loop.run_in_executor(
-            None, extract_frames_ffmpeg_sync,
-            video_path_str, str(frames_dir_path), settings.frame_interval_seconds, ffmpeg_log_cb
-        )
-        if not ffmpeg_success: raise RuntimeError(f"帧提取失败: {ffmpeg_msg}")
-        await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="frames_extracted", message=f"帧提取完成，共 {frame_count} 帧。", progress=100))
+        extract_key = checkpoint_key(video=video_path_str, interval=settings.frame_interval_seconds,
+                                     frame_store=settings.use_frame_store)
+        extract_checkpoint = stage_checkpoint(checkpoint, "extract", extract_key)
+        if extract_checkpoint and not (
+            Path(frame_store_path).is_file() if frame_store_path
+            else sum(1 for _ in frames_dir_path.glob("frame_*.png")) >= extract_checkpoint["frame_count"]
+        ):
+            extract_checkpoint = None # The frames are gone (the directory itself was just created above)
+        if extract_checkpoint:
+            frame_count = extract_checkpoint["frame_count"]
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="frames_extracted", message=f"帧已提取 (取自检查点)，共 {frame_count} 帧。", progress=100))
+        else:
+            reset_checkpoint(session_id, checkpoint, "extract")
+            ocr_checkpoint_path.unlink(missing_ok=True) # Recorded against the frames about to be replaced
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="extracting_frames", message="开始提取视频帧...", progress=0))
+            ffmpeg_log_cb = create_async_callback_for_sync_task(session_id, "extracting_frames", current_loop)
+            with metrics.STAGE_SECONDS.labels(pipeline="video", stage="extract").time(), tracer.span("extract", "stage"):
+                ffmpeg_success, ffmpeg_msg, frame_count = await current_loop.run_in_executor(
+                    None, extract_frames_ffmpeg_sync,
+                    video_path_str, str(frames_dir_path), settings.frame_interval_seconds, ffmpeg_log_cb, cancel_token,
+                    frame_store_path, tracer
+                )
+            cancel_token.raise_if_cancelled()
+            if not ffmpeg_success: raise RuntimeError(f"帧提取失败: {ffmpeg_msg}")
+            metrics.FRAMES_TOTAL.labels(state="extracted").inc(frame_count)
+            save_checkpoint(session_id, checkpoint, "extract", extract_key, frame_count=frame_count)
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="frames_extracted", message=f"帧提取完成，共 {frame_count} 帧。", progress=100))
+        session_store.update(session_id, frame_store_path=frame_store_path)
+        if frame_store_path:
+            frame_store = FrameStore(frame_store_path)
 
         # 2. OCR & Filter
-        if OCR_ENGINE is None: raise RuntimeError("OCR引擎未初始化。")
-        await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="ocr_processing", message="开始OCR与筛选...", progress=0))
-        ocr_log_cb = create_async_callback_for_sync_task(session_id, "ocr_processing", current_loop)
-        ocr_progress_cb = create_async_callback_for_sync_task(session_id, "ocr_processing", current_loop, is_progress=True)
-        ocr_filter = OcrFilter(
-            str(frames_dir_path), OCR_ENGINE, settings.exclusion_list, settings.ocr_analysis_rect,
-            log_callback=ocr_log_cb, progress_callback=ocr_progress_cb
-        )
-        kept_image_paths = await current_loop.run_in_executor(None, ocr_filter.run_filter)
-        session_data["kept_images"] = kept_image_paths
+        analysis_rect = settings.ocr_analysis_rect
+        if analysis_rect is None and settings.auto_ocr_region:
+            with tracer.span("detect_region", "stage"):
+                region = await detect_ocr_region_for_session(session_id, session_data)
+            analysis_rect = tuple(region["rect"]) if region.get("rect") else None
+        ocr_profile = resolve_ocr_profile(settings.ocr_profile)
+        ocr_engine = await current_loop.run_in_executor(None, get_ocr_engine, ocr_profile) # Loads the model on first use
+        if ocr_engine is None: raise RuntimeError(f"OCR引擎未初始化: {ocr_engine_status(ocr_profile)['error']}")
+        metrics.OCR_PROFILE_JOBS_TOTAL.labels(profile=ocr_profile).inc()
+        session_store.update(session_id, ocr_profile=ocr_profile)
+        ocr_key = checkpoint_key(extract=extract_key, rect=analysis_rect, profile=ocr_profile, backend=ocr_engine.name,
+                                 exclusion=settings.exclusion_list, boundary=settings.boundary_ocr,
+                                 adaptive=settings.adaptive_sampling, min_interval=settings.min_frame_interval_seconds)
+        ocr_checkpoint = stage_checkpoint(checkpoint, "ocr", ocr_key)
+        if ocr_checkpoint and not all(frame_store or Path(p).is_file() for p in ocr_checkpoint["kept_images"]):
+            ocr_checkpoint = None
+        if ocr_checkpoint:
+            kept_image_paths = ocr_checkpoint["kept_images"]
+        else:
+            if session_data.get("ocr_checkpoint_key") != ocr_key:
+                ocr_checkpoint_path.unlink(missing_ok=True) # Lines recorded with other OCR settings
+            reset_checkpoint(session_id, checkpoint, "ocr")
+            session_store.update(session_id, ocr_checkpoint_key=ocr_key) # Tags the per-frame JSONL being written
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="ocr_processing", message=f"开始OCR与筛选 (速度档位: {ocr_profile})...", progress=0))
+            ocr_log_cb = create_async_callback_for_sync_task(session_id, "ocr_processing", current_loop)
+            ocr_progress_cb = create_async_callback_for_sync_task(session_id, "ocr_processing", current_loop, is_progress=True)
+            ocr_filter = OcrFilter(
+                str(frames_dir_path), ocr_engine, settings.exclusion_list, analysis_rect,
+                log_callback=ocr_log_cb, progress_callback=ocr_progress_cb, frame_store=frame_store, tracer=tracer,
+                ocr_profile=ocr_profile, boundary_only=settings.boundary_ocr,
+                refine_video_path=video_path_str if settings.adaptive_sampling else None,
+                frame_interval_seconds=settings.frame_interval_seconds,
+                min_refine_interval_seconds=settings.min_frame_interval_seconds, cancel_token=cancel_token,
+                checkpoint_path=str(ocr_checkpoint_path)
+            )
+            cancel_token.register(ocr_filter.stop)
+            with metrics.STAGE_SECONDS.labels(pipeline="video", stage="ocr_filter").time(), tracer.span("ocr_filter", "stage", profile=ocr_profile):
+                kept_image_paths = await current_loop.run_in_executor(None, ocr_filter.run_filter)
+            cancel_token.unregister(ocr_filter.stop)
+            cancel_token.raise_if_cancelled()
+            save_checkpoint(session_id, checkpoint, "ocr", ocr_key, kept_images=kept_image_paths)
+        session_store.update(session_id, kept_images=kept_image_paths)
         preview_image_urls = [f"/get_processed_image/{session_id}/{Path(p).name}" for p in kept_image_paths] if kept_image_paths else []
         await manager.send_status_update(session_id, TaskStatus(
             session_id=session_id, status="ocr_completed", message=f"OCR与筛选完成，保留 {len(kept_image_paths)} 张图片。",
             preview_images=preview_image_urls, progress=100
         ))
         if not kept_image_paths:
+            session_store.update(session_id, job_status="completed")
             await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="completed_no_pdf", message="没有保留的图片，无法生成PDF。"))
             return
+        if not settings.build_pdf:
+            session_store.update(session_id, job_status="completed")
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="completed", message="OCR与筛选完成 (未单独生成PDF)。", progress=100))
+            return
 
         # 3. Generate PDF
         ordered_kept_images = kept_image_paths # Default order
@@ -280,11 +663,16 @@ async def run_full_process(session_id: str, settings: ProcessSettings):
             ordered_map = {Path(p).name: p for p in kept_image_paths}
             ordered_kept_images = [ordered_map[fname] for fname in settings.image_order if fname in ordered_map] or kept_image_paths
 
+        pdf_key = checkpoint_key(ocr=ocr_key, images=ordered_kept_images, rows=settings.pdf_rows, cols=settings.pdf_cols,
+                                 layout=settings.pdf_layout, title=settings.pdf_title)
+        if await reuse_pdf_checkpoint(session_id, checkpoint, pdf_key):
+            return
+
         output_pdf_dir = OUTPUT_BASE_DIR / session_id
         output_pdf_dir.mkdir(parents=True, exist_ok=True)
         pdf_filename_base = "".join(c if c.isalnum() or c in [' ', '-'] else "_" for c in settings.pdf_title).replace(' ', '_')[:50] or "video_evidence"
         output_pdf_path = output_pdf_dir / f"{pdf_filename_base}_video_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        session_data["video_pdf_path"] = str(output_pdf_path) # Store specific PDF path
+        session_store.update(session_id, video_pdf_path=str(output_pdf_path)) # Store specific PDF path
 
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="pdf_generating", message="开始生成PDF...", progress=0))
         pdf_log_cb = create_async_callback_for_sync_task(session_id, "pdf_generating", current_loop)
@@ -293,81 +681,162 @@ async def run_full_process(session_id: str, settings: ProcessSettings):
             ordered_kept_images, str(output_pdf_path), settings.pdf_cols, settings.pdf_rows,
             layout=settings.pdf_layout, # Pass layout
             page_title=settings.pdf_title,
-            log_callback=pdf_log_cb, progress_callback=pdf_progress_cb
+            log_callback=pdf_log_cb, progress_callback=pdf_progress_cb,
+            frame_store=frame_store, tracer=tracer
         )
-        pdf_success, pdf_msg_or_path = await current_loop.run_in_executor(None, pdf_generator.generate_pdf)
+        cancel_token.register(pdf_generator.stop)
+        with metrics.STAGE_SECONDS.labels(pipeline="video", stage="pdf").time(), tracer.span("pdf", "stage"):
+            pdf_success, pdf_msg_or_path = await current_loop.run_in_executor(None, pdf_generator.generate_pdf)
+        cancel_token.unregister(pdf_generator.stop)
+        cancel_token.raise_if_cancelled()
         if not pdf_success: raise RuntimeError(f"PDF生成失败: {pdf_msg_or_path}")
+        save_checkpoint(session_id, checkpoint, "pdf", pdf_key, path=str(output_pdf_path))
 
         pdf_download_url = f"/download_pdf/{session_id}/{output_pdf_path.name}"
+        session_store.update(session_id, job_status="completed")
         await manager.send_status_update(session_id, TaskStatus(
             session_id=session_id, status="completed", message=f"PDF生成成功: {output_pdf_path.name}",
             result_url=pdf_download_url, progress=100
         ))
 
+    except JobCancelledError:
+        await report_job_cancelled(session_id)
     except Exception as e:
         print(f"Error in run_full_process for session {session_id}: {e}")
+        session_store.update(session_id, job_status="error", job_error=str(e))
         import traceback
         traceback.print_exc()
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="error", message=f"处理过程中出错: {e}"))
+    finally:
+        if frame_store: frame_store.close()
 
 
 @app.post("/process_video/{session_id}")
 async def process_video_endpoint(session_id: str, settings: ProcessSettings, background_tasks: BackgroundTasks):
     """Endpoint to start the video processing background task."""
-    if session_id not in SESSIONS_DATA or SESSIONS_DATA[session_id].get("type") != "video":
+    session_data = session_store.get(session_id)
+    if not session_data or session_data.get("type") != "video":
         # Send error via WS if possible, then raise HTTP Exception
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="error", message="无效的视频处理会话。"))
         raise HTTPException(status_code=404, detail="无效的视频处理会话。")
-
-    # Add type marker if missing (e.g., if session existed before type field)
-    SESSIONS_DATA[session_id]["type"] = "video"
+    try:
+        resolve_ocr_profile(settings.ocr_profile)
+        ExclusionMatcher(settings.exclusion_list) # Rejects invalid regex rules before the job starts
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     print(f"Received video process request for session {session_id} with settings: {settings}")
-    background_tasks.add_task(run_full_process, session_id, settings)
+    dispatch_job("video", session_id, {"settings": settings.dict()}, background_tasks)
     return {"message": "视频处理已启动。", "session_id": session_id}
 
 
 # --- Background Task for Long Image Processing ---
-async def run_long_image_process(session_id: str, image_path_str: str, settings: LongImageProcessSettings):
+async def run_long_image_process(session_id: str, image_path_str: str, settings: LongImageProcessSettings,
+                                 cancel_token: Optional[CancelToken] = None, tracer: NullTracer = NULL_TRACER):
     """Runs the long image slicing and PDF generation in the background."""
-    if session_id not in SESSIONS_DATA or SESSIONS_DATA[session_id].get("type") != "long_image":
+    session_data = session_store.get(session_id)
+    if not session_data or session_data.get("type") != "long_image":
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="error", message="无效的长截图处理会话。"))
         return
 
     current_loop = asyncio.get_running_loop()
+    cancel_token = cancel_token or CancelToken()
     log_cb = create_async_callback_for_sync_task(session_id, "longImageProcessing", current_loop)
     progress_cb = create_async_callback_for_sync_task(session_id, "longImageProcessing", current_loop, is_progress=True)
 
     try:
-        # 1. Slice Image
-        await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="slicing", message="开始裁剪长截图...", progress=0))
-        temp_slice_dir = TEMP_SESSIONS_BASE_DIR / session_id / "sliced_images"
-        temp_slice_dir.mkdir(parents=True, exist_ok=True)
-
-        # ** Ensure slice_image_sync is implemented in core_workers.py **
-        try:
-            from backend.core_workers import slice_image_sync
-            sliced_image_paths = await current_loop.run_in_executor(
-                None, slice_image_sync,
-                image_path_str, settings.slice_height, settings.overlap, str(temp_slice_dir),
-                log_cb, progress_cb # Pass both callbacks
-            )
-        except ImportError:
-             log_cb("错误: slice_image_sync 函数未在 core_workers.py 中实现!")
-             raise RuntimeError("slice_image_sync function not implemented.")
-        except Exception as slice_err:
-            log_cb(f"裁剪过程中出错: {slice_err}")
-            raise RuntimeError(f"Error during slicing: {slice_err}")
+        checkpoint: Dict[str, Any] = dict(session_data.get("checkpoint") or {})
+        # 0. Stitch overlapping screenshots into the long image (multi-screenshot uploads only)
+        stitch_stats: Optional[Dict[str, Any]] = None
+        screenshot_paths = session_data.get("screenshot_paths")
+        if screenshot_paths:
+            stitch_key = checkpoint_key(screenshots=screenshot_paths, output=image_path_str)
+            stitch_checkpoint = stage_checkpoint(checkpoint, "stitch", stitch_key)
+            if stitch_checkpoint and Path(image_path_str).is_file():
+                stitch_stats = stitch_checkpoint["stitch_stats"]
+            else:
+                reset_checkpoint(session_id, checkpoint, "stitch")
+                await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="slicing", message=f"正在拼接 {len(screenshot_paths)} 张截图...", progress=0))
+                stitch_stats = {}
+                with metrics.STAGE_SECONDS.labels(pipeline="long_image", stage="stitch").time(), tracer.span("stitch", "stage", screenshots=len(screenshot_paths)):
+                    stitched_path = await current_loop.run_in_executor(
+                        None, stitch_screenshots_sync,
+                        screenshot_paths, image_path_str, log_cb, progress_cb, stitch_stats, cancel_token, tracer
+                    )
+                cancel_token.raise_if_cancelled()
+                if not stitched_path: raise RuntimeError("截图拼接失败。")
+                save_checkpoint(session_id, checkpoint, "stitch", stitch_key, stitch_stats=stitch_stats)
+            session_store.update(session_id, stitch_stats=stitch_stats)
 
-        if not sliced_image_paths: raise RuntimeError("长截图裁剪失败或未生成图片。")
-        await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="slicing_complete", message=f"长截图裁剪完成，共 {len(sliced_image_paths)} 张。", progress=100))
+        # 1. Slice Image
+        slice_key = checkpoint_key(image=image_path_str, height=settings.slice_height, overlap=settings.overlap,
+                                   mode=settings.slice_mode, format=settings.slice_format,
+                                   compress_level=settings.slice_png_compress_level, quality=settings.slice_quality,
+                                   embed=settings.pdf_embed_mode)
+        slice_checkpoint = stage_checkpoint(checkpoint, "slice", slice_key)
+        if slice_checkpoint and not all(Path(p).is_file() for p in slice_checkpoint["sliced_images"]):
+            slice_checkpoint = None # The slices are gone
+        if slice_checkpoint:
+            sliced_image_paths = slice_checkpoint["sliced_images"]
+            image_regions = [tuple(region) for region in slice_checkpoint["image_regions"]] if slice_checkpoint["image_regions"] else None
+            slice_stats = slice_checkpoint["slice_stats"]
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="slicing_complete", message=f"长截图已裁剪 (取自检查点)，共 {len(sliced_image_paths)} 张。", progress=100))
+        else:
+            reset_checkpoint(session_id, checkpoint, "slice")
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="slicing", message="开始裁剪长截图...", progress=0))
+            temp_slice_dir = TEMP_SESSIONS_BASE_DIR / session_id / "sliced_images"
+            temp_slice_dir.mkdir(parents=True, exist_ok=True)
+
+            slice_stats: Dict[str, Any] = {}
+            image_regions: Optional[List[Tuple[int, int]]] = None
+            with metrics.STAGE_SECONDS.labels(pipeline="long_image", stage="slice").time(), tracer.span("slice", "stage"):
+                try:
+                    if settings.pdf_embed_mode == "source":
+                        # Zero-copy export: only compute regions; previews come from small thumbnails
+                        image_regions = await current_loop.run_in_executor(
+                            None, plan_long_image_regions_sync,
+                            image_path_str, settings.slice_height, settings.overlap, settings.slice_mode,
+                            log_cb, slice_stats
+                        )
+                        sliced_image_paths = await current_loop.run_in_executor(
+                            None, render_region_thumbnails_sync,
+                            image_path_str, image_regions, str(temp_slice_dir), REGION_THUMBNAIL_WIDTH,
+                            log_cb, progress_cb
+                        ) if image_regions else []
+                    else:
+                        sliced_image_paths = await current_loop.run_in_executor(
+                            None, slice_image_sync,
+                            image_path_str, settings.slice_height, settings.overlap, str(temp_slice_dir),
+                            log_cb, progress_cb, # Pass both callbacks
+                            settings.slice_format, settings.slice_png_compress_level, settings.slice_quality,
+                            None, settings.slice_mode, slice_stats, cancel_token, tracer
+                        )
+                except Exception as slice_err:
+                    log_cb(f"裁剪过程中出错: {slice_err}")
+                    raise RuntimeError(f"Error during slicing: {slice_err}")
+
+            cancel_token.raise_if_cancelled()
+            if not sliced_image_paths: raise RuntimeError("长截图裁剪失败或未生成图片。")
+            slicing_msg = f"长截图裁剪完成，共 {len(sliced_image_paths)} 张。"
+            if stitch_stats:
+                slicing_msg += f" 已由 {stitch_stats['screenshots']} 张截图拼接，去除重复的 {stitch_stats['removed_rows']} 行。"
+            if slice_stats:
+                slicing_msg += f" 空白行对齐节省 {slice_stats['saved_slices']} 张切片，约 {slice_stats['saved_bytes'] / 1024:.1f} KB。"
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="slicing_complete", message=slicing_msg, progress=100))
+            save_checkpoint(session_id, checkpoint, "slice", slice_key, sliced_images=sliced_image_paths,
+                            image_regions=image_regions, slice_stats=slice_stats)
 
         # Update Session Data
-        SESSIONS_DATA[session_id]["sliced_images"] = sliced_image_paths
+        session_store.update(session_id, sliced_images=sliced_image_paths, slice_stats=slice_stats,
+                             image_regions=image_regions)
 
         # Provide Preview URLs
         preview_urls = [f"/get_processed_image/{session_id}/{Path(p).name}?type=sliced" for p in sliced_image_paths]
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="preview_ready", message="预览已生成", preview_images=preview_urls))
+        if not settings.build_pdf:
+            session_store.update(session_id, job_status="completed")
+            await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="completed", message="长截图裁剪完成 (未单独生成PDF)。", progress=100))
+            return
 
         # 2. Handle Sorting
         ordered_sliced_images = sliced_image_paths # Default order
@@ -378,8 +847,17 @@ async def run_long_image_process(session_id: str, image_path_str: str, settings:
             if not ordered_sliced_images:
                 log_cb("警告: 提供的排序列表无效或与切片不匹配，使用默认顺序。")
                 ordered_sliced_images = sliced_image_paths
+        ordered_regions = None
+        if image_regions:
+            # Regions follow the (possibly reordered) thumbnails
+            region_by_name = {Path(p).name: r for p, r in zip(sliced_image_paths, image_regions)}
+            ordered_regions = [region_by_name[Path(p).name] for p in ordered_sliced_images]
 
         # 3. Generate PDF
+        pdf_key = checkpoint_key(slice=slice_key, images=ordered_sliced_images, rows=settings.pdf_rows, cols=settings.pdf_cols,
+                                 layout=settings.pdf_layout, title=settings.pdf_title)
+        if await reuse_pdf_checkpoint(session_id, checkpoint, pdf_key):
+            return
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="pdf_generating", message="开始生成PDF...", progress=0))
         pdf_log_cb_gen = create_async_callback_for_sync_task(session_id, "pdfGenerating", current_loop)
         pdf_progress_cb_gen = create_async_callback_for_sync_task(session_id, "pdfGenerating", current_loop, is_progress=True)
@@ -388,35 +866,248 @@ async def run_long_image_process(session_id: str, image_path_str: str, settings:
         output_pdf_dir.mkdir(parents=True, exist_ok=True)
         pdf_filename_base = "".join(c if c.isalnum() or c in [' ', '-'] else "_" for c in settings.pdf_title).replace(' ', '_')[:50] or "long_screenshot"
         output_pdf_path = output_pdf_dir / f"{pdf_filename_base}_long_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
-        SESSIONS_DATA[session_id]["long_image_pdf_path"] = str(output_pdf_path)
+        session_store.update(session_id, long_image_pdf_path=str(output_pdf_path))
 
         pdf_generator = PdfGenerator(
             ordered_sliced_images, str(output_pdf_path),
             images_per_row=settings.pdf_cols, images_per_col=settings.pdf_rows,
             layout=settings.pdf_layout, # Use layout from settings
             page_title=settings.pdf_title,
-            log_callback=pdf_log_cb_gen, progress_callback=pdf_progress_cb_gen
+            log_callback=pdf_log_cb_gen, progress_callback=pdf_progress_cb_gen,
+            source_image_path=image_path_str if ordered_regions else None,
+            image_regions=ordered_regions, tracer=tracer
         )
-        pdf_success, pdf_msg_or_path = await current_loop.run_in_executor(None, pdf_generator.generate_pdf)
+        cancel_token.register(pdf_generator.stop)
+        with metrics.STAGE_SECONDS.labels(pipeline="long_image", stage="pdf").time(), tracer.span("pdf", "stage"):
+            pdf_success, pdf_msg_or_path = await current_loop.run_in_executor(None, pdf_generator.generate_pdf)
+        cancel_token.unregister(pdf_generator.stop)
+        cancel_token.raise_if_cancelled()
         if not pdf_success: raise RuntimeError(f"PDF生成失败: {pdf_msg_or_path}")
+        save_checkpoint(session_id, checkpoint, "pdf", pdf_key, path=str(output_pdf_path))
 
         pdf_download_url = f"/download_pdf/{session_id}/{output_pdf_path.name}"
+        session_store.update(session_id, job_status="completed")
         await manager.send_status_update(session_id, TaskStatus(
             session_id=session_id, status="completed", message=f"PDF生成成功: {output_pdf_path.name}",
             result_url=pdf_download_url, progress=100
         ))
 
+    except JobCancelledError:
+        await report_job_cancelled(session_id)
     except Exception as e:
         print(f"Error in run_long_image_process for session {session_id}: {e}")
+        session_store.update(session_id, job_status="error", job_error=str(e))
         import traceback
         traceback.print_exc()
         await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="error", message=f"长截图处理出错: {e}"))
 
+# --- Job Dispatch (inline background task or durable queue) ---
+# Cancel tokens of the jobs running in this process (session_id -> token)
+active_cancel_tokens: Dict[str, CancelToken] = {}
+
+
+async def report_job_cancelled(session_id: str):
+    print(f"Job for session {session_id} was cancelled.")
+    session_store.update(session_id, job_status="cancelled")
+    await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="cancelled", message="任务已取消。"))
+
+
+async def watch_for_cancel(session_id: str, cancel_token: CancelToken):
+    """Polls the shared session store so a cancel request handled by any API process reaches this job."""
+    loop = asyncio.get_running_loop()
+    while not cancel_token.cancelled:
+        await asyncio.sleep(CANCEL_POLL_INTERVAL_SECONDS)
+        session_data = await loop.run_in_executor(None, session_store.get, session_id)
+        if session_data is None or session_data.get("job_status") == "cancelling":
+            cancel_token.cancel()
+
+
+def start_job_trace(session_id: str, kind: str, payload: Dict[str, Any],
+                    session_data: Optional[Dict[str, Any]]) -> NullTracer:
+    """Returns a Tracer if the job opted in (or TRACE_JOBS is set), otherwise NULL_TRACER."""
+    if not (TRACE_JOBS or payload.get("settings", {}).get("enable_trace")):
+        return NULL_TRACER
+    tracer = Tracer(session_id)
+    upload = (session_data or {}).get("upload_trace")
+    if upload:
+        tracer.complete("upload_write", "io", upload["start"], upload["duration"], pid=upload["pid"],
+                        tid=upload["tid"], thread_name=upload.get("thread_name"), bytes=upload.get("bytes"))
+    manager.tracers[session_id] = tracer
+    return tracer
+
+
+async def finish_job_trace(session_id: str, tracer: Tracer):
+    """Flushes pending sends into the trace, saves it next to the PDFs and announces the download URL."""
+    try:
+        await manager.flush()
+    finally:
+        manager.tracers.pop(session_id, None)
+    trace_path = OUTPUT_BASE_DIR / session_id / f"{TRACE_FILENAME_PREFIX}{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, tracer.save, trace_path)
+    except Exception as e:
+        print(f"Failed to save trace for session {session_id}: {e}")
+        return
+    session_store.update(session_id, trace_path=str(trace_path))
+    await manager.send_status_update(session_id, TaskStatus(
+        session_id=session_id, status="trace_ready", message=f"性能追踪已保存 ({len(tracer)} 个事件)，可用 Perfetto 打开。",
+        result_url=f"/download_trace/{session_id}"
+    ))
+
+
+async def run_job(kind: str, session_id: str, payload: Dict[str, Any]):
+    """Runs a queued/dispatched job payload with the matching pipeline."""
+    def mark_running(data: Dict[str, Any]):
+        if data.get("job_status") != "cancelling":
+            data["job_status"] = "running"
+            data.pop("job_error", None) # Left over from a failed run that is being resumed
+            data["job_owner"] = current_process_owner() # Lets the janitor spot jobs of dead processes
+    session_data = session_store.mutate(session_id, mark_running)
+    if session_data and session_data.get("queued_at"):
+        metrics.JOB_QUEUE_WAIT_SECONDS.labels(kind=kind).observe(max(0.0, time.time() - session_data["queued_at"]))
+    if session_data and session_data.get("job_status") == "cancelling":
+        await report_job_cancelled(session_id) # Cancelled while waiting to start
+        metrics.JOBS_TOTAL.labels(kind=kind, outcome="cancelled").inc()
+        return
+
+    cancel_token = CancelToken()
+    active_cancel_tokens[session_id] = cancel_token
+    watcher = asyncio.create_task(watch_for_cancel(session_id, cancel_token))
+    tracer = start_job_trace(session_id, kind, payload, session_data)
+    job_timer = metrics.STAGE_SECONDS.labels(pipeline=kind, stage="total").time()
+    try:
+        with job_timer, tracer.span("job", "stage", kind=kind, session_id=session_id):
+            if kind == "video":
+                await run_full_process(session_id, ProcessSettings(**payload["settings"]), cancel_token, tracer)
+            elif kind == "long_image":
+                await run_long_image_process(session_id, payload["image_path"], LongImageProcessSettings(**payload["settings"]),
+                                             cancel_token, tracer)
+            else:
+                raise ValueError(f"Unknown job kind: {kind}")
+    finally:
+        watcher.cancel()
+        active_cancel_tokens.pop(session_id, None)
+        final_data = session_store.get(session_id) or {}
+        metrics.JOBS_TOTAL.labels(kind=kind, outcome=final_data.get("job_status") or "unknown").inc()
+        if tracer.enabled:
+            await finish_job_trace(session_id, tracer)
+
+
+def dispatch_job(kind: str, session_id: str, payload: Dict[str, Any], background_tasks: Optional[BackgroundTasks] = None):
+    """Starts a job in this process, or enqueues it for the worker processes."""
+    # The payload is kept so an interrupted job can be resumed from its checkpoints
+    session_store.update(session_id, job_status="queued", queued_at=time.time(), job_kind=kind, job_payload=payload,
+                         # Inline jobs wait in this process, so a restart loses them
+                         job_owner=current_process_owner() if job_queue is None else None)
+    if job_queue is not None:
+        job_id = job_queue.enqueue(session_id, kind, payload)
+        print(f"Enqueued {kind} job {job_id} for session {session_id}")
+    elif background_tasks is not None:
+        background_tasks.add_task(run_job, kind, session_id, payload)
+    else:
+        asyncio.create_task(run_job(kind, session_id, payload))
+
+
+RESUMABLE_JOB_STATUSES = ("interrupted", "error", "cancelled")
+
+
+def resume_job(session_id: str, background_tasks: Optional[BackgroundTasks] = None) -> bool:
+    """
+    Restarts the session's last job; finished stages are taken from the checkpoints.
+    Returns False if the job is not resumable (or another process resumed it first).
+    """
+    claimed = []
+    def claim(data: Dict[str, Any]):
+        claimed.clear() # mutate() may retry fn
+        resumable = data.get("job_payload") is not None or data.get("type") == "batch"
+        if data.get("job_status") in RESUMABLE_JOB_STATUSES and resumable:
+            data["job_status"] = "queued"
+            claimed.append(True)
+    session_data = session_store.mutate(session_id, claim)
+    if not session_data or not claimed:
+        return False
+    print(f"Resuming {session_data.get('job_kind') or session_data.get('type')} job of session {session_id}")
+    if session_data.get("type") == "batch":
+        if background_tasks is not None:
+            background_tasks.add_task(run_batch, session_id)
+        else:
+            asyncio.create_task(run_batch(session_id))
+    else:
+        dispatch_job(session_data["job_kind"], session_id, session_data["job_payload"], background_tasks)
+    return True
+
+
+async def resume_interrupted_jobs():
+    """Resumes the jobs the janitor's startup scan found interrupted (inline mode; workers requeue their own)."""
+    resumed = 0
+    for session_id, data in list(session_store.items()):
+        # Items of a batch are resumed by their batch
+        if data.get("job_status") == "interrupted" and not data.get("batch_id") and resume_job(session_id):
+            resumed += 1
+    if resumed:
+        print(f"Resumed {resumed} interrupted job(s) from their checkpoints.")
+
+
+async def relay_worker_events():
+    """Forwards status events published by worker processes to the local WebSocket clients."""
+    loop = asyncio.get_running_loop()
+    last_event_id = await loop.run_in_executor(None, job_queue.latest_event_id)
+    last_prune = loop.time()
+    while True:
+        try:
+            events = await loop.run_in_executor(None, job_queue.fetch_events, last_event_id)
+            for event_id, session_id, batch in events:
+                last_event_id = event_id
+                for payload in batch:
+                    manager.publish(session_id, TaskStatus(**payload))
+            if loop.time() - last_prune > 60:
+                last_prune = loop.time()
+                await loop.run_in_executor(None, job_queue.prune_events)
+            if not events:
+                await asyncio.sleep(EVENT_RELAY_INTERVAL_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error relaying worker events: {e}")
+            await asyncio.sleep(1)
+
+
+async def run_janitor():
+    """Startup scan, then periodic TTL/quota collection."""
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, janitor.startup_scan)
+        if RESUME_INTERRUPTED_JOBS and job_queue is None:
+            await resume_interrupted_jobs()
+    except Exception as e:
+        print(f"Janitor startup scan failed: {e}")
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+        try:
+            removed = await loop.run_in_executor(None, janitor.collect)
+            for session_id in removed:
+                manager.discard_session(session_id)
+        except Exception as e:
+            print(f"Janitor collection failed: {e}")
+
+
+@app.on_event("startup")
+async def start_event_relay():
+    asyncio.create_task(manager.run_flusher())
+    asyncio.create_task(run_janitor())
+    asyncio.create_task(metrics.monitor_event_loop_lag())
+    if OCR_WARMUP_ON_STARTUP and job_queue is None: # In queue mode only the workers run OCR
+        asyncio.get_running_loop().run_in_executor(None, warm_up_ocr_engine)
+    if job_queue is not None:
+        asyncio.create_task(relay_worker_events())
+        print("Job execution mode: queue (start workers with `python -m backend.worker`).")
+
+
 # --- New API Endpoint for Long Image ---
 @app.post("/slice_long_image/")
 async def slice_long_image_endpoint(
     # Use Form for parameters when Content-Type is multipart/form-data
-    long_image_file: UploadFile = File(...),
+    long_image_file: List[UploadFile] = File(...), # Several overlapping screenshots are stitched first
     slice_height: int = Form(...),
     overlap: int = Form(...),
     pdf_rows: int = Form(...),
@@ -424,19 +1115,43 @@ async def slice_long_image_endpoint(
     pdf_title: str = Form(...),
     pdf_layout: str = Form(...),
     image_order_json: Optional[str] = Form(None), # Receive image order as JSON string
+    slice_mode: str = Form('fixed'),
+    slice_format: str = Form('auto'),
+    slice_png_compress_level: int = Form(6),
+    slice_quality: int = Form(90),
+    pdf_embed_mode: str = Form('slices'),
+    enable_trace: bool = Form(False),
     background_tasks: BackgroundTasks = BackgroundTasks()
 ):
-    """Handles long image uploads and starts the slicing/PDF generation task."""
+    """
+    Handles long image uploads and starts the slicing/PDF generation task.
+    Several files are taken as overlapping screenshots in scroll order and stitched into one long image.
+    """
     session_id = str(uuid.uuid4())
     session_dir = TEMP_SESSIONS_BASE_DIR / session_id
     session_dir.mkdir(parents=True, exist_ok=True)
-    image_filename = f"original_long_{long_image_file.filename}"
-    image_path = session_dir / image_filename
-
+    first_file = long_image_file[0]
+    screenshot_paths: Optional[List[str]] = None
+    if len(long_image_file) == 1:
+        display_filename = first_file.filename
+        image_path = session_dir / f"original_long_{first_file.filename}"
+        targets = [image_path]
+    else:
+        display_filename = f"{first_file.filename} 等 {len(long_image_file)} 张截图"
+        stitched_suffix = ".jpg" if Path(first_file.filename).suffix.lower() in (".jpg", ".jpeg") else ".png"
+        image_path = session_dir / f"stitched_long{stitched_suffix}"
+        screenshots_dir = session_dir / "screenshots"
+        screenshots_dir.mkdir(exist_ok=True)
+        targets = [screenshots_dir / f"{i:04d}_{Path(f.filename).name}" for i, f in enumerate(long_image_file)]
+        screenshot_paths = [str(p) for p in targets]
+
+    upload_start = time.time()
     try:
-        with open(image_path, "wb") as buffer: shutil.copyfileobj(long_image_file.file, buffer)
+        for upload, target in zip(long_image_file, targets):
+            with open(target, "wb") as buffer: shutil.copyfileobj(upload.file, buffer)
     except Exception as e: return JSONResponse(status_code=500, content={"message": f"Error saving image: {e}"})
-    finally: long_image_file.file.close()
+    finally:
+        for upload in long_image_file: upload.file.close()
 
     image_order_list = None
     if image_order_json:
@@ -448,33 +1163,318 @@ async def slice_long_image_endpoint(
             print(f"Warning: Could not decode image_order_json for session {session_id}")
             image_order_list = None
 
-    SESSIONS_DATA[session_id] = {
-        "type": "long_image",
-        "long_image_path": str(image_path),
-        "sliced_images": [],
-        "long_image_pdf_path": None,
-        "original_long_image_filename": long_image_file.filename
-    }
+    session_store.create(session_id, long_image_session_data(
+        image_path, display_filename,
+        timed_record(upload_start, time.time() - upload_start, bytes=sum(p.stat().st_size for p in targets)),
+        screenshot_paths))
 
     settings = LongImageProcessSettings(
         slice_height=slice_height, overlap=overlap, pdf_rows=pdf_rows,
         pdf_cols=pdf_cols, pdf_title=pdf_title, pdf_layout=pdf_layout,
+        slice_mode=slice_mode, slice_format=slice_format, slice_png_compress_level=slice_png_compress_level,
+        slice_quality=slice_quality, pdf_embed_mode=pdf_embed_mode, enable_trace=enable_trace,
         image_order=image_order_list # Pass the parsed list
     )
 
     print(f"Received long image process request, session {session_id}, settings: {settings}")
-    await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="upload_complete", message=f"长截图 '{long_image_file.filename}' 上传成功。"))
-    background_tasks.add_task(run_long_image_process, session_id, str(image_path), settings)
+    await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="upload_complete", message=f"长截图 '{display_filename}' 上传成功。"))
+    dispatch_job("long_image", session_id, {"image_path": str(image_path), "settings": settings.dict()}, background_tasks)
     return {"message": "长截图处理已启动。", "session_id": session_id}
 
 
+# --- Batch Jobs (many videos / long screenshots in one request) ---
+BATCH_POLL_INTERVAL_SECONDS = 1.0 # How often the batch coordinator checks its items and publishes progress
+# Shared by every inline batch: items of concurrent batches take turns instead of oversubscribing the CPU
+batch_item_slots: Optional[asyncio.Semaphore] = None
+
+
+def get_batch_item_slots() -> asyncio.Semaphore:
+    global batch_item_slots
+    if batch_item_slots is None:
+        batch_item_slots = asyncio.Semaphore(BATCH_MAX_PARALLEL_ITEMS)
+    return batch_item_slots
+
+
+async def run_batch_item(kind: str, session_id: str, payload: Dict[str, Any]):
+    """Runs one inline batch item once a process-wide slot is free."""
+    async with get_batch_item_slots():
+        try:
+            await run_job(kind, session_id, payload)
+        except Exception as e:
+            print(f"Batch item {session_id} failed: {e}")
+            session_store.update(session_id, job_status="error")
+
+
+def start_batch_item(item: Dict[str, Any]):
+    session_store.update(item["session_id"], job_status="queued", queued_at=time.time(),
+                         job_kind=item["kind"], job_payload=item["payload"],
+                         job_owner=current_process_owner() if job_queue is None else None)
+    if job_queue is not None:
+        job_id = job_queue.enqueue(item["session_id"], item["kind"], item["payload"])
+        print(f"Enqueued batch item {item['index']} ({item['kind']}) as job {job_id}")
+    else:
+        asyncio.create_task(run_batch_item(item["kind"], item["session_id"], item["payload"]))
+
+
+def batch_item_result_url(session_id: str, session_data: Dict[str, Any]) -> Optional[str]:
+    pdf_path = session_data.get("video_pdf_path") or session_data.get("long_image_pdf_path")
+    return f"/download_pdf/{session_id}/{Path(pdf_path).name}" if pdf_path and Path(pdf_path).is_file() else None
+
+
+def publish_batch_progress(batch_id: str, progress: BatchProgress):
+    details = progress.snapshot()
+    session_store.update(batch_id, batch_details=details)
+    message = f"已完成 {details['succeeded']}/{details['total']} 项"
+    if details["failed"]:
+        message += f"，失败 {details['failed']} 项"
+    if details["cancelled"]:
+        message += f"，取消 {details['cancelled']} 项"
+    manager.publish(batch_id, TaskStatus(session_id=batch_id, status="batch_progress", message=message + "。",
+                                         progress=details["progress"], details=details))
+
+
+async def build_combined_pdf(batch_id: str, items: List[Dict[str, Any]], settings: BatchSettings,
+                             progress: BatchProgress, cancel_token: CancelToken) -> str:
+    """Lays out the kept frames / slices of all successful items, in upload order, into one PDF."""
+    current_loop = asyncio.get_running_loop()
+    images: List[str] = []
+    for item in items:
+        data = session_store.get(item["session_id"]) or {}
+        if data.get("job_status") == "completed":
+            images.extend(data.get("kept_images") or data.get("sliced_images") or [])
+    if not images: raise RuntimeError("没有可合并的图片。")
+
+    output_pdf_dir = OUTPUT_BASE_DIR / batch_id
+    output_pdf_dir.mkdir(parents=True, exist_ok=True)
+    pdf_filename_base = "".join(c if c.isalnum() or c in [' ', '-'] else "_" for c in settings.pdf_title).replace(' ', '_')[:50] or "batch_evidence"
+    output_pdf_path = output_pdf_dir / f"{pdf_filename_base}_batch_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.pdf"
+    session_store.update(batch_id, batch_pdf_path=str(output_pdf_path))
+
+    await manager.send_status_update(batch_id, TaskStatus(session_id=batch_id, status="pdf_generating", message=f"开始生成合并PDF ({len(images)} 张图片)...", progress=0))
+    pdf_generator = PdfGenerator(
+        images, str(output_pdf_path), settings.pdf_cols, settings.pdf_rows,
+        layout=settings.pdf_layout, page_title=settings.pdf_title,
+        log_callback=create_async_callback_for_sync_task(batch_id, "pdf_generating", current_loop),
+        progress_callback=create_async_callback_for_sync_task(batch_id, "pdf_generating", current_loop, is_progress=True)
+    )
+    cancel_token.register(pdf_generator.stop)
+    with metrics.STAGE_SECONDS.labels(pipeline="batch", stage="pdf").time():
+        pdf_success, pdf_msg_or_path = await current_loop.run_in_executor(None, pdf_generator.generate_pdf)
+    cancel_token.unregister(pdf_generator.stop)
+    cancel_token.raise_if_cancelled()
+    if not pdf_success: raise RuntimeError(f"合并PDF生成失败: {pdf_msg_or_path}")
+    progress.set_combined_progress(100)
+    return f"/download_pdf/{batch_id}/{output_pdf_path.name}"
+
+
+async def run_batch(batch_id: str):
+    """
+    Coordinates a batch: starts at most BATCH_MAX_PARALLEL_ITEMS items at a
+    time (as inline tasks or queue jobs), folds their events into per-item and
+    aggregate progress, and builds the combined PDF when requested.
+    """
+    current_loop = asyncio.get_running_loop()
+    batch = session_store.get(batch_id)
+    settings = BatchSettings(**batch["settings"])
+    items: List[Dict[str, Any]] = batch["items"]
+    progress = BatchProgress(items, combined_pdf=settings.combined_pdf)
+    for item in items:
+        manager.observers[item["session_id"]] = progress.observe
+    cancel_token = CancelToken()
+    active_cancel_tokens[batch_id] = cancel_token
+    session_store.update(batch_id, job_status="running", job_owner=current_process_owner())
+    published_version = -1
+
+    try:
+        if job_queue is None and any(item["kind"] == "video" for item in items):
+            # Load the model once before fanning out, so parallel items do not all wait on (or race) the first load
+            ocr_profile = resolve_ocr_profile(settings.video.ocr_profile)
+            await manager.send_status_update(batch_id, TaskStatus(session_id=batch_id, status="batch_preparing", message=f"正在加载OCR模型 ({ocr_profile})..."))
+            await current_loop.run_in_executor(None, warm_up_ocr_engine, ocr_profile)
+
+        pending, running = [], []
+        children_cancelled = False
+        for item in items:
+            item_data = session_store.get(item["session_id"]) or {}
+            if item_data.get("job_status") == "completed": # Finished before the batch was interrupted
+                progress.finish(item["session_id"], "completed", result_url=batch_item_result_url(item["session_id"], item_data))
+            else:
+                pending.append(item)
+        while pending or running:
+            batch_data = await current_loop.run_in_executor(None, session_store.get, batch_id)
+            if not cancel_token.cancelled and (batch_data is None or batch_data.get("job_status") == "cancelling"):
+                cancel_token.cancel()
+            if cancel_token.cancelled and not children_cancelled:
+                # Also when every item has already started and nothing is pending any more
+                children_cancelled = True
+                for item in running:
+                    await request_job_cancel(item["session_id"])
+                for item in pending:
+                    session_store.update(item["session_id"], job_status="cancelled")
+                    progress.finish(item["session_id"], "cancelled", "任务已取消。")
+                pending = []
+            while pending and len(running) < BATCH_MAX_PARALLEL_ITEMS:
+                item = pending.pop(0)
+                start_batch_item(item)
+                running.append(item)
+            await asyncio.sleep(BATCH_POLL_INTERVAL_SECONDS)
+            for item in list(running):
+                data = await current_loop.run_in_executor(None, session_store.get, item["session_id"])
+                job_status = (data or {}).get("job_status")
+                if job_status not in JOB_ACTIVE_STATUSES:
+                    progress.finish(item["session_id"], job_status or "error", result_url=batch_item_result_url(item["session_id"], data or {}))
+                    running.remove(item)
+            if progress.version != published_version:
+                published_version = progress.version
+                publish_batch_progress(batch_id, progress)
+
+        await manager.flush() # Let the items' final events reach the tracker before summarizing
+        cancel_token.raise_if_cancelled()
+        counts = progress.counts()
+        if not counts["succeeded"]:
+            raise RuntimeError("批量任务中没有成功处理的文件。")
+        result_url = None
+        if settings.combined_pdf:
+            result_url = await build_combined_pdf(batch_id, items, settings, progress, cancel_token)
+        details = progress.snapshot()
+        session_store.update(batch_id, job_status="completed", batch_details=details)
+        message = f"批量任务完成: 成功 {counts['succeeded']} 项，失败 {counts['failed']} 项。"
+        await manager.send_status_update(batch_id, TaskStatus(
+            session_id=batch_id, status="completed", message=message, progress=100,
+            result_url=result_url, details=details
+        ))
+    except JobCancelledError:
+        session_store.update(batch_id, batch_details=progress.snapshot())
+        await report_job_cancelled(batch_id)
+    except Exception as e:
+        print(f"Error in run_batch for batch {batch_id}: {e}")
+        details = progress.snapshot()
+        session_store.update(batch_id, job_status="error", batch_details=details)
+        await manager.send_status_update(batch_id, TaskStatus(session_id=batch_id, status="error", message=f"批量任务出错: {e}", details=details))
+    finally:
+        active_cancel_tokens.pop(batch_id, None)
+        for item in items:
+            manager.observers.pop(item["session_id"], None)
+
+
+def parse_batch_settings(settings_json: Optional[str]) -> BatchSettings:
+    try:
+        settings = BatchSettings(**json.loads(settings_json)) if settings_json else BatchSettings()
+        resolve_ocr_profile(settings.video.ocr_profile)
+        ExclusionMatcher(settings.video.exclusion_list)
+    except (json.JSONDecodeError, TypeError, ValueError) as e: # pydantic's ValidationError is a ValueError
+        raise HTTPException(status_code=400, detail=f"批量任务设置无效: {e}")
+    if settings.combined_pdf:
+        # Combined pages are laid out from plain image files: no frame store, no source-embedded regions
+        settings.video.use_frame_store = False
+        settings.long_image.pdf_embed_mode = 'slices'
+    settings.video.build_pdf = settings.long_image.build_pdf = not settings.combined_pdf
+    settings.video.image_order = settings.long_image.image_order = None # Names differ per item
+    return settings
+
+
+@app.post("/batch_jobs/")
+async def create_batch_job(
+    files: List[UploadFile] = File(...),
+    settings_json: Optional[str] = Form(None), # BatchSettings as JSON
+    background_tasks: BackgroundTasks = BackgroundTasks()
+):
+    """
+    Accepts several videos / long screenshots (or ZIP archives of them) and
+    processes every file as its own item. Progress is published on the
+    returned batch_id's WebSocket as "batch_progress" events whose details
+    hold per-item state.
+    """
+    settings = parse_batch_settings(settings_json)
+    batch_id = str(uuid.uuid4())
+    upload_dir = TEMP_SESSIONS_BASE_DIR / batch_id / "uploads"
+    upload_dir.mkdir(parents=True, exist_ok=True)
+
+    sources: List[Tuple[Path, str]] = [] # (saved file, original name)
+    skipped: List[str] = []
+    try:
+        for index, upload in enumerate(files):
+            saved_path = upload_dir / f"{index:04d}_{Path(upload.filename or 'upload').name}"
+            try:
+                with open(saved_path, "wb") as buffer: shutil.copyfileobj(upload.file, buffer)
+            finally: upload.file.close()
+            if saved_path.suffix.lower() == ".zip":
+                extracted, zip_skipped = await asyncio.get_running_loop().run_in_executor(
+                    None, expand_zip, saved_path, upload_dir / f"{index:04d}_unzipped")
+                sources.extend((path, display_name(path)) for path in extracted)
+                skipped.extend(f"{upload.filename}/{name}" for name in zip_skipped)
+                saved_path.unlink(missing_ok=True)
+            elif classify_file(saved_path.name):
+                sources.append((saved_path, upload.filename))
+            else:
+                skipped.append(upload.filename)
+    except (zipfile.BadZipFile, ValueError) as e:
+        shutil.rmtree(TEMP_SESSIONS_BASE_DIR / batch_id, ignore_errors=True)
+        raise HTTPException(status_code=400, detail=f"无法读取压缩包: {e}")
+    if not sources or len(sources) > BATCH_MAX_ITEMS:
+        shutil.rmtree(TEMP_SESSIONS_BASE_DIR / batch_id, ignore_errors=True)
+        detail = "没有可处理的视频或图片文件。" if not sources else f"文件数量超过上限 ({BATCH_MAX_ITEMS})。"
+        raise HTTPException(status_code=400, detail=detail)
+
+    items: List[Dict[str, Any]] = []
+    for index, (source_path, filename) in enumerate(sources):
+        kind = classify_file(source_path.name)
+        session_id = str(uuid.uuid4())
+        session_dir = TEMP_SESSIONS_BASE_DIR / session_id
+        session_dir.mkdir(parents=True, exist_ok=True)
+        if kind == "video":
+            item_path = session_dir / Path(filename).name
+            shutil.move(str(source_path), item_path)
+            session_data = video_session_data(item_path, filename, timed_record(time.time(), 0.0))
+            payload = {"settings": settings.video.dict()}
+        else:
+            item_path = session_dir / f"original_long_{Path(filename).name}"
+            shutil.move(str(source_path), item_path)
+            session_data = long_image_session_data(item_path, filename, timed_record(time.time(), 0.0))
+            payload = {"image_path": str(item_path), "settings": settings.long_image.dict()}
+        session_store.create(session_id, {**session_data, "batch_id": batch_id})
+        items.append({"index": index, "filename": filename, "kind": kind, "session_id": session_id, "payload": payload})
+    shutil.rmtree(upload_dir, ignore_errors=True)
+
+    session_store.create(batch_id, {
+        "type": "batch",
+        "settings": settings.dict(),
+        "items": items,
+        "skipped_files": skipped,
+        "batch_details": None,
+        "batch_pdf_path": None,
+        "job_status": "queued",
+        "queued_at": time.time(),
+    })
+    print(f"Batch {batch_id} created with {len(items)} item(s), {len(skipped)} skipped.")
+    message = f"批量任务已创建，共 {len(items)} 个文件。" + (f" 跳过 {len(skipped)} 个不支持的文件。" if skipped else "")
+    await manager.send_status_update(batch_id, TaskStatus(session_id=batch_id, status="upload_complete", message=message))
+    background_tasks.add_task(run_batch, batch_id)
+    return {
+        "batch_id": batch_id, "message": message, "skipped_files": skipped,
+        "items": [{key: item[key] for key in ("index", "filename", "kind", "session_id")} for item in items],
+    }
+
+
+@app.get("/batch_jobs/{batch_id}")
+async def get_batch_job(batch_id: str):
+    """Current per-item and aggregate state of a batch (the same details as its last progress event)."""
+    batch = session_store.get(batch_id)
+    if not batch or batch.get("type") != "batch":
+        raise HTTPException(status_code=404, detail=f"批量任务 {batch_id} 未找到。")
+    details = batch.get("batch_details") or BatchProgress(batch["items"]).snapshot()
+    result_url = f"/download_pdf/{batch_id}/{Path(batch['batch_pdf_path']).name}" if batch.get("batch_pdf_path") and batch.get("job_status") == "completed" else None
+    return {"batch_id": batch_id, "job_status": batch.get("job_status"), "skipped_files": batch.get("skipped_files", []),
+            "result_url": result_url, **details}
+
+
 # --- Modified Endpoints for Image/PDF Retrieval and Cleanup ---
 
 @app.get("/get_processed_image/{session_id}/{image_name}")
 async def get_processed_image(session_id: str, image_name: str, type: Optional[str] = Query(None)):
     """Serves processed images (video frames or sliced images)."""
-    if session_id not in SESSIONS_DATA: raise HTTPException(status_code=404, detail="会话未找到")
-    session_data = SESSIONS_DATA[session_id]
+    session_data = session_store.get(session_id)
+    if not session_data: raise HTTPException(status_code=404, detail="会话未找到")
 
     base_dir = None
     if type == "sliced" and session_data.get("type") == "long_image":
@@ -489,6 +1489,13 @@ async def get_processed_image(session_id: str, image_name: str, type: Optional[s
          raise HTTPException(status_code=404, detail=f"图片基础目录未找到: {base_dir}")
 
     image_path = base_dir / image_name
+    frame_store_path = session_data.get("frame_store_path")
+    if not image_path.is_file() and frame_store_path and Path(frame_store_path).is_file():
+        # Frames extracted into the single-file store are served straight from it
+        with FrameStore(frame_store_path) as frame_store:
+            frame_index = frame_store.index_of(image_name)
+            if frame_index is not None:
+                return Response(content=frame_store.get_bytes(frame_index), media_type="image/png")
     if not image_path.is_file(): # Use is_file() for better check
         print(f"Image not found at expected path: {image_path}")
         raise HTTPException(status_code=404, detail=f"图片 '{image_name}' 未找到。")
@@ -502,18 +1509,22 @@ async def get_processed_image(session_id: str, image_name: str, type: Optional[s
 @app.get("/download_pdf/{session_id}/{pdf_name}")
 async def download_pdf_file(session_id: str, pdf_name: str):
     """Serves the generated PDF file."""
-    if session_id not in SESSIONS_DATA: raise HTTPException(status_code=404, detail="会话未找到")
-    session_data = SESSIONS_DATA[session_id]
+    session_data = session_store.get(session_id)
+    if not session_data: raise HTTPException(status_code=404, detail="会话未找到")
 
     pdf_path_str = None
     # Check both potential PDF path keys based on the name matching
     long_pdf_path = session_data.get("long_image_pdf_path")
     video_pdf_path = session_data.get("video_pdf_path")
 
+    batch_pdf_path = session_data.get("batch_pdf_path")
+
     if long_pdf_path and Path(long_pdf_path).name == pdf_name:
         pdf_path_str = long_pdf_path
     elif video_pdf_path and Path(video_pdf_path).name == pdf_name:
          pdf_path_str = video_pdf_path
+    elif batch_pdf_path and Path(batch_pdf_path).name == pdf_name:
+        pdf_path_str = batch_pdf_path
 
     if not pdf_path_str:
         raise HTTPException(status_code=404, detail=f"名为 '{pdf_name}' 的 PDF 记录未在会话 {session_id} 中找到。")
@@ -522,18 +1533,143 @@ async def download_pdf_file(session_id: str, pdf_name: str):
     if not pdf_path.is_file():
         print(f"PDF file not found at expected path: {pdf_path}")
         raise HTTPException(status_code=404, detail=f"PDF 文件在路径 {pdf_path} 未找到。")
+    session_store.update(session_id) # Mark as recently used for the janitor
 
     return FileResponse(str(pdf_path), media_type='application/pdf', filename=pdf_name)
 
+@app.get("/download_trace/{session_id}")
+async def download_trace(session_id: str):
+    """Serves the job's Chrome trace-event JSON (open in https://ui.perfetto.dev or chrome://tracing)."""
+    session_data = session_store.get(session_id)
+    if not session_data: raise HTTPException(status_code=404, detail="会话未找到")
+    trace_path_str = session_data.get("trace_path")
+    if not trace_path_str or not Path(trace_path_str).is_file():
+        raise HTTPException(status_code=404, detail="该会话没有性能追踪记录。处理时请勾选“记录性能追踪”。")
+    return FileResponse(trace_path_str, media_type="application/json", filename=Path(trace_path_str).name)
+
+@app.get("/admin/disk_usage")
+async def admin_disk_usage(x_admin_token: Optional[str] = Header(None)):
+    """Reports per-session disk usage, the quota/TTL settings and the last janitor pass."""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="无效的管理令牌。")
+    return await asyncio.get_running_loop().run_in_executor(None, janitor.usage)
+
+
+_directory_sizes: Dict[str, Any] = {"scanned_at": 0.0, "temp": 0, "output": 0}
+
+
+def _scan_directory_sizes():
+    _directory_sizes.update(temp=directory_size(TEMP_SESSIONS_BASE_DIR), output=directory_size(OUTPUT_BASE_DIR),
+                            scanned_at=time.time())
+
+
+@app.get("/health")
+async def health():
+    """Liveness: the process is up and serving HTTP."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness: 200 once this process can run jobs (OCR model loaded and warmed
+    up in inline mode; always in queue mode, where workers run OCR), else 503.
+    """
+    ocr_status = ocr_engine_status()
+    is_ready = job_queue is not None or (ocr_status["state"] == OCR_STATE_READY and ocr_status["warmed_up"])
+    content = {"ready": is_ready, "job_execution_mode": JOB_EXECUTION_MODE, "ocr": ocr_status}
+    return JSONResponse(status_code=200 if is_ready else 503, content=content)
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition of pipeline, queue, WebSocket and disk metrics."""
+    loop = asyncio.get_running_loop()
+    sessions = await loop.run_in_executor(None, session_store.items)
+    metrics.SESSIONS.set(len(sessions))
+    metrics.ACTIVE_JOBS.clear()
+    for status in JOB_ACTIVE_STATUSES:
+        metrics.ACTIVE_JOBS.labels(status=status).set(sum(1 for _, data in sessions if data.get("job_status") == status))
+    if job_queue is not None:
+        metrics.JOB_QUEUE_DEPTH.set(await loop.run_in_executor(None, job_queue.depth))
+    metrics.WS_CLIENTS.set(sum(len(clients) for clients in manager.active_connections.values()))
+    if time.time() - _directory_sizes["scanned_at"] > METRICS_DISK_SCAN_INTERVAL_SECONDS:
+        await loop.run_in_executor(None, _scan_directory_sizes)
+    metrics.DIRECTORY_BYTES.labels(directory="temp").set(_directory_sizes["temp"])
+    metrics.DIRECTORY_BYTES.labels(directory="output").set(_directory_sizes["output"])
+    metrics.OCR_ENGINE_READY.set(1 if ocr_engine_status()["state"] == OCR_STATE_READY else 0)
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def request_job_cancel(session_id: str) -> Optional[Dict[str, Any]]:
+    """Marks the session's queued/running job as cancelling and signals it. Returns the session data."""
+    def mark_cancelling(data: Dict[str, Any]):
+        if data.get("job_status") in ("queued", "running"):
+            data["job_status"] = "cancelling"
+    session_data = session_store.mutate(session_id, mark_cancelling)
+    if session_data is None or session_data.get("job_status") != "cancelling":
+        return session_data
+    cancel_token = active_cancel_tokens.get(session_id)
+    if cancel_token:
+        cancel_token.cancel() # Running in this process: stop FFmpeg / OCR / PDF right away
+    if job_queue is not None and job_queue.cancel_queued(session_id):
+        await report_job_cancelled(session_id) # Never claimed by a worker; nothing to stop
+    print(f"Cancellation requested for session {session_id}")
+    return session_data
+
+
+async def wait_for_job_stop(session_id: str, timeout: float) -> bool:
+    """Waits until the session has no active job. Returns False on timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while loop.time() < deadline:
+        session_data = session_store.get(session_id)
+        if not session_data or session_data.get("job_status") not in JOB_ACTIVE_STATUSES:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+@app.post("/cancel_job/{session_id}")
+async def cancel_job(session_id: str):
+    """Cancels the session's queued or running job (kills FFmpeg, stops OCR/PDF work)."""
+    session_data = await request_job_cancel(session_id)
+    if session_data is None:
+        raise HTTPException(status_code=404, detail=f"会话 {session_id} 未找到。")
+    job_status = session_data.get("job_status")
+    if job_status != "cancelling":
+        return {"message": "当前没有正在运行的任务。", "job_status": job_status}
+    return {"message": "已请求取消任务，正在停止...", "job_status": job_status}
+
+
+@app.post("/resume_job/{session_id}")
+async def resume_job_endpoint(session_id: str, background_tasks: BackgroundTasks):
+    """Restarts an interrupted, failed or cancelled job from its last checkpoint."""
+    session_data = session_store.get(session_id)
+    if session_data is None:
+        raise HTTPException(status_code=404, detail=f"会话 {session_id} 未找到。")
+    if not resume_job(session_id, background_tasks):
+        job_status = (session_store.get(session_id) or {}).get("job_status")
+        return JSONResponse(status_code=409, content={"message": "当前没有可恢复的任务。", "job_status": job_status})
+    await manager.send_status_update(session_id, TaskStatus(session_id=session_id, status="resuming", message="正在从检查点恢复任务..."))
+    return {"message": "任务已恢复，已完成的阶段将被跳过。", "session_id": session_id}
+
+
 @app.post("/cleanup_session/{session_id}")
 async def cleanup_session(session_id: str):
-    """Cleans up temporary files and session data."""
+    """Cleans up temporary files and session data. A running job is cancelled and awaited first."""
     session_dir = TEMP_SESSIONS_BASE_DIR / session_id
     output_dir = OUTPUT_BASE_DIR / session_id
     cleaned_temp, cleaned_output, session_removed = False, False, False
 
     print(f"Attempting to cleanup session: {session_id}")
 
+    session_data = session_store.get(session_id)
+    if session_data and session_data.get("job_status") in JOB_ACTIVE_STATUSES:
+        await request_job_cancel(session_id)
+        if not await wait_for_job_stop(session_id, CLEANUP_CANCEL_TIMEOUT_SECONDS):
+            raise HTTPException(status_code=409, detail="任务仍在停止中，请稍后再清理。")
+
     if session_dir.exists():
         try:
             shutil.rmtree(session_dir)
@@ -550,12 +1686,17 @@ async def cleanup_session(session_id: str):
         except Exception as e: print(f"清理输出目录 {session_id} 出错: {e}")
     else: print(f"Output directory not found: {output_dir}")
 
-    if session_id in SESSIONS_DATA:
-        del SESSIONS_DATA[session_id]
+    if session_store.delete(session_id):
         session_removed = True
         print(f"Removed session data entry for: {session_id}")
 
-    manager.disconnect(session_id) # Also disconnect WebSocket
+    manager.discard_session(session_id) # Also disconnect WebSockets and drop the event log
+
+    for item in (session_data or {}).get("items") or []: # A batch takes its item sessions with it
+        try:
+            await cleanup_session(item["session_id"])
+        except HTTPException:
+            pass
 
     if cleaned_temp or cleaned_output or session_removed:
         return {"message": f"会话 {session_id} 已清理。"}
@@ -568,8 +1709,7 @@ async def cleanup_session(session_id: str):
 if __name__ == "__main__":
     import uvicorn
     print("-" * 30)
-    if OCR_ENGINE is None: print("⚠️ 警告: PaddleOCR 未能初始化。OCR功能将无法工作。")
-    else: print("✅ PaddleOCR 引擎已成功初始化。")
+    print(f"OCR 引擎将在后台加载 (OCR_WARMUP_ON_STARTUP={OCR_WARMUP_ON_STARTUP})，就绪状态见 /ready。")
     print(f"🚀 启动应用 '{APP_NAME}' 版本 '{APP_VERSION}'")
     print(f"    临时会话目录: {TEMP_SESSIONS_BASE_DIR.resolve()}")
     print(f"    输出目录: {OUTPUT_BASE_DIR.resolve()}")
@@ -0,0 +1,309 @@
+# backend/metrics.py
+"""
+Minimal Prometheus-style metrics.
+
+A small in-process registry of counters, gauges and histograms rendered in
+the Prometheus text exposition format (version 0.0.4), so the API can serve
+``/metrics`` without an extra dependency.  Metrics are per process: the API
+exposes its own on ``/metrics`` and every ``backend.worker`` can expose its
+pipeline metrics with ``--metrics-port``.
+
+Usage mirrors prometheus_client:
+
+    STAGE_SECONDS.labels(pipeline="video", stage="ocr_filter").observe(12.3)
+    with STAGE_SECONDS.labels(pipeline="video", stage="pdf").time():
+        ...
+"""
+import asyncio
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+EVENT_LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Timer:
+    def __init__(self, observe):
+        self._observe = observe
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._observe(time.perf_counter() - self._start)
+
+
+class _Metric:
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[LabelValues, "_Metric"] = {}
+        (registry or REGISTRY).register(self)
+
+    def labels(self, **labels: str) -> "_Child":
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return _Child(self, tuple(str(labels[name]) for name in self.labelnames))
+
+    def _key(self, key: Optional[LabelValues]) -> LabelValues:
+        if key is None:
+            if self.labelnames:
+                raise ValueError(f"{self.name} requires labels {self.labelnames}")
+            return ()
+        return key
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class _Child:
+    """A metric bound to one set of label values."""
+
+    def __init__(self, metric: _Metric, key: LabelValues):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1.0):
+        self._metric.inc(amount, _key=self._key)
+
+    def dec(self, amount: float = 1.0):
+        self._metric.dec(amount, _key=self._key)
+
+    def set(self, value: float):
+        self._metric.set(value, _key=self._key)
+
+    def observe(self, value: float):
+        self._metric.observe(value, _key=self._key)
+
+    def time(self) -> _Timer:
+        return _Timer(self.observe)
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, _key: Optional[LabelValues] = None):
+        if amount < 0:
+            raise ValueError("Counters can only increase.")
+        key = self._key(_key)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _label_text(self.labelnames, key), value
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, _key: Optional[LabelValues] = None):
+        with self._lock:
+            self._values[self._key(_key)] = float(value)
+
+    def inc(self, amount: float = 1.0, _key: Optional[LabelValues] = None):
+        key = self._key(_key)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, _key: Optional[LabelValues] = None):
+        self.inc(-amount, _key)
+
+    def clear(self):
+        """Drops all label sets (for gauges that are rebuilt on every scrape)."""
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield self.name, _label_text(self.labelnames, key), value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["Registry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, _key: Optional[LabelValues] = None):
+        key = self._key(_key)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def time(self) -> _Timer:
+        return _Timer(self.observe)
+
+    def samples(self):
+        with self._lock:
+            snapshot = sorted((key, list(counts), self._sums[key]) for key, counts in self._counts.items())
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _label_text(self.labelnames + ("le",), key + (_format_value(bound),))
+                yield f"{self.name}_bucket", labels, cumulative
+            base = _label_text(self.labelnames, key)
+            yield f"{self.name}_sum", base, total
+            yield f"{self.name}_count", base, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered.")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# --- Pipeline metrics (recorded in whichever process runs the job) ---
+_STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+STAGE_SECONDS = Histogram(
+    "chat_evidence_stage_duration_seconds", "Wall time of each pipeline stage.",
+    ("pipeline", "stage"), buckets=_STAGE_BUCKETS)
+JOB_QUEUE_WAIT_SECONDS = Histogram(
+    "chat_evidence_job_queue_wait_seconds", "Time between dispatching a job and a process starting it.",
+    ("kind",), buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600))
+JOBS_TOTAL = Counter(
+    "chat_evidence_jobs_total", "Finished jobs by kind and outcome.", ("kind", "outcome"))
+FRAMES_TOTAL = Counter(
+    "chat_evidence_frames_total", "Video frames extracted, OCR'd and kept by the filter.", ("state",))
+OCR_CALL_SECONDS = Histogram(
+    "chat_evidence_ocr_call_duration_seconds", "Latency of a single OCR engine call by speed profile.",
+    ("profile",), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+OCR_BOXES_TOTAL = Counter(
+    "chat_evidence_ocr_boxes_total", "Text boxes detected and recognized in boundary-only OCR mode.", ("state",))
+OCR_PROFILE_JOBS_TOTAL = Counter(
+    "chat_evidence_ocr_profile_jobs_total", "Video jobs by the OCR speed profile they ran with.", ("profile",))
+PDF_IMAGES_TOTAL = Counter(
+    "chat_evidence_pdf_images_total", "Images placed into generated PDFs.")
+PDF_OUTPUT_BYTES = Histogram(
+    "chat_evidence_pdf_output_bytes", "Size of generated PDF files.",
+    buckets=tuple(2 ** power for power in range(17, 31, 2)))  # 128 KiB .. 1 GiB
+
+# --- API process metrics ---
+WS_SEND_SECONDS = Histogram(
+    "chat_evidence_websocket_send_duration_seconds", "Time to deliver one batch of status updates to a client.")
+WS_EVENTS_SENT_TOTAL = Counter(
+    "chat_evidence_websocket_events_sent_total", "Status updates delivered to WebSocket clients.")
+WS_EVENTS_DROPPED_TOTAL = Counter(
+    "chat_evidence_websocket_events_dropped_total", "Status updates dropped because a client fell behind.")
+WS_CLIENTS = Gauge("chat_evidence_websocket_clients", "Connected WebSocket clients.")
+SESSIONS = Gauge("chat_evidence_sessions", "Sessions in the session store.")
+ACTIVE_JOBS = Gauge("chat_evidence_active_jobs", "Sessions with a queued or running job.", ("status",))
+JOB_QUEUE_DEPTH = Gauge("chat_evidence_job_queue_depth", "Jobs waiting in the durable queue (queue mode only).")
+OCR_ENGINE_READY = Gauge("chat_evidence_ocr_engine_ready", "1 once the default-profile OCR model is loaded in this process.")
+DIRECTORY_BYTES = Gauge("chat_evidence_directory_bytes", "Disk usage of the session directories.", ("directory",))
+EVENT_LOOP_LAG_SECONDS = Gauge("chat_evidence_event_loop_lag_seconds", "Most recent event-loop scheduling delay.")
+EVENT_LOOP_LAG_HISTOGRAM = Histogram(
+    "chat_evidence_event_loop_lag_distribution_seconds", "Event-loop scheduling delay.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+
+
+async def monitor_event_loop_lag(interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS):
+    """Measures how late the loop wakes up from a fixed sleep; blocking code in handlers shows up here."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        EVENT_LOOP_LAG_SECONDS.set(lag)
+        EVENT_LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0", registry: Optional[Registry] = None) -> ThreadingHTTPServer:
+    """Serves the registry on http://host:port/metrics from a daemon thread (used by worker processes)."""
+    registry = registry or REGISTRY
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass  # Scrapes every few seconds would flood the worker log
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    return server
@@ -1,31 +1,56 @@
 # backend/models.py
-from typing import List, Optional, Tuple, Literal # 添加 Literal
+from typing import Any, Dict, List, Optional, Tuple, Literal # 添加 Literal
 from pydantic import BaseModel, Field # 添加 Field
 
 # 定义允许的 PDF 布局类型
 PdfLayoutType = Literal['grid', 'column']
+# 定义允许的长图切片输出格式 ('auto' 表示沿用源图格式)
+SliceFormatType = Literal['auto', 'png', 'jpeg', 'webp']
+# 定义长图切割方式: 'fixed' 固定步长, 'snap' 对齐到消息间空白行
+SliceModeType = Literal['fixed', 'snap']
+# 定义长图 PDF 导出方式: 'slices' 嵌入切片文件, 'source' 源图只嵌入一次并按单元格裁剪显示
+PdfEmbedModeType = Literal['slices', 'source']
+# OCR 速度档位: 'fast' 轻量模型与较小检测尺寸, 'balanced' 默认, 'accurate' 较大检测尺寸
+OcrProfileType = Literal['fast', 'balanced', 'accurate']
+# 状态消息的日志级别
+LogLevelType = Literal['debug', 'info', 'warn']
 
 class ProcessSettings(BaseModel):
     """Settings specific to processing video files."""
     frame_interval_seconds: float = Field(default=1.0, gt=0, description="帧提取间隔 (秒), 必须大于 0")
-    exclusion_list: List[str] = Field(default=[], description="内容排除白名单列表")
+    adaptive_sampling: bool = Field(default=False, description="是否启用自适应采样: 先按帧提取间隔粗采样, 仅在相邻帧重叠检查失败处补抽帧并二分细化")
+    min_frame_interval_seconds: float = Field(default=0.25, gt=0, description="自适应采样时补抽帧的最小时间间隔 (秒)")
+    exclusion_list: List[str] = Field(default=[], description="内容排除规则列表：整行文本，或以 contains:/prefix:/re: 开头的包含、前缀与正则规则")
     # OCR rect: x, y, width, height - 坐标相对于原始帧
     ocr_analysis_rect: Optional[Tuple[int, int, int, int]] = Field(default=None, description="可选的OCR分析区域 (x, y, width, height)")
+    auto_ocr_region: bool = Field(default=False, description="未指定OCR分析区域时，是否根据帧间变化自动检测滚动的聊天内容区域")
     pdf_rows: int = Field(default=3, ge=1, description="PDF每页行数")
     pdf_cols: int = Field(default=2, ge=1, description="PDF每页列数")
     pdf_title: str = Field(default="聊天记录证据", description="PDF文档标题")
     pdf_layout: PdfLayoutType = Field(default='grid', description="PDF图片排列方式: 'grid' (行优先) 或 'column' (列优先)")
     image_order: Optional[List[str]] = Field(default=None, description="可选的图片文件名排序列表 (用于PDF生成)")
+    use_frame_store: bool = Field(default=False, description="是否将抽取的帧写入单个内存映射文件，而不是每帧一个 PNG 文件")
+    ocr_profile: Optional[OcrProfileType] = Field(default=None, description="OCR 速度档位: 'fast', 'balanced' 或 'accurate'; 未指定时使用 OCR_PROFILE 环境变量")
+    boundary_ocr: bool = Field(default=False, description="是否只识别每帧顶部与底部用于重叠判断的文本行 (检测全部文本框，识别开销与消息数量无关)")
+    build_pdf: bool = Field(default=True, description="是否生成PDF; 为 False 时在OCR与筛选后结束 (批量任务合并输出时使用)")
+    enable_trace: bool = Field(default=False, description="是否记录本次任务的性能追踪 (Chrome trace 格式)")
 
 class LongImageProcessSettings(BaseModel):
     """Settings specific to processing long screenshot files."""
     slice_height: int = Field(default=1000, gt=0, description="每个切片的高度 (像素)")
     overlap: int = Field(default=100, ge=0, description="切片之间的重叠高度 (像素)")
+    slice_mode: SliceModeType = Field(default='fixed', description="切割方式: 'fixed' (固定步长) 或 'snap' (对齐到空白行, 可将重叠设为 0)")
+    slice_format: SliceFormatType = Field(default='auto', description="切片输出格式: 'auto' (沿用源图), 'png', 'jpeg' 或 'webp'")
+    slice_png_compress_level: int = Field(default=6, ge=0, le=9, description="切片 PNG 压缩级别 (0-9), 越小越快")
+    slice_quality: int = Field(default=90, ge=1, le=100, description="切片 JPEG/WEBP 编码质量 (1-100)")
+    pdf_embed_mode: PdfEmbedModeType = Field(default='slices', description="PDF导出方式: 'slices' (嵌入切片文件) 或 'source' (源图只嵌入一次, 不生成切片文件)")
     pdf_rows: int = Field(default=3, ge=1, description="PDF每页行数")
     pdf_cols: int = Field(default=1, ge=1, description="PDF每页列数")
     pdf_title: str = Field(default="长截图证据", description="PDF文档标题")
     pdf_layout: PdfLayoutType = Field(default='column', description="PDF图片排列方式: 'grid' (行优先) 或 'column' (列优先)")
     image_order: Optional[List[str]] = Field(default=None, description="可选的切片文件名排序列表 (用于PDF生成)")
+    build_pdf: bool = Field(default=True, description="是否生成PDF; 为 False 时在裁剪后结束 (批量任务合并输出时使用)")
+    enable_trace: bool = Field(default=False, description="是否记录本次任务的性能追踪 (Chrome trace 格式)")
 
     # 可以添加 Pydantic 验证器来确保 slice_height > overlap
     # from pydantic import validator
@@ -35,6 +60,16 @@ class LongImageProcessSettings(BaseModel):
     #         raise ValueError('Overlap height must be less than slice height')
     #     return v
 
+class BatchSettings(BaseModel):
+    """Settings of a batch job (several videos / long screenshots in one request)."""
+    video: ProcessSettings = Field(default_factory=ProcessSettings, description="应用于批量中每个视频的处理设置")
+    long_image: LongImageProcessSettings = Field(default_factory=LongImageProcessSettings, description="应用于批量中每张长截图的处理设置")
+    combined_pdf: bool = Field(default=False, description="是否将所有文件合并输出为一个PDF (否则每个文件各生成一个PDF)")
+    pdf_rows: int = Field(default=3, ge=1, description="合并PDF每页行数")
+    pdf_cols: int = Field(default=2, ge=1, description="合并PDF每页列数")
+    pdf_title: str = Field(default="证据材料汇编", description="合并PDF文档标题")
+    pdf_layout: PdfLayoutType = Field(default='grid', description="合并PDF图片排列方式: 'grid' (行优先) 或 'column' (列优先)")
+
 class TaskStatus(BaseModel):
     """Represents the status update sent via WebSocket."""
     session_id: str
@@ -45,5 +80,8 @@ class TaskStatus(BaseModel):
     # current_step: Optional[int] = None
     result_url: Optional[str] = Field(default=None, description="最终结果 (如PDF) 的下载链接")
     preview_images: Optional[List[str]] = Field(default=None, description="用于前端预览的图片URL列表")
+    level: LogLevelType = Field(default='info', description="日志级别，客户端可按级别过滤")
+    seq: Optional[int] = Field(default=None, description="事件序号，断线重连时用于从上次位置续传")
+    details: Optional[Dict[str, Any]] = Field(default=None, description="结构化附加信息，如批量任务中每个文件的进度")
     # 可以添加一个字段来区分消息对应的任务类型，如果前端需要的话
     # task_type: Optional[Literal['video', 'long_image']] = None
\ No newline at end of file
@@ -0,0 +1,396 @@
+# backend/ocr_backends.py
+"""
+OCR backends.
+
+``OcrFilter`` and the warm-up code talk to OCR through the small
+``OcrBackend`` interface instead of PaddleOCR's result lists:
+
+* ``detect(image)`` -> text line boxes (4x2 float arrays, image pixels);
+* ``recognize(crops, cls)`` -> ``(text, score)`` per text line image;
+* ``ocr(image, cls)`` -> ``OcrLine(box, text, score)`` for every line,
+  top to bottom (by default detect + crop + recognize).
+
+Images are BGR ``uint8`` arrays (or paths to image files for ``ocr``).
+Three implementations are selected with OCR_BACKEND:
+
+``paddle`` (default)
+    PaddleOCR, configured from the OCR speed profile.
+``onnx``
+    PP-OCR detection / recognition (and optionally direction
+    classification) models exported to ONNX, run with ONNX Runtime on the
+    CPU.  Needs only ``onnxruntime`` next to numpy and Pillow; int8
+    quantized exports work unchanged (see OCR_ONNX_QUANTIZED).
+``stub``
+    Deterministic, model-free: every horizontal band that differs from the
+    background is one "line" named after its geometry.  Used by the
+    benchmarks and for tests; it exercises everything except inference.
+"""
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image as PILImage
+
+OCR_BACKENDS = ("paddle", "onnx", "stub")
+OCR_BACKEND = os.getenv("OCR_BACKEND", "paddle").lower()
+if OCR_BACKEND not in OCR_BACKENDS:
+    print(f"⚠️ 未知的 OCR_BACKEND '{OCR_BACKEND}'，改用 'paddle'。")
+    OCR_BACKEND = "paddle"
+OCR_ONNX_MODEL_DIR = os.getenv("OCR_ONNX_MODEL_DIR", "models/onnx")
+OCR_ONNX_QUANTIZED = os.getenv("OCR_ONNX_QUANTIZED", "0").lower() in ("1", "true", "yes")
+
+ImageInput = Union[str, Path, np.ndarray]
+
+
+class OcrLine(NamedTuple):
+    box: Optional[np.ndarray]  # 4x2 corner points in image pixels (None if the backend has no boxes)
+    text: str
+    score: float
+
+
+def load_bgr(image: ImageInput) -> np.ndarray:
+    """BGR uint8 array of an image path or array (arrays are returned as they are)."""
+    if isinstance(image, np.ndarray):
+        return image
+    with PILImage.open(image) as img:
+        return np.ascontiguousarray(np.asarray(img.convert("RGB"))[:, :, ::-1])
+
+
+def crop_box(array: np.ndarray, box: np.ndarray) -> np.ndarray:
+    """Crops the bounding rectangle of a box (text lines in screen recordings are horizontal)."""
+    height, width = array.shape[:2]
+    x0, y0 = np.floor(box.min(axis=0)).astype(int)
+    x1, y1 = np.ceil(box.max(axis=0)).astype(int)
+    x0, y0 = max(0, x0), max(0, y0)
+    x1, y1 = min(width, max(x1, x0 + 1)), min(height, max(y1, y0 + 1))
+    return np.ascontiguousarray(array[y0:y1, x0:x1])
+
+
+def sort_boxes(boxes: List[np.ndarray]) -> List[np.ndarray]:
+    """Top-to-bottom, then left-to-right reading order."""
+    return sorted(boxes, key=lambda box: (box[:, 1].min(), box[:, 0].min()))
+
+
+def rect_box(x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float32)
+
+
+class OcrBackend:
+    """Interface shared by all OCR backends."""
+
+    name = "base"
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        """Text line boxes (4x2 float32 arrays) of a BGR image, in reading order."""
+        raise NotImplementedError
+
+    def recognize(self, crops: List[np.ndarray], cls: bool) -> List[Tuple[str, float]]:
+        """(text, score) of every text line image; cls runs the direction classifier first."""
+        raise NotImplementedError
+
+    def ocr(self, image: ImageInput, cls: bool = False) -> List[OcrLine]:
+        """Detects and recognizes all lines of an image, top to bottom."""
+        array = load_bgr(image)
+        boxes = self.detect(array)
+        texts = self.recognize([crop_box(array, box) for box in boxes], cls)
+        return [OcrLine(box, text, score) for box, (text, score) in zip(boxes, texts)]
+
+
+# --- PaddleOCR ---
+
+class PaddleOcrBackend(OcrBackend):
+    """PaddleOCR (2.x) behind the backend interface."""
+
+    name = "paddle"
+
+    def __init__(self, options: Dict[str, Any], use_gpu: bool = False, cpu_threads: int = 4, engine=None):
+        if engine is None:
+            from paddleocr import PaddleOCR
+            engine = PaddleOCR(**self.engine_kwargs(options, use_gpu, cpu_threads))
+        self.engine = engine
+
+    @staticmethod
+    def engine_kwargs(options: Dict[str, Any], use_gpu: bool, cpu_threads: int) -> Dict[str, Any]:
+        """Converts an OCR speed profile to PaddleOCR constructor arguments."""
+        options = dict(options)
+        enable_mkldnn = options.pop("enable_mkldnn", False)
+        kwargs = {"show_log": False, "use_gpu": use_gpu, "det_limit_type": "max", **options}
+        if not use_gpu:
+            kwargs.update(enable_mkldnn=enable_mkldnn, cpu_threads=cpu_threads)
+        return kwargs
+
+    def ocr(self, image: ImageInput, cls: bool = False) -> List[OcrLine]:
+        results = self.engine.ocr(str(image) if isinstance(image, Path) else image, cls=cls)
+        lines = results[0] if results and results[0] else []
+        return [OcrLine(np.asarray(item[0], dtype=np.float32).reshape(-1, 2) if item[0] is not None else None,
+                        item[1][0], float(item[1][1]) if len(item[1]) > 1 else 0.0)
+                for item in lines if item and len(item) > 1 and len(item[1]) > 0]
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        results = self.engine.ocr(image, det=True, rec=False, cls=False)
+        boxes = results[0] if results and results[0] else []
+        return sort_boxes([np.asarray(box, dtype=np.float32).reshape(-1, 2) for box in boxes])
+
+    def recognize(self, crops: List[np.ndarray], cls: bool) -> List[Tuple[str, float]]:
+        """Calls PaddleOCR's classifier and recognizer on the whole batch directly."""
+        if not crops:
+            return []
+        recognizer = getattr(self.engine, "text_recognizer", None)
+        if recognizer is not None:
+            classifier = getattr(self.engine, "text_classifier", None)
+            if cls and classifier is not None:
+                crops, _, _ = classifier(crops)
+            rec_results, _ = recognizer(crops)
+            return [(text, float(score)) for text, score in rec_results]
+        recognized = []
+        for crop in crops:
+            results = self.engine.ocr(crop, det=False, rec=True, cls=cls)
+            lines = results[0] if results and results[0] else []
+            recognized.append((lines[0][0], float(lines[0][1])) if lines else ("", 0.0))
+        return recognized
+
+
+# --- ONNX Runtime ---
+
+class OnnxOcrBackend(OcrBackend):
+    """
+    PP-OCR models exported to ONNX (e.g. with paddle2onnx), run on the CPU.
+
+    The model directory holds det.onnx, rec.onnx, the recognizer's character
+    dictionary ppocr_keys_v1.txt and optionally cls.onnx (direction
+    classifier); with OCR_ONNX_QUANTIZED=1 the *_int8.onnx files are loaded
+    instead.  Pre- and post-processing follow PaddleOCR's defaults: DB
+    detection (probability map -> boxes) and greedy CTC decoding.  Boxes
+    are axis-aligned rectangles, which is what screen recordings contain.
+    """
+
+    name = "onnx"
+    DET_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+    DET_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+    DET_THRESHOLD = 0.3  # Probability map binarization
+    DET_BOX_THRESHOLD = 0.6  # Minimum mean probability of a box
+    DET_UNCLIP_RATIO = 1.5  # DB shrinks text regions in training; boxes are grown back by this ratio
+    REC_HEIGHT = 48
+    REC_MAX_WIDTH = 3200
+    CLS_SHAPE = (48, 192)
+    CLS_THRESHOLD = 0.9
+
+    def __init__(self, options: Dict[str, Any], model_dir: str = OCR_ONNX_MODEL_DIR,
+                 quantized: bool = OCR_ONNX_QUANTIZED, cpu_threads: int = 4):
+        import onnxruntime
+        model_path = Path(model_dir)
+        suffix = "_int8" if quantized else ""
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = cpu_threads
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        def load(name: str, required: bool = True):
+            path = model_path / f"{name}{suffix}.onnx"
+            if not path.is_file():
+                if required:
+                    raise FileNotFoundError(f"未找到 ONNX 模型文件: {path}")
+                return None
+            return onnxruntime.InferenceSession(str(path), session_options, providers=["CPUExecutionProvider"])
+
+        self.det_session = load("det")
+        self.rec_session = load("rec")
+        self.cls_session = load("cls", required=False) if options.get("use_angle_cls") else None
+        dict_path = model_path / "ppocr_keys_v1.txt"
+        if not dict_path.is_file():
+            raise FileNotFoundError(f"未找到识别字典: {dict_path}")
+        # Index 0 is the CTC blank; PP-OCR models append a space character after the dictionary
+        self.characters = ["", *dict_path.read_text(encoding="utf-8").splitlines(), " "]
+        self.det_limit_side_len = int(options.get("det_limit_side_len", 960))
+        self.rec_batch_num = int(options.get("rec_batch_num", 6))
+
+    # Detection
+
+    def _det_input(self, image: np.ndarray) -> Tuple[np.ndarray, float, float]:
+        height, width = image.shape[:2]
+        ratio = min(1.0, self.det_limit_side_len / max(height, width))
+        resized_h = max(32, int(round(height * ratio / 32)) * 32)
+        resized_w = max(32, int(round(width * ratio / 32)) * 32)
+        resized = np.asarray(PILImage.fromarray(image).resize((resized_w, resized_h), PILImage.BILINEAR))
+        blob = (resized.astype(np.float32) / 255.0 - self.DET_MEAN) / self.DET_STD
+        return blob.transpose(2, 0, 1)[np.newaxis], height / resized_h, width / resized_w
+
+    @classmethod
+    def boxes_from_probability_map(cls, probability: np.ndarray) -> List[Tuple[int, int, int, int, float]]:
+        """
+        Text regions of a DB probability map as (x0, y0, x1, y1, score) in map pixels.
+
+        Rows with text pixels form bands; a band is split into regions at
+        horizontal gaps at least as wide as the band is high, so messages
+        side by side stay apart while the words of one line stay together.
+        """
+        mask = probability > cls.DET_THRESHOLD
+        regions = []
+        for y0, y1 in _runs(mask.any(axis=1)):
+            band = mask[y0:y1]
+            min_gap = max(1, y1 - y0)
+            for x0, x1 in _runs(band.any(axis=0), min_gap=min_gap):
+                rows = np.flatnonzero(band[:, x0:x1].any(axis=1))
+                ry0, ry1 = y0 + rows[0], y0 + rows[-1] + 1
+                region = mask[ry0:ry1, x0:x1]
+                score = float(probability[ry0:ry1, x0:x1][region].mean())
+                if min(ry1 - ry0, x1 - x0) < 3 or score < cls.DET_BOX_THRESHOLD:
+                    continue
+                regions.append((x0, ry0, x1, ry1, score))
+        return regions
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        blob, scale_y, scale_x = self._det_input(image)
+        probability = self.det_session.run(None, {self.det_session.get_inputs()[0].name: blob})[0][0, 0]
+        height, width = image.shape[:2]
+        boxes = []
+        for x0, y0, x1, y1, _ in self.boxes_from_probability_map(probability):
+            # Unclip: offset = area * ratio / perimeter, as in PaddleOCR's DBPostProcess
+            w, h = x1 - x0, y1 - y0
+            offset = w * h * self.DET_UNCLIP_RATIO / (2 * (w + h))
+            boxes.append(rect_box(max(0.0, (x0 - offset) * scale_x), max(0.0, (y0 - offset) * scale_y),
+                                  min(float(width), (x1 + offset) * scale_x),
+                                  min(float(height), (y1 + offset) * scale_y)))
+        return sort_boxes(boxes)
+
+    # Recognition
+
+    def _resize_normalized(self, crop: np.ndarray, height: int, width: int) -> np.ndarray:
+        """Resizes to the given height keeping the aspect ratio, normalizes to [-1, 1] and right-pads to width."""
+        crop_h, crop_w = crop.shape[:2]
+        resized_w = max(1, min(width, int(math.ceil(height * crop_w / max(1, crop_h)))))
+        resized = np.asarray(PILImage.fromarray(crop).resize((resized_w, height), PILImage.BILINEAR))
+        blob = np.zeros((3, height, width), dtype=np.float32)
+        blob[:, :, :resized_w] = (resized.astype(np.float32).transpose(2, 0, 1) / 255.0 - 0.5) / 0.5
+        return blob
+
+    def _classify(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        """Turns text lines the direction classifier sees as upside down."""
+        height, width = self.CLS_SHAPE
+        crops = list(crops)
+        for start in range(0, len(crops), self.rec_batch_num):
+            batch = np.stack([self._resize_normalized(crop, height, width)
+                              for crop in crops[start:start + self.rec_batch_num]])
+            probabilities = self.cls_session.run(None, {self.cls_session.get_inputs()[0].name: batch})[0]
+            for offset, row in enumerate(probabilities):
+                if int(row.argmax()) == 1 and row[1] > self.CLS_THRESHOLD:  # Labels: 0°, 180°
+                    crops[start + offset] = np.ascontiguousarray(np.rot90(crops[start + offset], 2))
+        return crops
+
+    def ctc_decode(self, probabilities: np.ndarray) -> Tuple[str, float]:
+        """Greedy CTC decoding of one (time steps, classes) matrix: merge repeats, drop blanks."""
+        indices = probabilities.argmax(axis=1)
+        scores = probabilities.max(axis=1)
+        keep = indices != 0
+        keep[1:] &= indices[1:] != indices[:-1]
+        characters = [self.characters[i] if i < len(self.characters) else "" for i in indices[keep]]
+        return "".join(characters), float(scores[keep].mean()) if keep.any() else 0.0
+
+    def recognize(self, crops: List[np.ndarray], cls: bool) -> List[Tuple[str, float]]:
+        if not crops:
+            return []
+        if cls and self.cls_session is not None:
+            crops = self._classify(crops)
+        # Similar widths batch together with little padding
+        order = sorted(range(len(crops)), key=lambda i: crops[i].shape[1] / max(1, crops[i].shape[0]))
+        results: List[Tuple[str, float]] = [("", 0.0)] * len(crops)
+        input_name = self.rec_session.get_inputs()[0].name
+        for start in range(0, len(order), self.rec_batch_num):
+            batch_indices = order[start:start + self.rec_batch_num]
+            max_ratio = max(crops[i].shape[1] / max(1, crops[i].shape[0]) for i in batch_indices)
+            width = min(self.REC_MAX_WIDTH, int(math.ceil(self.REC_HEIGHT * max(max_ratio, 320 / 48))))
+            batch = np.stack([self._resize_normalized(crops[i], self.REC_HEIGHT, width) for i in batch_indices])
+            probabilities = self.rec_session.run(None, {input_name: batch})[0]
+            for index, matrix in zip(batch_indices, probabilities):
+                results[index] = self.ctc_decode(matrix)
+        return results
+
+
+def _runs(flags: np.ndarray, min_gap: int = 1) -> List[Tuple[int, int]]:
+    """[start, end) runs of True, joining runs separated by fewer than min_gap False values."""
+    padded = np.concatenate(([False], flags, [False]))
+    changes = np.flatnonzero(padded[1:] != padded[:-1])
+    runs: List[Tuple[int, int]] = []
+    for start, end in zip(changes[::2], changes[1::2]):
+        if runs and start - runs[-1][1] < min_gap:
+            runs[-1] = (runs[-1][0], int(end))
+        else:
+            runs.append((int(start), int(end)))
+    return runs
+
+
+# --- Stub ---
+
+class StubOcrBackend(OcrBackend):
+    """
+    Deterministic stand-in without a model.
+
+    Rows that differ from the background (estimated from the left edge) are
+    grouped into bands, one per chat bubble; every band fully inside the
+    image becomes one line.  Its text is derived from the band's content:
+    each row of "ink" (pixels far from the band's dominant colour) becomes
+    two CJK characters, one for its quantised ink amount and one for its
+    width.  The same bubble reads (almost) the same after video compression
+    and scrolling, while different bubbles share next to no characters, so
+    frames without overlap fail the filter's similarity check as with real
+    OCR.  Full OCR is the inherited detect + recognize, so it names lines
+    exactly like boundary-mode OCR of the same crops.  An optional latency
+    emulates inference.
+    """
+
+    name = "stub"
+    INK_CHARS = 0x4E00  # Code point ranges of the two character kinds, STUB_ALPHABET apart
+    WIDTH_CHARS = 0x4E00 + 2048
+    STUB_ALPHABET = 2048
+
+    def __init__(self, options: Optional[Dict[str, Any]] = None, latency_seconds: float = 0.0, tolerance: int = 12,
+                 ink_contrast: int = 80):
+        self.latency_seconds = latency_seconds
+        self.tolerance = tolerance
+        self.ink_contrast = ink_contrast
+
+    def _wait(self):
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _bands(self, array: np.ndarray) -> List[Tuple[int, int, int, int]]:
+        gray = array.mean(axis=2) if array.ndim == 3 else array.astype(float)
+        background = np.median(gray[:, :max(1, gray.shape[1] // 40)])
+        content = np.abs(gray - background) > self.tolerance
+        bands = []
+        for start, end in _runs(content.any(axis=1)):
+            if start > 0 and end < content.shape[0] and end - start > 4:  # Skip bands cut by the viewport edge
+                columns = np.flatnonzero(content[start:end].any(axis=0))
+                bands.append((int(columns[0]), start, int(columns[-1]) + 1, end))
+        return bands
+
+    def detect(self, image: np.ndarray) -> List[np.ndarray]:
+        self._wait()
+        return [rect_box(*band) for band in self._bands(image)]
+
+    def _line_text(self, crop: np.ndarray) -> str:
+        gray = crop.mean(axis=2) if crop.ndim == 3 else crop.astype(float)
+        ink = np.abs(gray - np.median(gray)) > self.ink_contrast
+        chars = []
+        for start, end in _runs(ink.any(axis=1)):
+            rows = ink[start:end]
+            columns = np.flatnonzero(rows.any(axis=0))
+            chars.append(chr(self.INK_CHARS + int(rows.sum()) // 8 % self.STUB_ALPHABET))
+            chars.append(chr(self.WIDTH_CHARS + int(columns[-1] - columns[0]) // 2 % self.STUB_ALPHABET))
+        return "".join(chars) or f"band h{crop.shape[0] // 4} w{crop.shape[1] // 8}"  # No ink: e.g. a picture
+
+    def recognize(self, crops: List[np.ndarray], cls: bool) -> List[Tuple[str, float]]:
+        return [(self._line_text(crop), 0.99) for crop in crops]
+
+
+def create_ocr_backend(kind: str, options: Dict[str, Any], use_gpu: bool = False, cpu_threads: int = 4) -> OcrBackend:
+    """Builds the backend named kind for an OCR speed profile's options. Raises ImportError if it is not installed."""
+    if kind == "paddle":
+        return PaddleOcrBackend(options, use_gpu=use_gpu, cpu_threads=cpu_threads)
+    if kind == "onnx":
+        return OnnxOcrBackend(options, cpu_threads=cpu_threads)
+    if kind == "stub":
+        return StubOcrBackend(options)
+    raise ValueError(f"未知的 OCR 引擎: {kind}，可选: {', '.join(OCR_BACKENDS)}")
@@ -0,0 +1,201 @@
+# backend/session_store.py
+"""
+Session state storage.
+
+Every API worker process (and the background job workers) reads and writes
+session state through a ``SessionStore``.  The default SQLite-backed store
+keeps sessions on local disk so that:
+
+* ``uvicorn --workers N`` can serve an upload from one process and the
+  matching ``/process_video`` call from another;
+* in-flight sessions survive a server restart.
+
+Updates are applied atomically (``BEGIN IMMEDIATE`` + JSON merge), so
+concurrent writers never lose each other's fields.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import copy
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "sqlite")  # 'sqlite' or 'memory'
+SESSION_STORE_DB_PATH = os.getenv("SESSION_STORE_DB_PATH")  # Defaults to <temp_sessions>/_sessions.sqlite3
+
+SessionData = Dict[str, Any]
+
+
+class SessionStore:
+    """Interface shared by all session store backends."""
+
+    def get(self, session_id: str) -> Optional[SessionData]:
+        """Returns a copy of the session data, or None if the session does not exist."""
+        raise NotImplementedError
+
+    def exists(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def create(self, session_id: str, data: SessionData) -> None:
+        """Creates (or replaces) a session."""
+        raise NotImplementedError
+
+    def update(self, session_id: str, **fields: Any) -> Optional[SessionData]:
+        """Atomically merges fields into an existing session. Returns the new data, or None if missing."""
+        return self.mutate(session_id, lambda data: data.update(fields))
+
+    def mutate(self, session_id: str, fn: Callable[[SessionData], None]) -> Optional[SessionData]:
+        """Atomically applies fn to the session data in place. Returns the new data, or None if missing."""
+        raise NotImplementedError
+
+    def delete(self, session_id: str) -> bool:
+        """Removes a session. Returns True if it existed."""
+        raise NotImplementedError
+
+    def items(self) -> List[Tuple[str, SessionData]]:
+        """Returns (session_id, data) pairs for all sessions."""
+        raise NotImplementedError
+
+    def list_ids(self) -> List[str]:
+        return [session_id for session_id, _ in self.items()]
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store. Only suitable for a single API process without restarts."""
+
+    def __init__(self):
+        self._data: Dict[str, SessionData] = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[SessionData]:
+        with self._lock:
+            data = self._data.get(session_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def create(self, session_id: str, data: SessionData) -> None:
+        now = time.time()
+        with self._lock:
+            self._data[session_id] = {**copy.deepcopy(data), "created_at": now, "updated_at": now}
+
+    def mutate(self, session_id: str, fn: Callable[[SessionData], None]) -> Optional[SessionData]:
+        with self._lock:
+            data = self._data.get(session_id)
+            if data is None:
+                return None
+            fn(data)
+            data["updated_at"] = time.time()
+            return copy.deepcopy(data)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._data.pop(session_id, None) is not None
+
+    def items(self) -> List[Tuple[str, SessionData]]:
+        with self._lock:
+            return [(sid, copy.deepcopy(data)) for sid, data in self._data.items()]
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    SQLite-backed store shared by every process on the host.
+
+    Each thread gets its own connection; WAL mode lets readers proceed while
+    a writer holds the lock, and ``busy_timeout`` makes writers wait instead
+    of failing when another process is mid-update.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = str(db_path)
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " session_id TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _decode(data: str, created_at: float, updated_at: float) -> SessionData:
+        decoded = json.loads(data)
+        decoded["created_at"] = created_at
+        decoded["updated_at"] = updated_at
+        return decoded
+
+    def get(self, session_id: str) -> Optional[SessionData]:
+        row = self._connect().execute(
+            "SELECT data, created_at, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return self._decode(*row) if row else None
+
+    def exists(self, session_id: str) -> bool:
+        row = self._connect().execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row is not None
+
+    def create(self, session_id: str, data: SessionData) -> None:
+        now = time.time()
+        payload = {k: v for k, v in data.items() if k not in ("created_at", "updated_at")}
+        self._connect().execute(
+            "INSERT OR REPLACE INTO sessions (session_id, data, created_at, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, json.dumps(payload, ensure_ascii=False), now, now),
+        )
+
+    def mutate(self, session_id: str, fn: Callable[[SessionData], None]) -> Optional[SessionData]:
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")  # Takes the write lock before reading
+        try:
+            row = conn.execute(
+                "SELECT data, created_at FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            data = json.loads(row[0])
+            fn(data)
+            data.pop("created_at", None)
+            data.pop("updated_at", None)
+            now = time.time()
+            conn.execute(
+                "UPDATE sessions SET data = ?, updated_at = ? WHERE session_id = ?",
+                (json.dumps(data, ensure_ascii=False), now, session_id),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        data["created_at"] = row[1]
+        data["updated_at"] = now
+        return data
+
+    def delete(self, session_id: str) -> bool:
+        cursor = self._connect().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        return cursor.rowcount > 0
+
+    def items(self) -> List[Tuple[str, SessionData]]:
+        rows = self._connect().execute(
+            "SELECT session_id, data, created_at, updated_at FROM sessions"
+        ).fetchall()
+        return [(row[0], self._decode(row[1], row[2], row[3])) for row in rows]
+
+
+def create_session_store(default_dir: Path) -> SessionStore:
+    """Builds the store selected by SESSION_STORE_BACKEND (SQLite by default)."""
+    if SESSION_STORE_BACKEND == "memory":
+        print("Using in-memory session store (single process only).")
+        return InMemorySessionStore()
+    db_path = SESSION_STORE_DB_PATH or str(Path(default_dir) / "_sessions.sqlite3")
+    print(f"Using SQLite session store: {db_path}")
+    return SqliteSessionStore(db_path)
@@ -0,0 +1,167 @@
+# backend/tracing.py
+"""
+Opt-in per-job span tracing in the Chrome trace-event format.
+
+A ``Tracer`` collects complete ("X") events with wall-clock microsecond
+timestamps plus the process and native thread id they ran on, so spans
+recorded by executor threads, encoder pools and separate processes line up
+on one timeline.  ``save()`` writes the JSON object format
+(``{"traceEvents": [...]}``) that chrome://tracing and https://ui.perfetto.dev
+open directly.
+
+Code that accepts a tracer defaults to ``NULL_TRACER``, whose methods do
+nothing, so untraced jobs pay only an attribute lookup per span.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "200000"))  # Bounds memory for very long jobs
+TRACE_FILENAME_PREFIX = "trace_"
+
+
+def _now_us() -> float:
+    return time.time() * 1_000_000
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer._add_complete(self.name, self.cat, self.start, _now_us() - self.start, self.args)
+
+    def set(self, **args: Any):
+        """Attaches extra arguments (e.g. results) before the span ends."""
+        self.args.update(args)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args: Any):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullTracer:
+    """Tracer that records nothing."""
+    enabled = False
+
+    def span(self, name: str, cat: str = "pipeline", **args: Any):
+        return _NULL_SPAN
+
+    def complete(self, name: str, cat: str, start: float, duration: float, **args: Any):
+        pass
+
+    def instant(self, name: str, cat: str = "pipeline", **args: Any):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class Tracer(NullTracer):
+    """Thread-safe collector of trace events for one job."""
+    enabled = True
+
+    def __init__(self, session_id: str, max_events: int = TRACE_MAX_EVENTS):
+        self.session_id = session_id
+        self.max_events = max_events
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[tuple, str] = {}  # (pid, tid) -> thread name
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _add(self, event: Dict[str, Any], pid: Optional[int] = None, tid: Optional[int] = None,
+             thread_name: Optional[str] = None):
+        event["pid"] = pid if pid is not None else os.getpid()
+        event["tid"] = tid if tid is not None else threading.get_native_id()
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            self._events.append(event)
+            key = (event["pid"], event["tid"])
+            if key not in self._threads:
+                self._threads[key] = thread_name or threading.current_thread().name
+
+    def _add_complete(self, name: str, cat: str, start_us: float, duration_us: float, args: Dict[str, Any],
+                      **ids: Any):
+        self._add({"name": name, "cat": cat, "ph": "X", "ts": round(start_us, 1),
+                   "dur": round(max(0.0, duration_us), 1), "args": args}, **ids)
+
+    def span(self, name: str, cat: str = "pipeline", **args: Any) -> _Span:
+        """Context manager recording one complete event around its body."""
+        return _Span(self, name, cat, args)
+
+    def complete(self, name: str, cat: str, start: float, duration: float, pid: Optional[int] = None,
+                 tid: Optional[int] = None, thread_name: Optional[str] = None, **args: Any):
+        """Records a span measured elsewhere (start is a time.time() value, duration in seconds)."""
+        self._add_complete(name, cat, start * 1_000_000, duration * 1_000_000, args,
+                           pid=pid, tid=tid, thread_name=thread_name)
+
+    def instant(self, name: str, cat: str = "pipeline", **args: Any):
+        self._add({"name": name, "cat": cat, "ph": "i", "s": "t", "ts": round(_now_us(), 1), "args": args})
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._events)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = []
+        for pid in sorted({pid for pid, _ in threads}):
+            metadata.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0,
+                             "args": {"name": f"pid {pid}"}})
+        for (pid, tid), thread_name in sorted(threads.items()):
+            metadata.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                             "args": {"name": thread_name}})
+        return {
+            "traceEvents": metadata + sorted(events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "otherData": {"session_id": self.session_id, "dropped_events": self.dropped},
+        }
+
+    def save(self, path: Path) -> Path:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.to_dict(), ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+        return path
+
+
+def timed_record(start: float, duration: float, **extra: Any) -> Dict[str, Any]:
+    """
+    A span measured before tracing was decided (e.g. an upload), kept in the
+    session data so a later traced job can include it via Tracer.complete().
+    """
+    thread = threading.current_thread()
+    return {"start": start, "duration": duration, "pid": os.getpid(), "tid": threading.get_native_id(),
+            "thread_name": thread.name, **extra}
@@ -0,0 +1,98 @@
+# backend/worker.py
+"""
+Job worker process.
+
+Run one or more of these next to the API when ``JOB_EXECUTION_MODE=queue``:
+
+    python -m backend.worker [--worker-id NAME] [--poll-interval 1.0] [--metrics-port 9101]
+
+Each worker loads and warms up the OCR engine once, claims jobs from the shared SQLite
+queue, runs the same pipelines the API would run inline, and publishes its
+status updates to the queue's event log, which the API relays to the
+browser over WebSocket.  With ``--metrics-port`` (or WORKER_METRICS_PORT)
+the worker serves its own pipeline metrics on ``http://host:port/metrics``.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import traceback
+
+import backend.main as api
+from backend import metrics
+from backend.job_queue import JOB_CANCELLED, JOB_DONE, JOB_FAILED, JOB_STALE_SECONDS, create_job_queue
+
+HEARTBEAT_INTERVAL_SECONDS = max(1.0, JOB_STALE_SECONDS / 4)
+
+
+async def _heartbeat(queue, job_id: str):
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL_SECONDS)
+        try:
+            await loop.run_in_executor(None, queue.heartbeat, job_id)
+        except Exception as e:
+            print(f"Worker heartbeat failed for job {job_id}: {e}")
+
+
+async def run_worker(worker_id: str, poll_interval: float, metrics_port: int = 0):
+    queue = create_job_queue(api.TEMP_SESSIONS_BASE_DIR)
+    # Batched status updates from the pipelines go to the event log instead of a local socket
+    api.manager.forwarder = queue.publish_event
+    asyncio.create_task(api.manager.run_flusher())
+    asyncio.create_task(metrics.monitor_event_loop_lag())
+    if metrics_port:
+        metrics.start_metrics_server(metrics_port)
+        print(f"Worker {worker_id} serving metrics on port {metrics_port}")
+    loop = asyncio.get_running_loop()
+    if api.OCR_WARMUP_ON_STARTUP:
+        await loop.run_in_executor(None, api.warm_up_ocr_engine) # Before claiming, so the first job is not slowed down
+    print(f"Worker {worker_id} started, queue: {queue.db_path}")
+
+    while True:
+        await loop.run_in_executor(None, queue.requeue_stale)
+        job = await loop.run_in_executor(None, queue.claim, worker_id)
+        if job is None:
+            await asyncio.sleep(poll_interval)
+            continue
+
+        job_id, session_id = job["job_id"], job["session_id"]
+        print(f"Worker {worker_id} claimed {job['kind']} job {job_id} for session {session_id} "
+              f"(attempt {job['attempts']}, waited {job['queue_wait_seconds']:.1f}s)")
+        heartbeat_task = asyncio.create_task(_heartbeat(queue, job_id))
+        try:
+            await api.run_job(job["kind"], session_id, job["payload"])
+            # The pipelines report their own failures on the session instead of raising
+            session_data = api.session_store.get(session_id) or {}
+            job_status, error = session_data.get("job_status"), None
+            if job_status == "cancelled":
+                final_status = JOB_CANCELLED
+            elif job_status == "error":
+                final_status, error = JOB_FAILED, session_data.get("job_error") or "pipeline failed"
+            else:
+                final_status = JOB_DONE
+            await loop.run_in_executor(None, queue.finish, job_id, final_status, error)
+        except Exception as e:
+            traceback.print_exc()
+            api.session_store.update(session_id, job_status="error")
+            await loop.run_in_executor(None, queue.finish, job_id, JOB_FAILED, str(e))
+        finally:
+            heartbeat_task.cancel()
+            await api.manager.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat evidence tool job worker")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("WORKER_METRICS_PORT", "0")),
+                        help="Serve Prometheus metrics on this port (0 disables)")
+    args = parser.parse_args()
+    try:
+        asyncio.run(run_worker(args.worker_id, args.poll_interval, args.metrics_port))
+    except KeyboardInterrupt:
+        print(f"Worker {args.worker_id} stopped.")
+
+
+if __name__ == "__main__":
+    main()
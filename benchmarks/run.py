@@ -0,0 +1,370 @@
+# benchmarks/run.py
+"""
+End-to-end pipeline benchmarks.
+
+    python -m benchmarks.run [--scenario smoke] [--ocr stub|paddle|onnx] [--frame-store]
+                             [--baseline benchmarks/baseline.json] [--update-baseline]
+
+Each scenario generates (or reuses) a synthetic input with
+``benchmarks.synthetic`` and times the pipeline stages separately:
+
+* video: ``extract_frames_ffmpeg_sync`` -> ``OcrFilter.run_filter`` -> ``PdfGenerator.generate_pdf``
+* long image: ``slice_image_sync`` -> ``PdfGenerator.generate_pdf``
+
+For every stage we record wall time, items/s, OCR calls, peak RSS and the
+PDF size.  Results are compared against a stored baseline; a metric that is
+worse by more than ``--tolerance`` is reported as a regression and the run
+exits with status 1.
+
+``--ocr stub`` (the default) uses the deterministic stub OCR backend, which
+derives one "line" per text bubble from the bubble's pixels, so screens
+without overlap fail the filter's similarity check as they would with real
+OCR.  It measures everything except model inference, so runs are fast and
+comparable across machines with and without a GPU.  Every stub run also
+checks that sampling the video STUB_CHECK_INTERVAL_FACTOR times coarser
+makes the filter drop frames or refine between them (adaptive sampling);
+if neither happens the stub no longer exercises the filter and the run
+fails.  Use ``--ocr paddle`` or ``--ocr onnx`` for real
+numbers; running both with ``--output`` compares the engines side by side.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from backend import core_workers, ocr_backends
+from backend.core_workers import OcrFilter, PdfGenerator, extract_frames_ffmpeg_sync, slice_image_sync
+from backend.frame_store import FRAME_STORE_FILENAME, FrameStore
+from backend.ocr_backends import OcrBackend, StubOcrBackend
+from benchmarks.synthetic import generate_chat_video, generate_long_image
+
+DEFAULT_BASELINE_PATH = Path(__file__).with_name("baseline.json")
+DEFAULT_WORK_DIR = Path(tempfile.gettempdir()) / "chat_evidence_benchmarks"
+
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "smoke": {
+        "video": {"duration_seconds": 10, "width": 360, "height": 640, "fps": 30, "frame_interval": 0.5},
+        "long_image": {"width": 720, "height": 8000, "slice_height": 1600, "overlap": 100},
+    },
+    "default": {
+        "video": {"duration_seconds": 60, "width": 720, "height": 1280, "fps": 30, "frame_interval": 0.5},
+        "long_image": {"width": 1080, "height": 30000, "slice_height": 2000, "overlap": 100},
+    },
+    "long": {
+        "video": {"duration_seconds": 300, "width": 1080, "height": 1920, "fps": 30, "frame_interval": 0.5},
+        "long_image": {"width": 1080, "height": 120000, "slice_height": 2000, "overlap": 100},
+    },
+}
+PDF_LAYOUT = {"images_per_row": 3, "images_per_col": 2}
+
+# Metric -> True if higher is better. Metrics not listed are informational.
+METRIC_DIRECTIONS = {
+    "seconds": False,
+    "items_per_second": True,
+    "ocr_calls": False,
+    "peak_rss_mb": False,
+    "pdf_bytes": False,
+}
+EXACT_METRICS = {"ocr_calls"}  # Deterministic; any increase is a regression
+# The stub check samples this many frame intervals apart: more than a screen scrolls by in the scenarios
+STUB_CHECK_INTERVAL_FACTOR = 8
+
+
+# --- Measurement helpers ---
+
+def _current_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _max_rss_bytes() -> int:
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # macOS reports bytes, Linux KiB
+
+
+class RssSampler:
+    """Samples this process's resident set size in a background thread to find a stage's peak."""
+
+    def __init__(self, interval: float = 0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _current_rss_bytes() or 0)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = _current_rss_bytes() or 0
+        if self.peak:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self.peak = max(self.peak, _current_rss_bytes() or 0)
+        else:
+            self.peak = _max_rss_bytes()  # No /proc: fall back to the process-lifetime peak
+
+
+def run_stage(name: str, func: Callable[[], Any], items: Callable[[Any], int],
+              ocr_engine=None) -> Tuple[Any, Dict[str, Any]]:
+    """Runs one stage and returns (result, metrics)."""
+    calls_before = ocr_engine.calls if ocr_engine is not None else 0
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+    count = items(result)
+    metrics = {
+        "seconds": round(seconds, 3),
+        "items": count,
+        "items_per_second": round(count / seconds, 2) if seconds > 0 else None,
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+    }
+    if ocr_engine is not None:
+        metrics["ocr_calls"] = ocr_engine.calls - calls_before
+    print(f"  {name:<10} {metrics['seconds']:>8.2f}s  {count:>6} items  "
+          f"{metrics['items_per_second'] or 0:>8.1f}/s  peak {metrics['peak_rss_mb']:.0f} MB")
+    return result, metrics
+
+
+# --- OCR engines ---
+
+class CountingOcrBackend(OcrBackend):
+    """Wraps an OCR backend and counts its inference passes (full OCR or detection calls)."""
+
+    def __init__(self, backend: OcrBackend):
+        self.backend = backend
+        self.name = backend.name
+        self.calls = 0
+
+    def ocr(self, image, cls: bool = False):
+        self.calls += 1
+        return self.backend.ocr(image, cls=cls)
+
+    def detect(self, image):
+        self.calls += 1
+        return self.backend.detect(image)
+
+    def recognize(self, crops, cls: bool):
+        return self.backend.recognize(crops, cls)
+
+
+def create_ocr_engine(kind: str, stub_latency_ms: float, profile: Optional[str] = None) -> CountingOcrBackend:
+    if kind == "stub":
+        return CountingOcrBackend(StubOcrBackend(latency_seconds=stub_latency_ms / 1000))
+    ocr_backends.OCR_BACKEND = kind
+    if not core_workers.warm_up_ocr_engine(profile):
+        error = core_workers.ocr_engine_status(profile)["error"]
+        raise SystemExit(f"OCR backend {kind} is not available ({error}); use --ocr stub.")
+    return CountingOcrBackend(core_workers.get_ocr_engine(profile))
+
+
+# --- Scenarios ---
+
+def run_video_benchmark(params: Dict[str, Any], ocr_engine, work_dir: Path, run_dir: Path,
+                        use_frame_store: bool, font_path: Optional[str],
+                        ocr_profile: Optional[str] = None) -> Dict[str, Any]:
+    video_path, info = generate_chat_video(
+        work_dir, params["duration_seconds"], params["width"], params["height"], params["fps"], font_path=font_path
+    )
+    print(f"video: {video_path.name} ({params['duration_seconds']}s {params['width']}x{params['height']}, "
+          f"{info['screens']} distinct screens)")
+    frames_dir = run_dir / "video_frames"
+    store_path = str(run_dir / FRAME_STORE_FILENAME) if use_frame_store else None
+    stages: Dict[str, Any] = {}
+
+    def extract():
+        success, message, count = extract_frames_ffmpeg_sync(
+            str(video_path), str(frames_dir), params["frame_interval"], None, None, store_path
+        )
+        if not success:
+            raise RuntimeError(message)
+        return count
+    _, stages["extract"] = run_stage("extract", extract, lambda count: count)
+
+    frame_store = FrameStore(store_path) if store_path else None
+    try:
+        ocr_filter = OcrFilter(str(frames_dir), ocr_engine, frame_store=frame_store, ocr_profile=ocr_profile)
+        kept, stages["ocr_filter"] = run_stage("ocr_filter", ocr_filter.run_filter,
+                                               lambda kept: stages["extract"]["items"], ocr_engine)
+        stages["ocr_filter"]["kept"] = len(kept)
+
+        pdf_path = run_dir / "video.pdf"
+        pdf_generator = PdfGenerator(kept, str(pdf_path), PDF_LAYOUT["images_per_row"],
+                                     PDF_LAYOUT["images_per_col"], frame_store=frame_store)
+        _, stages["pdf"] = run_stage("pdf", pdf_generator.generate_pdf, lambda result: len(kept))
+        stages["pdf"]["pdf_bytes"] = pdf_path.stat().st_size if pdf_path.exists() else 0
+    finally:
+        if frame_store:
+            frame_store.close()
+    if ocr_engine.name == "stub":
+        stages["stub_check"] = check_stub_filter(video_path, params["frame_interval"] * STUB_CHECK_INTERVAL_FACTOR,
+                                                 ocr_engine, run_dir)
+    return stages
+
+
+def check_stub_filter(video_path: Path, interval: float, ocr_engine, run_dir: Path) -> Dict[str, Any]:
+    """
+    Smoke check of the stub OCR: with frames sampled so far apart that consecutive
+    ones share no bubbles, the filter must drop frames or refine between them.
+    """
+    frames_dir = run_dir / "stub_check_frames"
+    success, message, count = extract_frames_ffmpeg_sync(str(video_path), str(frames_dir), interval)
+    if not success:
+        raise RuntimeError(message)
+    ocr_filter = OcrFilter(str(frames_dir), ocr_engine, refine_video_path=str(video_path),
+                           frame_interval_seconds=interval)
+    kept = ocr_filter.run_filter()
+    result = {"interval": interval, "frames": count, "kept": len(kept), "refined": ocr_filter.refined_frame_count}
+    result["passed"] = result["refined"] > 0 or result["kept"] < count
+    print(f"  stub check {interval:g}s interval: {count} frames, kept {len(kept)}, refined {result['refined']} "
+          f"-> {'ok' if result['passed'] else 'FAILED'}")
+    return result
+
+
+def run_long_image_benchmark(params: Dict[str, Any], work_dir: Path, run_dir: Path,
+                             font_path: Optional[str]) -> Dict[str, Any]:
+    image_path = generate_long_image(work_dir, params["width"], params["height"], font_path=font_path)
+    print(f"long image: {image_path.name} ({params['width']}x{params['height']})")
+    stages: Dict[str, Any] = {}
+    slices, stages["slice"] = run_stage(
+        "slice",
+        lambda: slice_image_sync(str(image_path), params["slice_height"], params["overlap"], str(run_dir / "slices")),
+        len,
+    )
+    pdf_path = run_dir / "long_image.pdf"
+    pdf_generator = PdfGenerator(slices, str(pdf_path), PDF_LAYOUT["images_per_row"], PDF_LAYOUT["images_per_col"])
+    _, stages["pdf"] = run_stage("pdf", pdf_generator.generate_pdf, lambda result: len(slices))
+    stages["pdf"]["pdf_bytes"] = pdf_path.stat().st_size if pdf_path.exists() else 0
+    return stages
+
+
+# --- Baseline comparison ---
+
+def compare_with_baseline(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Returns one message per metric that is worse than the baseline by more than tolerance."""
+    regressions = []
+    for scenario, pipelines in results["scenarios"].items():
+        for pipeline, stages in pipelines.items():
+            for stage, metrics in stages.items():
+                expected = baseline.get("scenarios", {}).get(scenario, {}).get(pipeline, {}).get(stage, {})
+                for metric, higher_is_better in METRIC_DIRECTIONS.items():
+                    current, reference = metrics.get(metric), expected.get(metric)
+                    if current is None or not reference:
+                        continue
+                    allowed = 0.0 if metric in EXACT_METRICS else tolerance
+                    change = (current - reference) / reference
+                    worse = -change if higher_is_better else change
+                    if worse > allowed:
+                        regressions.append(f"{scenario}/{pipeline}/{stage} {metric}: {reference} -> {current} "
+                                           f"({change:+.1%})")
+    return regressions
+
+
+def _environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": core_workers.FFMPEG_PATH,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Chat evidence tool pipeline benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: smoke)")
+    parser.add_argument("--pipeline", choices=("all", "video", "long_image"), default="all")
+    parser.add_argument("--ocr", choices=ocr_backends.OCR_BACKENDS, default="stub")
+    parser.add_argument("--ocr-profile", choices=sorted(core_workers.OCR_PROFILES),
+                        help="OCR speed profile (default: the OCR_PROFILE env setting)")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0, help="Simulated inference time per stub OCR call")
+    parser.add_argument("--frame-store", action="store_true", help="Extract video frames into the single-file frame store")
+    parser.add_argument("--font", help="TrueType font for the synthetic chat text")
+    parser.add_argument("--work-dir", type=Path, default=DEFAULT_WORK_DIR, help="Cache for generated inputs")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown before flagging")
+    parser.add_argument("--output", type=Path, help="Also write the results JSON to this file")
+    args = parser.parse_args(argv)
+
+    ocr_engine = create_ocr_engine(args.ocr, args.stub_latency_ms, args.ocr_profile)
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    results: Dict[str, Any] = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": _environment(),
+        "options": {"ocr": args.ocr, "ocr_profile": core_workers.resolve_ocr_profile(args.ocr_profile),
+                    "stub_latency_ms": args.stub_latency_ms, "frame_store": args.frame_store},
+        "scenarios": {},
+    }
+    for scenario in args.scenario or ["smoke"]:
+        print(f"== scenario {scenario} ==")
+        pipelines: Dict[str, Any] = {}
+        run_dir = Path(tempfile.mkdtemp(prefix=f"run_{scenario}_", dir=args.work_dir))
+        try:
+            if args.pipeline in ("all", "video"):
+                pipelines["video"] = run_video_benchmark(SCENARIOS[scenario]["video"], ocr_engine, args.work_dir,
+                                                         run_dir, args.frame_store, args.font, args.ocr_profile)
+            if args.pipeline in ("all", "long_image"):
+                pipelines["long_image"] = run_long_image_benchmark(SCENARIOS[scenario]["long_image"], args.work_dir,
+                                                                   run_dir, args.font)
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+        results["scenarios"][scenario] = pipelines
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    failed_checks = [scenario for scenario, pipelines in results["scenarios"].items()
+                     if not pipelines.get("video", {}).get("stub_check", {}).get("passed", True)]
+    if failed_checks:
+        print(f"Stub OCR check failed in {', '.join(failed_checks)}: a coarse interval neither dropped nor "
+              f"refined frames, so the filter is not exercised.")
+        return 1
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    if baseline.get("options") != results["options"]:
+        print(f"Note: baseline was recorded with {baseline.get('options')}, this run used {results['options']}.")
+    regressions = compare_with_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} regression(s) against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+# benchmarks/synthetic.py
+"""
+Deterministic synthetic inputs for the pipeline benchmarks.
+
+A chat transcript of alternating left/right text bubbles is rendered from a
+seeded random generator onto one tall canvas.  From that canvas we derive:
+
+* a long screenshot (the canvas itself, saved as PNG);
+* a screen recording that scrolls through the canvas in "scroll, then hold"
+  steps, like a person paging through a chat, encoded with the local FFmpeg
+  from raw RGB frames piped to stdin.
+
+The same parameters always produce the same pixels, so timings from
+different commits are comparable.  Generated files are cached by parameter
+hash and reused between runs.
+"""
+import hashlib
+import json
+import random
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage, ImageDraw, ImageFont
+
+from backend.core_workers import FFMPEG_PATH
+
+BACKGROUND_COLOR = (237, 237, 237)
+LEFT_BUBBLE_COLOR = (255, 255, 255)
+RIGHT_BUBBLE_COLOR = (149, 236, 105)
+TEXT_COLOR = (20, 20, 20)
+
+WORDS = (
+    "ok sure meeting tomorrow at the office please send the contract again "
+    "payment invoice received thanks call me when you arrive deposit transfer "
+    "bank account number address delivery confirmed price discount order "
+    "refund screenshot evidence agreed yesterday morning afternoon evening"
+).split()
+
+
+def _load_font(size: int, font_path: Optional[str] = None) -> ImageFont.ImageFont:
+    if font_path:
+        return ImageFont.truetype(font_path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 has no scalable default font
+        return ImageFont.load_default()
+
+
+def _wrap_words(words: List[str], font: ImageFont.ImageFont, max_width: int) -> List[str]:
+    lines, current = [], ""
+    for word in words:
+        candidate = f"{current} {word}".strip()
+        if current and font.getlength(candidate) > max_width:
+            lines.append(current)
+            current = word
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+
+def render_chat_canvas(width: int, height: int, seed: int = 0, font_size: Optional[int] = None,
+                       font_path: Optional[str] = None) -> PILImage.Image:
+    """Renders a chat transcript of at least the given height (RGB)."""
+    rng = random.Random(seed)
+    font_size = font_size or max(14, width // 26)
+    font = _load_font(font_size, font_path)
+    line_height = int(font_size * 1.4)
+    margin = width // 24
+    padding = font_size // 2
+    max_text_width = int(width * 0.62)
+
+    canvas = PILImage.new("RGB", (width, height), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(canvas)
+    y = margin
+    index = 0
+    while y < height:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 28))]
+        lines = _wrap_words([f"#{index}"] + words, font, max_text_width)  # Numbered so every bubble is unique
+        text_width = max(int(font.getlength(line)) for line in lines)
+        bubble_w = text_width + 2 * padding
+        bubble_h = len(lines) * line_height + 2 * padding
+        outgoing = rng.random() < 0.45
+        x = width - margin - bubble_w if outgoing else margin
+        draw.rounded_rectangle((x, y, x + bubble_w, y + bubble_h), radius=padding,
+                               fill=RIGHT_BUBBLE_COLOR if outgoing else LEFT_BUBBLE_COLOR)
+        for line_no, line in enumerate(lines):
+            draw.text((x + padding, y + padding + line_no * line_height), line, fill=TEXT_COLOR, font=font)
+        y += bubble_h + rng.randint(margin // 2, margin * 2)
+        index += 1
+    return canvas
+
+
+def scroll_offsets(duration_seconds: float, fps: int, viewport_height: int,
+                   scroll_seconds: float = 0.8, hold_seconds: float = 1.2,
+                   page_ratio: float = 0.6) -> List[int]:
+    """Canvas offset of every video frame: scroll page_ratio of a screen, hold, repeat."""
+    cycle = scroll_seconds + hold_seconds
+    page = viewport_height * page_ratio
+    offsets = []
+    for frame in range(int(duration_seconds * fps)):
+        t = frame / fps
+        cycles, within = divmod(t, cycle)
+        progress = min(1.0, within / scroll_seconds) if scroll_seconds > 0 else 1.0
+        progress = 0.5 - 0.5 * np.cos(np.pi * progress)  # Ease in/out like a finger swipe
+        offsets.append(int(round((cycles + progress) * page)))
+    return offsets
+
+
+def _cache_path(work_dir: Path, kind: str, params: Dict[str, Any], suffix: str) -> Path:
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+    return work_dir / f"{kind}_{digest}{suffix}"
+
+
+def generate_long_image(work_dir: Path, width: int = 1080, height: int = 20000, seed: int = 0,
+                        font_path: Optional[str] = None) -> Path:
+    """Writes (or reuses) a synthetic long chat screenshot and returns its path."""
+    params = {"width": width, "height": height, "seed": seed, "font": font_path}
+    path = _cache_path(work_dir, "long_image", params, ".png")
+    if not path.exists():
+        work_dir.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.png")
+        render_chat_canvas(width, height, seed, font_path=font_path).save(tmp, compress_level=1)
+        tmp.replace(path)
+    return path
+
+
+def generate_chat_video(work_dir: Path, duration_seconds: float = 60, width: int = 720, height: int = 1280,
+                        fps: int = 30, seed: int = 0, codec: str = "libx264",
+                        font_path: Optional[str] = None) -> Tuple[Path, Dict[str, Any]]:
+    """
+    Writes (or reuses) a synthetic scrolling-chat screen recording.
+
+    Returns (video path, info) where info holds the frame count and the
+    number of distinct screens (hold positions) in the recording.
+    """
+    params = {"duration": duration_seconds, "width": width, "height": height, "fps": fps,
+              "seed": seed, "codec": codec, "font": font_path}
+    path = _cache_path(work_dir, "chat_video", params, ".mp4")
+    offsets = scroll_offsets(duration_seconds, fps, height)
+    info = {"frames": len(offsets), "screens": len(set(offsets)) if offsets else 0,
+            "scroll_height": (max(offsets) if offsets else 0) + height}
+    if path.exists():
+        return path, info
+
+    work_dir.mkdir(parents=True, exist_ok=True)
+    canvas = np.asarray(render_chat_canvas(width, info["scroll_height"], seed, font_path=font_path))
+    tmp = path.with_suffix(".tmp.mp4")
+    cmd = [
+        FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-",
+        "-c:v", codec, "-pix_fmt", "yuv420p", str(tmp),
+    ]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        for offset in offsets:
+            process.stdin.write(canvas[offset:offset + height].tobytes())
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+    stderr = process.stderr.read().decode(errors="replace")
+    if process.wait() != 0:
+        tmp.unlink(missing_ok=True)
+        raise RuntimeError(f"FFmpeg failed to encode the synthetic video: {stderr.strip()}")
+    tmp.replace(path)
+    return path, info
@@ -4,12 +4,18 @@ document.addEventListener("DOMContentLoaded", () => {
   const videoFileInput = document.getElementById("videoFile");
   const uploadVideoButton = document.getElementById("uploadVideoButton"); // 确认HTML中的ID
   const frameIntervalInput = document.getElementById("frameInterval");
+  const useFrameStoreCheckbox = document.getElementById("useFrameStore");
+  const adaptiveSamplingCheckbox = document.getElementById("adaptiveSampling");
+  const ocrProfileSelect = document.getElementById("ocrProfile");
+  const boundaryOcrCheckbox = document.getElementById("boundaryOcr");
+  const videoEnableTraceCheckbox = document.getElementById("videoEnableTrace");
   const exclusionListInput = document.getElementById("exclusionList");
   const loadRefFrameButton = document.getElementById("loadRefFrameButton");
   const clearOcrRegionButton = document.getElementById("clearOcrRegionButton");
   const ocrCropContainer = document.getElementById("ocrCropContainer");
   const refImageElement = document.getElementById("refImage");
   const ocrCoordsP = document.getElementById("ocrCoords");
+  const autoOcrRegionCheckbox = document.getElementById("autoOcrRegion");
   const pdfRowsVideoInput = document.getElementById("pdfRowsVideo");
   const pdfColsVideoInput = document.getElementById("pdfColsVideo");
   const pdfLayoutVideoSelect = document.getElementById("pdfLayoutVideo");
@@ -21,19 +27,27 @@ document.addEventListener("DOMContentLoaded", () => {
   const videoProgressBar = document.getElementById("videoProgressBar");
   const videoProgressStatus = document.getElementById("videoProgressStatus");
   const videoLogOutput = document.getElementById("videoLogOutput");
+  const videoLogLevelSelect = document.getElementById("videoLogLevel");
   const videoPreviewArea = document.getElementById("videoPreviewArea");
   const videoDownloadPdfButton = document.getElementById(
     "videoDownloadPdfButton"
   );
   const videoCleanupButton = document.getElementById("videoCleanupButton");
+  const videoCancelButton = document.getElementById("videoCancelButton");
 
   const longImageFileInput = document.getElementById("longImageFile");
   const sliceHeightInput = document.getElementById("sliceHeight");
   const overlapHeightInput = document.getElementById("overlapHeight");
+  const sliceModeSelect = document.getElementById("sliceMode");
+  const sliceFormatSelect = document.getElementById("sliceFormat");
   const pdfRowsLongInput = document.getElementById("pdfRowsLong");
   const pdfColsLongInput = document.getElementById("pdfColsLong");
   const pdfLayoutLongSelect = document.getElementById("pdfLayoutLong");
   const pdfTitleLongInput = document.getElementById("pdfTitleLong");
+  const pdfEmbedModeLongSelect = document.getElementById("pdfEmbedModeLong");
+  const longImageEnableTraceCheckbox = document.getElementById(
+    "longImageEnableTrace"
+  );
   const processLongImageButton = document.getElementById(
     "processLongImageButton"
   );
@@ -45,6 +59,7 @@ document.addEventListener("DOMContentLoaded", () => {
     "longImageProgressStatus"
   );
   const longImageLogOutput = document.getElementById("longImageLogOutput");
+  const longImageLogLevelSelect = document.getElementById("longImageLogLevel");
   const longImagePreviewArea = document.getElementById("longImagePreviewArea");
   const longImageDownloadPdfButton = document.getElementById(
     "longImageDownloadPdfButton"
@@ -52,6 +67,9 @@ document.addEventListener("DOMContentLoaded", () => {
   const longImageCleanupButton = document.getElementById(
     "longImageCleanupButton"
   );
+  const longImageCancelButton = document.getElementById(
+    "longImageCancelButton"
+  );
   const lightbox = document.getElementById("imageLightbox");
   const lightboxImg = document.getElementById("lightboxImg");
   const lightboxCaption = document.getElementById("lightboxCaption");
@@ -66,6 +84,9 @@ document.addEventListener("DOMContentLoaded", () => {
   let videoSortable = null;
   let longImageSortable = null;
   let activeSessionId = null; // Store the session ID of the currently active WS connection
+  const lastSeqBySession = {}; // session_id -> 最近收到的事件序号，用于断线重连后续传
+  let wsReconnectAttempts = 0;
+  const WS_MAX_RECONNECT_ATTEMPTS = 5;
 
   function addLog(message, type = "info", taskType = activeTaskType) {
     const targetLog =
@@ -82,6 +103,32 @@ document.addEventListener("DOMContentLoaded", () => {
     targetLog.scrollTop = targetLog.scrollHeight;
   }
 
+  // 服务端日志级别 (debug/info/warn) 对应的日志样式
+  const LOG_LEVEL_CLASSES = { debug: "debug", info: "info", warn: "warning" };
+
+  function getLogLevel(taskType) {
+    const select =
+      taskType === "video" ? videoLogLevelSelect : longImageLogLevelSelect;
+    return select?.value || "info";
+  }
+
+  [
+    [videoLogLevelSelect, "video"],
+    [longImageLogLevelSelect, "longImage"],
+  ].forEach(([select, taskType]) => {
+    select?.addEventListener("change", () => {
+      if (
+        activeWebSocket &&
+        activeWebSocket.readyState === WebSocket.OPEN &&
+        activeTaskType === taskType
+      ) {
+        activeWebSocket.send(
+          JSON.stringify({ type: "set_level", level: select.value })
+        );
+      }
+    });
+  });
+
   function updateProgress(
     percentage,
     statusText = "",
@@ -139,6 +186,7 @@ document.addEventListener("DOMContentLoaded", () => {
       videoDownloadPdfButton.href = "#";
     }
     if (videoCleanupButton) videoCleanupButton.disabled = true;
+    if (videoCancelButton) videoCancelButton.disabled = true;
     if (videoLogOutput) videoLogOutput.innerHTML = "";
     if (videoPreviewArea) videoPreviewArea.innerHTML = "";
     if (ocrCropContainer) ocrCropContainer.style.display = "none";
@@ -175,6 +223,7 @@ document.addEventListener("DOMContentLoaded", () => {
       longImageDownloadPdfButton.href = "#";
     }
     if (longImageCleanupButton) longImageCleanupButton.disabled = true;
+    if (longImageCancelButton) longImageCancelButton.disabled = true;
     if (longImageLogOutput) longImageLogOutput.innerHTML = "";
     if (longImagePreviewArea) longImagePreviewArea.innerHTML = "";
     if (longImageProgressBarContainer)
@@ -396,6 +445,7 @@ document.addEventListener("DOMContentLoaded", () => {
                   ocrSelection
                 );
               }
+              presetDetectedOcrRegion();
             },
             cropend() {
               // 当用户停止拖动裁剪框时触发 (这是我们主要更新选区的地方)
@@ -448,6 +498,35 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // 请求后端自动检测的聊天内容区域，并作为裁剪框的初始位置供用户确认或调整
+  async function presetDetectedOcrRegion() {
+    if (!cropper || !videoSessionId) return;
+    try {
+      const response = await fetch(`/detect_ocr_region/${videoSessionId}`);
+      if (!response.ok) return;
+      const data = await response.json();
+      if (!data.rect || !cropper) {
+        addLog(data.message || "未检测到聊天内容区域。", "info", "video");
+        return;
+      }
+      const [x, y, width, height] = data.rect;
+      cropper.setData({ x, y, width, height });
+      const cropData = cropper.getData(true);
+      ocrSelection = {
+        x: cropData.x,
+        y: cropData.y,
+        width: cropData.width,
+        height: cropData.height,
+      };
+      if (ocrCoordsP) {
+        ocrCoordsP.textContent = `选区 (自动检测): X=${ocrSelection.x}, Y=${ocrSelection.y}, W=${ocrSelection.width}, H=${ocrSelection.height}`;
+      }
+      addLog("已自动框选聊天内容区域，请确认或拖动调整。", "success", "video");
+    } catch (error) {
+      console.warn("Automatic OCR region detection failed:", error);
+    }
+  }
+
   if (clearOcrRegionButton && ocrCoordsP) {
     clearOcrRegionButton.addEventListener("click", () => {
       if (cropper) {
@@ -480,6 +559,7 @@ document.addEventListener("DOMContentLoaded", () => {
             .split("\n")
             .map((s) => s.trim())
             .filter((s) => s) || [],
+        auto_ocr_region: autoOcrRegionCheckbox?.checked || false,
         ocr_analysis_rect: ocrSelection
           ? [
               ocrSelection.x,
@@ -493,6 +573,11 @@ document.addEventListener("DOMContentLoaded", () => {
         pdf_title: pdfTitleVideoInput?.value || "聊天记录证据",
         pdf_layout: pdfLayoutVideoSelect?.value || "grid",
         image_order: getVideoPreviewImageOrder(),
+        adaptive_sampling: adaptiveSamplingCheckbox?.checked || false,
+        use_frame_store: useFrameStoreCheckbox?.checked || false,
+        ocr_profile: ocrProfileSelect?.value || null,
+        boundary_ocr: boundaryOcrCheckbox?.checked || false,
+        enable_trace: videoEnableTraceCheckbox?.checked || false,
       };
       console.log("Processing video with settings:", settings);
 
@@ -505,6 +590,7 @@ document.addEventListener("DOMContentLoaded", () => {
         const data = await response.json();
         if (response.ok) {
           addLog(data.message || "处理已启动...", "success", "video");
+          if (videoCancelButton) videoCancelButton.disabled = false;
         } else {
           addLog(
             `启动处理失败: ${
@@ -522,6 +608,43 @@ document.addEventListener("DOMContentLoaded", () => {
     });
   }
 
+  // 取消正在运行的任务；服务端会终止 FFmpeg 并停止 OCR/PDF 处理，结果通过 WebSocket 的 "cancelled" 状态返回
+  async function cancelJob(sessionId, taskType, cancelButton) {
+    if (!sessionId) {
+      addLog("没有可取消的任务。", "warning", taskType);
+      return;
+    }
+    cancelButton.disabled = true;
+    addLog("正在请求取消任务...", "info", taskType);
+    try {
+      const response = await fetch(`/cancel_job/${sessionId}`, {
+        method: "POST",
+      });
+      const data = await response.json();
+      if (response.ok) {
+        addLog(data.message, "info", taskType);
+      } else {
+        addLog(`取消失败: ${data.detail || data.message}`, "error", taskType);
+        cancelButton.disabled = false;
+      }
+    } catch (error) {
+      addLog(`取消出错: ${error}`, "error", taskType);
+      cancelButton.disabled = false;
+    }
+  }
+
+  if (videoCancelButton) {
+    videoCancelButton.addEventListener("click", () =>
+      cancelJob(videoSessionId, "video", videoCancelButton)
+    );
+  }
+
+  if (longImageCancelButton) {
+    longImageCancelButton.addEventListener("click", () =>
+      cancelJob(longImageSessionId, "longImage", longImageCancelButton)
+    );
+  }
+
   if (videoCleanupButton) {
     videoCleanupButton.addEventListener("click", async () => {
       if (!videoSessionId) {
@@ -572,7 +695,13 @@ document.addEventListener("DOMContentLoaded", () => {
     longImageFileInput.addEventListener("change", () => {
       processLongImageButton.disabled =
         !longImageFileInput.files || longImageFileInput.files.length === 0;
-      if (longImageFileInput.files && longImageFileInput.files.length > 0) {
+      if (longImageFileInput.files && longImageFileInput.files.length > 1) {
+        addLog(
+          `已选择 ${longImageFileInput.files.length} 张截图，将按文件名顺序拼接为一张长截图。`,
+          "info",
+          "longImage"
+        );
+      } else if (longImageFileInput.files && longImageFileInput.files.length > 0) {
         addLog(
           `已选择长截图: ${longImageFileInput.files[0].name}`,
           "info",
@@ -586,8 +715,11 @@ document.addEventListener("DOMContentLoaded", () => {
 
   if (processLongImageButton) {
     processLongImageButton.addEventListener("click", async () => {
-      const fileToUpload = longImageFileInput?.files[0];
-      if (!fileToUpload) {
+      // Several screenshots are stitched in scroll order, taken from the file names
+      const filesToUpload = Array.from(longImageFileInput?.files || []).sort(
+        (a, b) => a.name.localeCompare(b.name, undefined, { numeric: true })
+      );
+      if (filesToUpload.length === 0) {
         addLog("请选择长截图文件。", "error", "longImage");
         return;
       }
@@ -597,13 +729,23 @@ document.addEventListener("DOMContentLoaded", () => {
       addLog("开始处理长截图...", "info", "longImage");
 
       const formData = new FormData();
-      formData.append("long_image_file", fileToUpload);
+      filesToUpload.forEach((file) => formData.append("long_image_file", file));
       formData.append("slice_height", sliceHeightInput?.value || "1000");
       formData.append("overlap", overlapHeightInput?.value || "100");
+      formData.append("slice_mode", sliceModeSelect?.value || "fixed");
+      formData.append("slice_format", sliceFormatSelect?.value || "auto");
       formData.append("pdf_rows", pdfRowsLongInput?.value || "3");
       formData.append("pdf_cols", pdfColsLongInput?.value || "1"); // Default to 1 col for long images usually
       formData.append("pdf_title", pdfTitleLongInput?.value || "长截图证据");
       formData.append("pdf_layout", pdfLayoutLongSelect?.value || "column"); // 'column' for long image default
+      formData.append(
+        "pdf_embed_mode",
+        pdfEmbedModeLongSelect?.value || "slices"
+      );
+      formData.append(
+        "enable_trace",
+        longImageEnableTraceCheckbox?.checked ? "true" : "false"
+      );
 
       // For long images, image_order is usually determined by slicing order,
       // but if you implement reordering for sliced previews, you'd get it here.
@@ -624,6 +766,7 @@ document.addEventListener("DOMContentLoaded", () => {
           );
           connectWebSocket(longImageSessionId, "longImage");
           if (longImageCleanupButton) longImageCleanupButton.disabled = false;
+          if (longImageCancelButton) longImageCancelButton.disabled = false;
         } else {
           addLog(
             `启动处理失败: ${data.message || response.statusText}`,
@@ -727,7 +870,9 @@ document.addEventListener("DOMContentLoaded", () => {
     activeSessionId = sessionId; // 更新活动会话ID
 
     const wsProtocol = window.location.protocol === "https:" ? "wss:" : "ws:";
-    const wsUrl = `${wsProtocol}//${window.location.host}/ws/${sessionId}`;
+    const wsUrl = `${wsProtocol}//${window.location.host}/ws/${sessionId}?level=${getLogLevel(
+      taskTypeOfOrigin
+    )}&last_seq=${lastSeqBySession[sessionId] || 0}`;
     addLog(
       `正在连接 WebSocket (${taskTypeOfOrigin}): ${wsUrl}`,
       "info",
@@ -737,158 +882,191 @@ document.addEventListener("DOMContentLoaded", () => {
     activeWebSocket = new WebSocket(wsUrl);
 
     activeWebSocket.onopen = () => {
+      wsReconnectAttempts = 0;
       addLog("WebSocket 连接成功。", "success", taskTypeOfOrigin);
     };
 
     activeWebSocket.onmessage = (event) => {
       try {
-        const data = JSON.parse(event.data);
-        let messageTaskType = "unknown"; // Determine task type from message's session_id
-
-        if (data.session_id === videoSessionId) messageTaskType = "video";
-        else if (data.session_id === longImageSessionId)
-          messageTaskType = "longImage";
-        else {
-          // If session_id in message doesn't match known ones,
-          // assume it's for the task type that initiated this WebSocket.
-          messageTaskType =
-            activeWebSocket && activeWebSocket.url.includes(videoSessionId)
-              ? "video"
-              : activeWebSocket &&
-                activeWebSocket.url.includes(longImageSessionId)
-              ? "longImage"
-              : activeTaskType; // Fallback
-          console.warn(
-            "WS message session_id doesn't match current known session IDs. Using task type:",
-            messageTaskType,
-            data
-          );
-        }
+        // 服务端按批次发送状态数组 (每 ~200ms 一批)
+        const parsed = JSON.parse(event.data);
+        (Array.isArray(parsed) ? parsed : [parsed]).forEach(handleStatusMessage);
+      } catch (e) {
+        console.error(
+          "Failed to parse WebSocket message or update UI:",
+          e,
+          event.data
+        );
+        addLog("接收到无效的 WebSocket 消息。", "error", activeTaskType);
+      }
+    };
 
-        // Get target UI elements based on messageTaskType
-        const targetLog =
-          messageTaskType === "video" ? videoLogOutput : longImageLogOutput;
-        const targetPreviewArea =
-          messageTaskType === "video" ? videoPreviewArea : longImagePreviewArea;
-        const targetDownloadButton =
-          messageTaskType === "video"
-            ? videoDownloadPdfButton
-            : longImageDownloadPdfButton;
-        const targetProcessButton =
-          messageTaskType === "video"
-            ? processVideoButton
-            : processLongImageButton;
-        const targetCleanupButton =
-          messageTaskType === "video"
-            ? videoCleanupButton
-            : longImageCleanupButton;
+    function handleStatusMessage(data) {
+      if (data.seq) lastSeqBySession[data.session_id || sessionId] = data.seq;
+      let messageTaskType = "unknown"; // Determine task type from message's session_id
+
+      if (data.session_id === videoSessionId) messageTaskType = "video";
+      else if (data.session_id === longImageSessionId)
+        messageTaskType = "longImage";
+      else {
+        // If session_id in message doesn't match known ones,
+        // assume it's for the task type that initiated this WebSocket.
+        messageTaskType =
+          activeWebSocket && activeWebSocket.url.includes(videoSessionId)
+            ? "video"
+            : activeWebSocket &&
+              activeWebSocket.url.includes(longImageSessionId)
+            ? "longImage"
+            : activeTaskType; // Fallback
+        console.warn(
+          "WS message session_id doesn't match current known session IDs. Using task type:",
+          messageTaskType,
+          data
+        );
+      }
 
-        if (!targetLog) {
-          // Should not happen if IDs are correct
-          console.error("Could not determine target log for WS message:", data);
-          return;
-        }
+      // Get target UI elements based on messageTaskType
+      const targetLog =
+        messageTaskType === "video" ? videoLogOutput : longImageLogOutput;
+      const targetPreviewArea =
+        messageTaskType === "video" ? videoPreviewArea : longImagePreviewArea;
+      const targetDownloadButton =
+        messageTaskType === "video"
+          ? videoDownloadPdfButton
+          : longImageDownloadPdfButton;
+      const targetProcessButton =
+        messageTaskType === "video"
+          ? processVideoButton
+          : processLongImageButton;
+      const targetCleanupButton =
+        messageTaskType === "video"
+          ? videoCleanupButton
+          : longImageCleanupButton;
+      const targetCancelButton =
+        messageTaskType === "video" ? videoCancelButton : longImageCancelButton;
+
+      if (!targetLog) {
+        // Should not happen if IDs are correct
+        console.error("Could not determine target log for WS message:", data);
+        return;
+      }
 
-        addLog(`[WS] ${data.status}: ${data.message}`, "info", messageTaskType);
+      addLog(
+        `[WS] ${data.status}: ${data.message}`,
+        LOG_LEVEL_CLASSES[data.level] || "info",
+        messageTaskType
+      );
 
-        if (data.progress !== null && data.progress !== undefined) {
-          updateProgress(
-            data.progress,
-            `${data.status}: ${data.message}`,
-            messageTaskType
-          );
-        } else if (
-          [
-            "extracting_frames",
-            "ocr_processing",
-            "pdf_generating",
-            "slicing",
-          ].some((s) => data.status.includes(s))
-        ) {
-          const progressBarForType =
-            messageTaskType === "video"
-              ? videoProgressBar
-              : longImageProgressBar;
-          const currentProgress =
-            progressBarForType?.getAttribute("aria-valuenow") || 0;
-          updateProgress(
-            currentProgress,
-            `${data.status}: ${data.message}`,
-            messageTaskType
-          );
-        }
+      if (data.progress !== null && data.progress !== undefined) {
+        updateProgress(
+          data.progress,
+          `${data.status}: ${data.message}`,
+          messageTaskType
+        );
+      } else if (
+        [
+          "extracting_frames",
+          "ocr_processing",
+          "pdf_generating",
+          "slicing",
+        ].some((s) => data.status.includes(s))
+      ) {
+        const progressBarForType =
+          messageTaskType === "video"
+            ? videoProgressBar
+            : longImageProgressBar;
+        const currentProgress =
+          progressBarForType?.getAttribute("aria-valuenow") || 0;
+        updateProgress(
+          currentProgress,
+          `${data.status}: ${data.message}`,
+          messageTaskType
+        );
+      }
 
-        if (
-          (data.status === "ocr_completed" ||
-            data.status === "preview_ready" ||
-            data.status === "slicing_complete") &&
-          data.preview_images
-        ) {
-          if (targetPreviewArea) {
-            targetPreviewArea.innerHTML = "";
-            data.preview_images.forEach((imgUrl) => {
-              const colDiv = document.createElement("div");
-              colDiv.className = "col-6 col-sm-4 col-md-3 preview-item";
-              const img = document.createElement("img");
-              img.src = imgUrl; // Backend now provides full, correct URLs
-              img.className = "img-fluid rounded preview-image";
-              img.alt = "预览";
-              img.style.cursor = "pointer";
-              img.title = "双击预览";
-              img.addEventListener('click', function() {
-                openLightbox(this.src, this.alt); // Pass src and alt (or filename)
-            });
-              colDiv.appendChild(img);
-              targetPreviewArea.appendChild(colDiv);
-            });
-            if (data.preview_images.length > 0) {
-              setupSortable(targetPreviewArea);
-            }
+      if (
+        (data.status === "ocr_completed" ||
+          data.status === "preview_ready" ||
+          data.status === "slicing_complete") &&
+        data.preview_images
+      ) {
+        if (targetPreviewArea) {
+          targetPreviewArea.innerHTML = "";
+          data.preview_images.forEach((imgUrl) => {
+            const colDiv = document.createElement("div");
+            colDiv.className = "col-6 col-sm-4 col-md-3 preview-item";
+            const img = document.createElement("img");
+            img.src = imgUrl; // Backend now provides full, correct URLs
+            img.className = "img-fluid rounded preview-image";
+            img.alt = "预览";
+            img.style.cursor = "pointer";
+            img.title = "双击预览";
+            img.addEventListener('click', function() {
+              openLightbox(this.src, this.alt); // Pass src and alt (or filename)
+          });
+            colDiv.appendChild(img);
+            targetPreviewArea.appendChild(colDiv);
+          });
+          if (data.preview_images.length > 0) {
+            setupSortable(targetPreviewArea);
           }
         }
+      }
 
-        const isCompleted = data.status === "completed";
-        const isCompletedNoPdf = data.status === "completed_no_pdf";
-        const isError = data.status === "error";
+      if (data.status === "trace_ready" && data.result_url) {
+        // 性能追踪文件: 在日志中附上下载链接
+        const traceLink = document.createElement("a");
+        traceLink.href = data.result_url;
+        traceLink.textContent = "下载性能追踪 (trace.json)";
+        traceLink.setAttribute("download", "");
+        const traceEntry = document.createElement("div");
+        traceEntry.className = "log-entry log-success";
+        traceEntry.appendChild(traceLink);
+        targetLog.appendChild(traceEntry);
+        targetLog.scrollTop = targetLog.scrollHeight;
+      }
 
-        if (isCompleted && data.result_url) {
-          if (targetDownloadButton) {
-            targetDownloadButton.href = data.result_url;
-            targetDownloadButton.classList.remove("disabled");
-          }
-          addLog(`PDF准备就绪，请在下方点击下载`, "success", messageTaskType);
-          updateProgress(100, "全部完成！", messageTaskType);
-        } else if (isCompletedNoPdf) {
-          addLog("处理完成，无PDF。", "info", messageTaskType);
-          updateProgress(100, "处理完成，无PDF。", messageTaskType);
-        } else if (isError) {
-          addLog(`处理错误: ${data.message}`, "error", messageTaskType);
-          const progressBarForError =
-            messageTaskType === "video"
-              ? videoProgressBar
-              : longImageProgressBar;
-          const currentProgressOnError =
-            progressBarForError?.getAttribute("aria-valuenow") || 0;
-          updateProgress(
-            currentProgressOnError,
-            `错误: ${data.message}`,
-            messageTaskType
-          );
-        }
+      const isCompleted = data.status === "completed";
+      const isCompletedNoPdf = data.status === "completed_no_pdf";
+      const isError = data.status === "error";
+      const isCancelled = data.status === "cancelled";
 
-        if (isCompleted || isCompletedNoPdf || isError) {
-          if (targetProcessButton) targetProcessButton.disabled = false;
-          if (targetCleanupButton) targetCleanupButton.disabled = false;
+      if (isCompleted && data.result_url) {
+        if (targetDownloadButton) {
+          targetDownloadButton.href = data.result_url;
+          targetDownloadButton.classList.remove("disabled");
         }
-      } catch (e) {
-        console.error(
-          "Failed to parse WebSocket message or update UI:",
-          e,
-          event.data
+        addLog(`PDF准备就绪，请在下方点击下载`, "success", messageTaskType);
+        updateProgress(100, "全部完成！", messageTaskType);
+      } else if (isCompletedNoPdf) {
+        addLog("处理完成，无PDF。", "info", messageTaskType);
+        updateProgress(100, "处理完成，无PDF。", messageTaskType);
+      } else if (isError) {
+        addLog(`处理错误: ${data.message}`, "error", messageTaskType);
+        const progressBarForError =
+          messageTaskType === "video"
+            ? videoProgressBar
+            : longImageProgressBar;
+        const currentProgressOnError =
+          progressBarForError?.getAttribute("aria-valuenow") || 0;
+        updateProgress(
+          currentProgressOnError,
+          `错误: ${data.message}`,
+          messageTaskType
         );
-        addLog("接收到无效的 WebSocket 消息。", "error", activeTaskType);
       }
-    };
+
+      if (isCancelled) {
+        addLog("任务已取消。", "warning", messageTaskType);
+        updateProgress(0, "已取消", messageTaskType);
+      }
+
+      if (isCompleted || isCompletedNoPdf || isError || isCancelled) {
+        if (targetProcessButton) targetProcessButton.disabled = false;
+        if (targetCleanupButton) targetCleanupButton.disabled = false;
+        if (targetCancelButton) targetCancelButton.disabled = true;
+      }
+    }
 
     activeWebSocket.onclose = (event) => {
       let taskTypeForLog = "unknown"; // Determine task type from the closing socket's associated session ID
@@ -911,6 +1089,31 @@ document.addEventListener("DOMContentLoaded", () => {
         taskTypeForLog === "unknown" ? activeTaskType : taskTypeForLog
       );
 
+      const sessionStillCurrent =
+        (taskTypeOfOrigin === "video" && videoSessionId === sessionId) ||
+        (taskTypeOfOrigin === "longImage" && longImageSessionId === sessionId);
+      if (
+        event.code !== 1000 &&
+        sessionStillCurrent &&
+        (activeWebSocket === event.target || activeWebSocket === null) &&
+        wsReconnectAttempts < WS_MAX_RECONNECT_ATTEMPTS
+      ) {
+        // 非正常断开: 带上最近的事件序号重连，服务端会补发错过的状态
+        wsReconnectAttempts += 1;
+        const delayMs = 1000 * 2 ** (wsReconnectAttempts - 1);
+        addLog(
+          `WebSocket 将在 ${delayMs / 1000} 秒后重连 (第 ${wsReconnectAttempts} 次)...`,
+          "warning",
+          taskTypeOfOrigin
+        );
+        activeWebSocket = null;
+        activeSessionId = null;
+        setTimeout(() => {
+          if (!activeWebSocket) connectWebSocket(sessionId, taskTypeOfOrigin);
+        }, delayMs);
+        return;
+      }
+
       if (event.code !== 1000) {
         // 1000 is normal closure
         if (taskTypeForLog === "video" && processVideoButton)
@@ -1,6 +1,7 @@
-def main():
-    print("Hello from chat-evidence-tool-web!")
+import sys
+
+from backend.cli import main
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())